@@ -35,6 +35,7 @@ function Teacher({ token, role, updateLatestToken }) {
       subject: 'General',
       requestId: '',
       isPolling: false,
+      streamedQuestions: [],
     };
   };
 
@@ -54,6 +55,7 @@ function Teacher({ token, role, updateLatestToken }) {
     subject,
     requestId,
     isPolling,
+    streamedQuestions = [],
   } = state;
 
   const navigate = useNavigate();
@@ -79,6 +81,7 @@ function Teacher({ token, role, updateLatestToken }) {
       subject: 'General',
       requestId: '',
       isPolling: false,
+      streamedQuestions: [],
     };
     setState(initialState);
     localStorage.setItem('teacherDashboardState', JSON.stringify(initialState));
@@ -91,47 +94,130 @@ function Teacher({ token, role, updateLatestToken }) {
   }, [role, navigate]);
 
   useEffect(() => {
-    let pollingInterval;
-    if (requestId && isPolling) {
+    if (!requestId || !isPolling) return undefined;
+    // Questions are pushed as soon as the server accepts them; the stream closes on completion.
+    // The stream is opened with a short-lived ticket rather than the session token, since its
+    // URL can end up in logs. If the server refuses the stream (too many open, or the ticket
+    // expired on a reconnect), a fresh ticket is tried once, then token-status is polled.
+    const apiUrl = import.meta.env.VITE_API_URL;
+    const headers = { Authorization: `Bearer ${token}` };
+    let source = null;
+    let pollingInterval = null;
+    let cancelled = false;
+    let lastEventId = '';
+    const progressMessage = ({ queuePosition, etaSeconds, progress }) => {
+      if (queuePosition) {
+        return `Waiting in queue (position ${queuePosition}${etaSeconds ? `, about ${Math.ceil(etaSeconds / 60)} min` : ''})...`;
+      }
+      if (!progress || progress.stage === 'analysis') {
+        return 'Processing content, please wait...';
+      }
+      return `Generating questions: ${progress.mcqs}/${progress.mcqsTarget} MCQs, ${progress.descriptive}/${progress.descriptiveTarget} descriptive...`;
+    };
+    const complete = (newToken) => {
+      setState(prev => ({
+        ...prev,
+        tokenId: newToken,
+        generatedToken: newToken,
+        showTokenModal: true,
+        message: 'Content uploaded successfully',
+        isPolling: false,
+        requestId: '',
+      }));
+      updateLatestToken(newToken);
+    };
+    const fail = (error) => {
+      setState(prev => ({
+        ...prev,
+        message: error || 'Upload failed',
+        isPolling: false,
+        requestId: '',
+      }));
+    };
+
+    const poll = () => {
       pollingInterval = setInterval(async () => {
         try {
-          const res = await axios.get(`${import.meta.env.VITE_API_URL}/api/token-status/${requestId}`, {
-            headers: { Authorization: `Bearer ${token}` },
-          });
-          const { status, token: newToken, error } = res.data;
+          const res = await axios.get(`${apiUrl}/api/token-status/${requestId}`, { headers });
+          const { status, token: newToken, error, mcqs = [], descriptiveQuestions = [] } = res.data;
           if (status === 'completed') {
-            setState(prev => ({
-              ...prev,
-              tokenId: newToken,
-              generatedToken: newToken,
-              showTokenModal: true,
-              message: 'Content uploaded successfully',
-              isPolling: false,
-              requestId: '',
-            }));
-            updateLatestToken(newToken);
             clearInterval(pollingInterval);
+            complete(newToken);
           } else if (status === 'failed') {
+            clearInterval(pollingInterval);
+            fail(error);
+          } else {
             setState(prev => ({
               ...prev,
-              message: error || 'Upload failed',
-              isPolling: false,
-              requestId: '',
+              message: progressMessage(res.data),
+              streamedQuestions: [
+                ...mcqs.map(q => ({ type: 'mcq', ...q })),
+                ...descriptiveQuestions.map(q => ({ type: 'descriptive', ...q })),
+              ],
             }));
-            clearInterval(pollingInterval);
           }
         } catch (error) {
-          setState(prev => ({
-            ...prev,
-            message: error.response?.data?.error || 'Failed to check token status',
-            isPolling: false,
-            requestId: '',
-          }));
           clearInterval(pollingInterval);
+          fail(error.response?.data?.error || 'Failed to check token status');
         }
-      }, 2000); // Poll every 2 seconds
-    }
-    return () => clearInterval(pollingInterval);
+      }, 2000);
+    };
+
+    const connect = async (retry) => {
+      let ticket;
+      try {
+        const res = await axios.post(`${apiUrl}/api/token-stream/${requestId}/ticket`, {}, { headers });
+        ticket = res.data.ticket;
+      } catch {
+        if (!cancelled) poll();
+        return;
+      }
+      if (cancelled) return;
+      const resume = lastEventId ? `&lastEventId=${encodeURIComponent(lastEventId)}` : '';
+      source = new EventSource(`${apiUrl}/api/token-stream/${requestId}?ticket=${encodeURIComponent(ticket)}${resume}`);
+      let received = false;
+      source.addEventListener('progress', (event) => {
+        received = true;
+        const data = JSON.parse(event.data);
+        setState(prev => ({ ...prev, message: progressMessage(data) }));
+      });
+      source.addEventListener('question', (event) => {
+        received = true;
+        lastEventId = event.lastEventId;
+        const question = JSON.parse(event.data);
+        setState(prev => ({ ...prev, streamedQuestions: [...(prev.streamedQuestions || []), question] }));
+      });
+      source.addEventListener('reset', () => {
+        setState(prev => ({ ...prev, streamedQuestions: [] }));
+      });
+      source.addEventListener('completed', (event) => {
+        const { token: newToken } = JSON.parse(event.data);
+        source.close();
+        complete(newToken);
+      });
+      source.addEventListener('failed', (event) => {
+        const { error } = JSON.parse(event.data);
+        source.close();
+        fail(error);
+      });
+      source.onerror = () => {
+        // EventSource reconnects by itself (resuming from the last event id) unless the server refused the stream
+        if (source.readyState === EventSource.CLOSED && !cancelled) {
+          if (received || retry) {
+            connect(false);
+          } else {
+            poll();
+          }
+        }
+      };
+    };
+
+    connect(true);
+    return () => {
+      cancelled = true;
+      if (source) source.close();
+      clearInterval(pollingInterval);
+    };
   }, [requestId, isPolling, token, updateLatestToken]);
 
   const updateState = (newState) => {
@@ -178,6 +264,7 @@ function Teacher({ token, role, updateLatestToken }) {
       updateState({
         requestId: newRequestId,
         isPolling: true,
+        streamedQuestions: [],
         message: 'Processing content, please wait...',
       });
     } catch (error) {
@@ -245,7 +332,7 @@ function Teacher({ token, role, updateLatestToken }) {
                   id="textContent"
                   value={textContent}
                   onChange={(e) => updateState({ textContent: e.target.value })}
-                  placeholder="Paste text for question generation (up to 3000 words)"
+                  placeholder="Paste text for question generation (up to 20000 words)"
                   className="mt-1 block w-full p-2 border border-gray-300 rounded-md focus:ring-2 focus:ring-blue-500 focus:border-blue-500"
                   rows="5"
                 />
@@ -343,6 +430,22 @@ function Teacher({ token, role, updateLatestToken }) {
             </div>
           )}
 
+          {isPolling && streamedQuestions.length > 0 && (
+            <div className="mt-4">
+              <h3 className="text-lg font-semibold text-gray-700 mb-2">
+                Generated so far ({streamedQuestions.length})
+              </h3>
+              <ol className="list-decimal list-inside space-y-1 text-gray-700">
+                {streamedQuestions.map((q, index) => (
+                  <li key={index}>
+                    <span className="text-xs uppercase text-gray-500 mr-2">{q.type === 'mcq' ? 'MCQ' : 'Descriptive'}</span>
+                    {q.question}
+                  </li>
+                ))}
+              </ol>
+            </div>
+          )}
+
           {tokenId && (
             <div className="mt-6">
               <h3 className="text-xl font-semibold text-gray-700 mb-4">
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+# Per-job time budget for generation. The share of QG_JOB_DEADLINE seconds still left picks
+# a decoding profile: full beams and retries while most of it remains, then fewer beams,
+# return sequences and retries, down to greedy decoding. Once the deadline has passed the
+# generators finish their current round and stop. 0 disables the deadline.
+# The generation scheduler only merges requests with identical decoding params, so concurrent
+# jobs on different levels are batched separately; the levels are few and coarse to keep that
+# split small.
+JOB_DEADLINE = float(os.getenv("QG_JOB_DEADLINE", 600))
+
+# Profiles per generation step, fullest first; a level applies while the remaining share of
+# the budget is above its threshold
+LEVEL_THRESHOLDS = [0.5, 0.25, 0.1, 0.0]
+LEVEL_NAMES = ["full", "reduced", "minimal", "greedy"]
+DECODING_PROFILES = {
+    "mcq_question": [
+        {"num_beams": 8, "num_return_sequences": 5, "max_attempts": 3},
+        {"num_beams": 4, "num_return_sequences": 3, "max_attempts": 2},
+        {"num_beams": 2, "num_return_sequences": 2, "max_attempts": 1},
+        {"num_beams": 1, "num_return_sequences": 1, "max_attempts": 1}
+    ],
+    "descriptive_question": [
+        {"num_beams": 5, "num_return_sequences": 5},
+        {"num_beams": 3, "num_return_sequences": 3},
+        {"num_beams": 2, "num_return_sequences": 2},
+        {"num_beams": 1, "num_return_sequences": 1}
+    ],
+    "descriptive_answer": [
+        {"num_beams": 5, "max_length": 250},
+        {"num_beams": 3, "max_length": 200},
+        {"num_beams": 2, "max_length": 160},
+        {"num_beams": 1, "max_length": 120}
+    ]
+}
+
+
+# generate() arguments that only apply to beam search. With num_beams=1 transformers warns
+# about them, and they would keep greedy requests from merging with each other's batches.
+BEAM_ONLY_KWARGS = ("early_stopping", "length_penalty")
+
+
+def full_profile(step):
+    return {"level": LEVEL_NAMES[0], **DECODING_PROFILES[step][0]}
+
+
+def decoding_kwargs(decoding):
+    if decoding.get("num_beams") == 1:
+        return {name: value for name, value in decoding.items() if name not in BEAM_ONLY_KWARGS}
+    return decoding
+
+
+class DecodingBudget:
+    def __init__(self, deadline=JOB_DEADLINE, started_at=None):
+        # started_at, the datetime the job started, backdates the budget so the time spent
+        # before generation (PDF extraction, the cache lookup, analysis) counts against it
+        self.deadline = deadline
+        self.started = time.monotonic()
+        if started_at is not None:
+            self.started -= max(0.0, (datetime.now() - started_at).total_seconds())
+        self.lowest_level = 0
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining_share(self):
+        if not self.deadline:
+            return 1.0
+        return max(0.0, 1 - self.elapsed() / self.deadline)
+
+    def expired(self):
+        return bool(self.deadline) and self.elapsed() >= self.deadline
+
+    def level(self):
+        share = self.remaining_share()
+        return next(i for i, threshold in enumerate(LEVEL_THRESHOLDS) if share > threshold or i == len(LEVEL_THRESHOLDS) - 1)
+
+    def profile(self, step):
+        # The decoding settings for the next call of a step; returned as a new dict that is
+        # recorded on the questions it produces
+        level = self.level()
+        with self._lock:
+            self.lowest_level = max(self.lowest_level, level)
+        return {"level": LEVEL_NAMES[level], **DECODING_PROFILES[step][level]}
+
+    def degraded(self):
+        return self.lowest_level > 0
+
+    def summary(self):
+        return {
+            "deadline_seconds": self.deadline,
+            "elapsed_seconds": round(self.elapsed(), 2),
+            "lowest_level": LEVEL_NAMES[self.lowest_level],
+            "expired": self.expired()
+        }
@@ -0,0 +1,75 @@
+from collections import Counter
+import numpy as np
+from ai.string_similarity import similarity_to_many
+
+
+class DedupIndex:
+    # Accepted questions plus a growing matrix of their normalized embeddings. A question
+    # is a duplicate when its normalized Levenshtein similarity or embedding cosine
+    # similarity to any accepted question is above the threshold.
+    def __init__(self, encode, threshold=0.85, ngram_size=3):
+        self.encode = encode
+        self.threshold = threshold
+        self.ngram_size = ngram_size
+        self.questions = []
+        self._texts = []
+        self._ngrams = []
+        self._embeddings = None
+        self._size = 0
+
+    def __len__(self):
+        return len(self.questions)
+
+    def _ngram_counts(self, text):
+        n = self.ngram_size
+        return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+    def _may_be_similar(self, text, ngrams, other, other_ngrams):
+        # Cheap necessary conditions for similarity > threshold, i.e. an edit distance below
+        # (1 - threshold) * longest: the length gap is a lower bound on the edit distance, and
+        # each edit destroys at most ngram_size of the shared character n-grams
+        longest = max(len(text), len(other))
+        if longest == 0:
+            return True
+        max_distance = (1 - self.threshold) * longest + 1e-9
+        if abs(len(text) - len(other)) >= max_distance:
+            return False
+        shared = sum((ngrams & other_ngrams).values())
+        required = longest - self.ngram_size + 1 - self.ngram_size * max_distance
+        return shared > required
+
+    def _normalized_embedding(self, text):
+        embedding = np.asarray(self.encode([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def is_duplicate(self, question):
+        if not self.questions:
+            return False
+        text = question.lower()
+        ngrams = self._ngram_counts(text)
+        candidates = [other for other, other_ngrams in zip(self._texts, self._ngrams)
+                      if self._may_be_similar(text, ngrams, other, other_ngrams)]
+        if candidates and similarity_to_many(text, candidates).max() > self.threshold:
+            return True
+        similarities = self._embeddings[:self._size] @ self._normalized_embedding(question)
+        return bool(similarities.max() > self.threshold)
+
+    def add(self, question):
+        text = question["question"] if isinstance(question, dict) else question
+        embedding = self._normalized_embedding(text)
+        if self._embeddings is None:
+            self._embeddings = np.zeros((8, embedding.shape[0]), dtype=np.float32)
+        elif self._size == len(self._embeddings):
+            grown = np.zeros((2 * self._size, embedding.shape[0]), dtype=np.float32)
+            grown[:self._size] = self._embeddings
+            self._embeddings = grown
+        self._embeddings[self._size] = embedding
+        self._size += 1
+        self.questions.append(question)
+        self._texts.append(text.lower())
+        self._ngrams.append(self._ngram_counts(text.lower()))
+
+    def extend(self, questions):
+        for question in questions:
+            self.add(question)
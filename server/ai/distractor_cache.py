@@ -0,0 +1,138 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# Candidate distractors (sense2vec neighbours and WordNet siblings) per answer term, kept in
+# sqlite so every process and every later upload reuses them. Only the context-free
+# gathering is cached; filtering against the question and MMR ranking still run per question.
+# Hits record their access time in memory, written out in one batch every USED_AT_FLUSH_SECONDS
+# (and before pruning), so a hit costs no write transaction.
+# Usage: python -m ai.distractor_cache [stats | prune | clear]
+DISTRACTOR_CACHE_PATH = os.getenv("QG_DISTRACTOR_CACHE", "distractor_cache.sqlite3")
+DISTRACTOR_CACHE_TTL = int(os.getenv("QG_DISTRACTOR_CACHE_TTL_DAYS", 30)) * 86400
+DISTRACTOR_CACHE_SIZE = int(os.getenv("QG_DISTRACTOR_CACHE_SIZE", 50000))
+PRUNE_EVERY = 500
+USED_AT_FLUSH_SECONDS = 60
+
+
+def normalize_answer(answer):
+    return " ".join(answer.lower().split())
+
+
+class DistractorCache:
+    def __init__(self, path=DISTRACTOR_CACHE_PATH, ttl=DISTRACTOR_CACHE_TTL, max_entries=DISTRACTOR_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        self._used = {}
+        self._flushed_at = time.time()
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS candidates ("
+                "answer TEXT NOT NULL, sense TEXT NOT NULL, candidates TEXT NOT NULL, "
+                "created_at REAL NOT NULL, used_at REAL NOT NULL, PRIMARY KEY (answer, sense))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS candidates_used_at ON candidates (used_at)")
+            self._connection.commit()
+        return self._connection
+
+    def get(self, answer, sense):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT candidates, created_at FROM candidates WHERE answer = ? AND sense = ?",
+                             (answer, sense)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self._used[(answer, sense)] = now
+            if now - self._flushed_at >= USED_AT_FLUSH_SECONDS:
+                self._flush_used(db)
+                db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, answer, sense, candidates):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO candidates VALUES (?, ?, ?, ?, ?)",
+                       (answer, sense, json.dumps(candidates), now, now))
+            self._flush_used(db)
+            db.commit()
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune(db)
+
+    def _flush_used(self, db):
+        # Part of the caller's transaction
+        if self._used:
+            db.executemany("UPDATE candidates SET used_at = ? WHERE answer = ? AND sense = ?",
+                           [(used_at, answer, sense) for (answer, sense), used_at in self._used.items()])
+            self._used.clear()
+        self._flushed_at = time.time()
+
+    def _prune(self, db):
+        self._flush_used(db)
+        expired = db.execute("DELETE FROM candidates WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+        overflow = db.execute(
+            "DELETE FROM candidates WHERE rowid IN (SELECT rowid FROM candidates ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        ).rowcount
+        db.commit()
+        self.evictions += expired + overflow
+
+    def prune(self):
+        with self._lock:
+            self._prune(self._db())
+
+    def clear(self):
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM candidates")
+            db.commit()
+            self._used.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._db().execute("SELECT COUNT(*) FROM candidates").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_days": self.ttl / 86400,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    cache = DistractorCache()
+    if command == "clear":
+        cache.clear()
+    elif command == "prune":
+        cache.prune()
+        print(f"Evicted {cache.evictions} entries")
+    elif command != "stats":
+        print("Usage: python -m ai.distractor_cache [stats | prune | clear]")
+        sys.exit(1)
+    print(json.dumps(cache.stats(), indent=2))
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class EmbeddingCache:
+    # Bounded LRU of sentence embeddings keyed by (model version, sha1 of text). encode()
+    # only sends the texts that are not cached to the model, in a single call.
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, version, text):
+        return (version, hashlib.sha1(text.encode("utf-8")).hexdigest())
+
+    def encode(self, model, texts, version):
+        if isinstance(texts, str):
+            texts = [texts]
+        results = [None] * len(texts)
+        missing = OrderedDict()
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = self._key(version, text)
+                embedding = self._entries.get(key)
+                if embedding is not None:
+                    self._entries.move_to_end(key)
+                    results[i] = embedding
+                    self.hits += 1
+                elif key in missing:
+                    missing[key].append(i)
+                    self.hits += 1
+                else:
+                    missing[key] = [i]
+                    self.misses += 1
+        if missing:
+            miss_texts = [texts[positions[0]] for positions in missing.values()]
+            embeddings = np.asarray(model.encode(miss_texts))
+            with self._lock:
+                for (key, positions), embedding in zip(missing.items(), embeddings):
+                    embedding.setflags(write=False)
+                    self._entries[key] = embedding
+                    self._entries.move_to_end(key)
+                    for i in positions:
+                        results[i] = embedding
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        if not results:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(results)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": self.hits / total if total else 0.0
+            }
@@ -0,0 +1,287 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import torch
+from ai.inference_backend import GenerationBackend
+
+# One scheduler per generation model. Every caller in the process (each job thread, and each
+# HTTP request in the inference server) submits prompts and gets a future back; a single
+# thread per model collects the requests that arrive within a short window, merges those
+# with the same decoding params into one batched generate call and resolves the futures.
+# Calls on different models take turns on the shared compute lock, so torch's intra-op pool
+# is never split between concurrent generate calls. max_batch caps the prompts collected into
+# one call; within it, the model runs forward passes of at most the smallest batch_size the
+# callers asked for (QG_BATCH_SIZE / QG_DESCRIPTIVE_BATCH_SIZE), as without the scheduler.
+# Usage: python -m ai.generation_scheduler benchmark [--model t5_question] [--clients 8] [--requests 4]
+SCHEDULER_ENABLED = os.getenv("QG_SCHEDULER", "1") == "1"
+SCHEDULER_WINDOW = float(os.getenv("QG_BATCH_WINDOW_MS", os.getenv("QG_SERVER_BATCH_WINDOW_MS", 10))) / 1000
+SCHEDULER_MAX_BATCH = int(os.getenv("QG_MAX_BATCH", os.getenv("QG_SERVER_MAX_BATCH", 16)))
+SCHEDULER_EXCLUSIVE = os.getenv("QG_SCHEDULER_EXCLUSIVE", "1") == "1"
+TORCH_THREADS = int(os.getenv("QG_TORCH_THREADS", 0))
+
+logger = logging.getLogger(__name__)
+
+_compute_lock = threading.Lock()
+_schedulers = {}
+_registry_lock = threading.Lock()
+_threads_configured = False
+
+
+def configure_torch_threads(threads=TORCH_THREADS):
+    # Generate calls are serialized, so each one may use every core for intra-op work;
+    # inter-op parallelism only adds contention for these models
+    global _threads_configured
+    if _threads_configured:
+        return
+    _threads_configured = True
+    torch.set_num_threads(threads or os.cpu_count() or 1)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before torch ran any parallel work
+        pass
+
+
+class _Request:
+    def __init__(self, prompts, max_input_length, batch_size, decoding):
+        self.prompts = prompts
+        self.max_input_length = max_input_length
+        self.batch_size = batch_size
+        self.decoding = decoding
+        self.key = (max_input_length, json.dumps(decoding, sort_keys=True))
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+
+
+class GenerationScheduler:
+    def __init__(self, backend, name, window=SCHEDULER_WINDOW, max_batch=SCHEDULER_MAX_BATCH,
+                 exclusive=SCHEDULER_EXCLUSIVE):
+        self.backend = backend
+        self.name = name
+        self.window = window
+        self.max_batch = max_batch
+        self.exclusive = exclusive
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._counters = {"requests": 0, "prompts": 0, "batches": 0, "output_tokens": 0,
+                          "busy_seconds": 0.0, "queue_seconds": 0.0, "errors": 0}
+        self._started_at = time.time()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=f"generation-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompts, max_input_length=512, batch_size=None, **decoding):
+        request = _Request(list(prompts), max_input_length, batch_size, decoding)
+        if not request.prompts:
+            request.future.set_result([])
+            return request.future
+        with self._stats_lock:
+            if self._stopped:
+                raise RuntimeError(f"Generation scheduler for {self.name} is stopped")
+            self._queue.put(request)
+        return request.future
+
+    def stop(self):
+        # Ends the thread once every request submitted before the call has been served
+        with self._stats_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put(None)
+
+    def _collect(self):
+        # Block for the first request, then take whatever else arrives within the window
+        # until one batch worth of prompts is waiting. None is stop()'s marker; nothing is
+        # queued after it.
+        first = self._queue.get()
+        if first is None:
+            return None
+        requests = [first]
+        prompts = len(first.prompts)
+        deadline = time.perf_counter() + self.window
+        while prompts < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            requests.append(request)
+            prompts += len(request.prompts)
+        groups = {}
+        for request in requests:
+            groups.setdefault(request.key, []).append(request)
+        return list(groups.values())
+
+    def _run(self):
+        # Nothing but stop() may end this thread: every caller of the model waits on it
+        while True:
+            groups = self._collect()
+            if groups is None:
+                return
+            for group in groups:
+                try:
+                    self._generate(group)
+                except Exception as e:
+                    logger.exception(f"Generation scheduler for {self.name} failed a batch")
+                    for request in group:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+
+    def _generate(self, group):
+        prompts = [prompt for request in group for prompt in request.prompts]
+        first = group[0]
+        batch_size = min([request.batch_size for request in group if request.batch_size] or [self.max_batch])
+        start = time.perf_counter()
+        try:
+            if self.exclusive:
+                with _compute_lock:
+                    outputs = self.backend.generate(prompts, max_input_length=first.max_input_length,
+                                                    batch_size=batch_size, **first.decoding)
+            else:
+                outputs = self.backend.generate(prompts, max_input_length=first.max_input_length,
+                                                batch_size=batch_size, **first.decoding)
+        except Exception as e:
+            with self._stats_lock:
+                self._counters["errors"] += 1
+            for request in group:
+                request.future.set_exception(e)
+            return
+        busy = time.perf_counter() - start
+        offset = 0
+        for request in group:
+            request.future.set_result(outputs[offset:offset + len(request.prompts)])
+            offset += len(request.prompts)
+        try:
+            # Throughput stats only; the callers already have their outputs
+            tokens = sum(self.backend.count_tokens_batch([text for outs in outputs for text in outs]))
+        except Exception:
+            logger.exception(f"Counting output tokens for {self.name} failed")
+            tokens = 0
+        with self._stats_lock:
+            self._counters["requests"] += len(group)
+            self._counters["prompts"] += len(prompts)
+            self._counters["batches"] += 1
+            self._counters["output_tokens"] += tokens
+            self._counters["busy_seconds"] += busy
+            self._counters["queue_seconds"] += sum(start - request.submitted_at for request in group)
+
+    def stats(self):
+        with self._stats_lock:
+            counters = dict(self._counters)
+        batches = counters["batches"]
+        busy = counters["busy_seconds"]
+        return {
+            **counters,
+            "queued": self._queue.qsize(),
+            "mean_batch_prompts": counters["prompts"] / batches if batches else 0.0,
+            "mean_queue_ms": counters["queue_seconds"] / counters["requests"] * 1000 if counters["requests"] else 0.0,
+            "tokens_per_second": counters["output_tokens"] / busy if busy else 0.0,
+            "utilization": busy / max(time.time() - self._started_at, 1e-9)
+        }
+
+
+class ScheduledBackend(GenerationBackend):
+    # A backend whose generate goes through the model's scheduler; everything else, the
+    # model and tokenizer included, is the wrapped backend's
+    def __init__(self, backend, scheduler):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.name = backend.name
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def count_tokens(self, text):
+        return self.backend.count_tokens(text)
+
+    def count_tokens_batch(self, texts):
+        return self.backend.count_tokens_batch(texts)
+
+    def submit(self, prompts, max_input_length=512, batch_size=None, **decoding):
+        return self.scheduler.submit(prompts, max_input_length=max_input_length, batch_size=batch_size, **decoding)
+
+    def generate(self, prompts, max_input_length=512, batch_size=None, **decoding):
+        # Prompts are merged with other callers'; batch_size still caps each forward pass
+        return self.submit(prompts, max_input_length=max_input_length, batch_size=batch_size, **decoding).result()
+
+
+def schedule(name, backend):
+    # The scheduled wrapper for one model. The scheduler registered for the same backend is
+    # reused; one registered for another backend is stopped and replaced.
+    if not SCHEDULER_ENABLED:
+        return backend
+    configure_torch_threads()
+    with _registry_lock:
+        scheduler = _schedulers.get(name)
+        if scheduler is None or scheduler.backend is not backend:
+            if scheduler is not None:
+                scheduler.stop()
+            scheduler = GenerationScheduler(backend, name)
+            _schedulers[name] = scheduler
+    return ScheduledBackend(backend, scheduler)
+
+
+def scheduler_stats():
+    with _registry_lock:
+        schedulers = dict(_schedulers)
+    return {name: scheduler.stats() for name, scheduler in schedulers.items()}
+
+
+def _run_clients(generate, prompts, decoding, clients, requests):
+    def client(index):
+        for i in range(requests):
+            generate([prompts[(index + i) % len(prompts)]], **decoding)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client, range(clients)))
+    return time.perf_counter() - start
+
+
+def benchmark(model_name, clients=8, requests=4):
+    from ai.inference_backend import PARITY_DECODING, PARITY_PROMPTS, create_backend
+    backend = create_backend(model_name)
+    prompts = PARITY_PROMPTS[model_name]
+    decoding = PARITY_DECODING[model_name]
+    total = clients * requests
+    backend.generate(prompts[:1], **decoding)
+    # Unscheduled: every client thread calls generate concurrently at batch size 1
+    outputs = []
+    lock = threading.Lock()
+
+    def direct(batch, **kwargs):
+        result = backend.generate(batch, batch_size=1, **kwargs)
+        with lock:
+            outputs.extend(result)
+        return result
+    direct_seconds = _run_clients(direct, prompts, decoding, clients, requests)
+    direct_tokens = sum(backend.count_tokens_batch([text for outs in outputs for text in outs]))
+    scheduled = ScheduledBackend(backend, GenerationScheduler(backend, model_name))
+    configure_torch_threads()
+    scheduled_seconds = _run_clients(scheduled.generate, prompts, decoding, clients, requests)
+    stats = scheduled.scheduler.stats()
+    print(f"{model_name}: {clients} concurrent clients x {requests} requests ({total} prompts)")
+    print(f"  direct:    {direct_seconds:.1f}s, {direct_tokens / direct_seconds:.1f} tokens/s")
+    print(f"  scheduled: {scheduled_seconds:.1f}s, {stats['output_tokens'] / scheduled_seconds:.1f} tokens/s, "
+          f"{stats['batches']} batches of {stats['mean_batch_prompts']:.1f} prompts, "
+          f"{stats['mean_queue_ms']:.0f} ms mean queueing")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generation scheduler")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    benchmark_parser = subparsers.add_parser("benchmark")
+    benchmark_parser.add_argument("--model", default="t5_question")
+    benchmark_parser.add_argument("--clients", type=int, default=8)
+    benchmark_parser.add_argument("--requests", type=int, default=4)
+    args = parser.parse_args()
+    benchmark(args.model, clients=args.clients, requests=args.requests)
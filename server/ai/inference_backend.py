@@ -0,0 +1,154 @@
+import json
+import os
+import sys
+from abc import ABC, abstractmethod
+import torch
+from ai.model_store import MODEL_STORE_DIR, MODEL_SOURCES, load_model, load_tokenizer, model_dir, store_versions
+
+# "torch" runs Hugging Face generate on the loaded model, "onnx" runs an exported
+# encoder/decoder graph with onnxruntime (needs optimum[onnxruntime]). QG_BACKEND picks the
+# default, QG_BACKEND_<MODEL NAME> overrides it for one model, e.g. QG_BACKEND_T5_ANSWER=onnx.
+# Usage: python -m ai.inference_backend parity [model name]
+INFERENCE_BACKEND = os.getenv("QG_BACKEND", "torch")
+BACKEND_BATCH_SIZE = int(os.getenv("QG_BATCH_SIZE", 8))
+
+
+class GenerationBackend(ABC):
+    name = None
+
+    @abstractmethod
+    def generate(self, prompts, max_input_length=512, **decoding):
+        # Returns one list of num_return_sequences decoded strings per prompt
+        pass
+
+    @abstractmethod
+    def count_tokens(self, text):
+        pass
+
+    def count_tokens_batch(self, texts):
+        return [self.count_tokens(text) for text in texts]
+
+
+class TorchBackend(GenerationBackend):
+    name = "torch"
+
+    def __init__(self, model, tokenizer, device=None, batch_size=BACKEND_BATCH_SIZE):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device or torch.device("cpu")
+        self.batch_size = batch_size
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.tokenize(text))
+
+    def count_tokens_batch(self, texts):
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+    def generate(self, prompts, max_input_length=512, batch_size=None, **decoding):
+        batch_size = batch_size or self.batch_size
+        num_return_sequences = decoding.get("num_return_sequences", 1)
+        results = []
+        for start in range(0, len(prompts), batch_size):
+            batch = prompts[start:start + batch_size]
+            encoding = self.tokenizer.batch_encode_plus(batch, max_length=max_input_length, padding=True,
+                                                        truncation=True, return_tensors="pt").to(self.device)
+            outs = self.model.generate(input_ids=encoding["input_ids"],
+                                       attention_mask=encoding["attention_mask"],
+                                       **decoding)
+            decoded = [self.tokenizer.decode(ids, skip_special_tokens=True) for ids in outs]
+            for i in range(len(batch)):
+                results.append(decoded[i * num_return_sequences:(i + 1) * num_return_sequences])
+        return results
+
+
+class OnnxBackend(TorchBackend):
+    name = "onnx"
+
+    def __init__(self, model_name, batch_size=BACKEND_BATCH_SIZE):
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        except ImportError:
+            raise ImportError("The onnx backend needs optimum with onnxruntime: pip install optimum[onnxruntime]")
+        base_version = store_versions().get(model_name)
+        if base_version is None:
+            load_model(model_name)
+            base_version = store_versions().get(model_name)
+        export_dir = os.path.join(MODEL_STORE_DIR, f"{model_name}-onnx")
+        version_path = os.path.join(export_dir, "source_version")
+        exported_version = None
+        if os.path.exists(version_path):
+            with open(version_path) as f:
+                exported_version = f.read().strip()
+        if exported_version == base_version:
+            model = ORTModelForSeq2SeqLM.from_pretrained(export_dir, use_cache=True)
+        else:
+            model = ORTModelForSeq2SeqLM.from_pretrained(model_dir(model_name), export=True, use_cache=True)
+            model.save_pretrained(export_dir)
+            with open(version_path, "w") as f:
+                f.write(base_version)
+        super().__init__(model, load_tokenizer(model_name), torch.device("cpu"), batch_size)
+
+
+def backend_kind(model_name):
+    return os.getenv(f"QG_BACKEND_{model_name.upper()}", INFERENCE_BACKEND)
+
+
+def create_backend(model_name, model=None, tokenizer=None, device=None, kind=None):
+    kind = kind or backend_kind(model_name)
+    if kind == "torch":
+        if model is None:
+            model, tokenizer = load_model(model_name)
+            model = model.to(device or torch.device("cpu"))
+        return TorchBackend(model, tokenizer, device)
+    if kind == "onnx":
+        return OnnxBackend(model_name)
+    raise ValueError(f"Unknown inference backend '{kind}' for {model_name}")
+
+
+PARITY_PROMPTS = {
+    "t5_summary": [
+        "summarize: Photosynthesis is the process by which green plants use sunlight, water and carbon dioxide to produce glucose and oxygen. It takes place in the chloroplasts, which contain chlorophyll.",
+    ],
+    "t5_question": [
+        "context: The mitochondria is the powerhouse of the cell and produces ATP through cellular respiration. answer: mitochondria Generate a question for this answer.",
+        "generate an educational question based on this text: Newton's first law states that an object remains at rest or in uniform motion unless acted upon by a force.",
+    ],
+    "t5_answer": [
+        "Answer this question in detail based on the given information. Question: What does the first law of motion state? Context: Newton's first law states that an object remains at rest or in uniform motion unless acted upon by a force. Answer:",
+    ],
+}
+
+PARITY_DECODING = {
+    "t5_summary": {"max_input_length": 512, "early_stopping": True, "num_beams": 3, "num_return_sequences": 1,
+                   "no_repeat_ngram_size": 2, "min_length": 75, "max_length": 300},
+    "t5_question": {"max_input_length": 512, "early_stopping": True, "num_beams": 8, "num_return_sequences": 5,
+                    "no_repeat_ngram_size": 3, "max_length": 100},
+    "t5_answer": {"max_input_length": 768, "early_stopping": True, "num_beams": 5, "length_penalty": 1.5,
+                  "no_repeat_ngram_size": 3, "min_length": 50, "max_length": 250},
+}
+
+
+def parity_check(model_name, reference_kind="torch", candidate_kind="onnx"):
+    reference = create_backend(model_name, kind=reference_kind)
+    candidate = create_backend(model_name, kind=candidate_kind)
+    prompts = PARITY_PROMPTS[model_name]
+    decoding = PARITY_DECODING[model_name]
+    reference_outputs = reference.generate(prompts, **decoding)
+    candidate_outputs = candidate.generate(prompts, **decoding)
+    mismatches = []
+    for prompt, expected, actual in zip(prompts, reference_outputs, candidate_outputs):
+        if expected != actual:
+            mismatches.append({"prompt": prompt, reference_kind: expected, candidate_kind: actual})
+    return {"model": model_name, "prompts": len(prompts), "mismatches": mismatches}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "parity":
+        print("Usage: python -m ai.inference_backend parity [model name]")
+        sys.exit(1)
+    names = sys.argv[2:] or list(PARITY_PROMPTS)
+    reports = [parity_check(name) for name in names if name in MODEL_SOURCES]
+    print(json.dumps(reports, indent=2))
+    sys.exit(1 if any(report["mismatches"] for report in reports) else 0)
@@ -0,0 +1,168 @@
+import base64
+import http.client
+import json
+import os
+import socket
+import tempfile
+from urllib.parse import urlparse
+import numpy as np
+from ai.inference_backend import GenerationBackend
+
+# Address of a running `python -m ai.inference_server`: "unix:/path/to.sock", "unix:" for
+# the default socket, or "http://127.0.0.1:8765". When unset or unreachable, models are
+# loaded in-process. Sockets live in a directory only their user can enter, never directly
+# in a world-writable one like /tmp.
+INFERENCE_SERVER = os.getenv("QG_INFERENCE_SERVER")
+INFERENCE_TIMEOUT = float(os.getenv("QG_INFERENCE_TIMEOUT", 600))
+RUNTIME_DIR = os.getenv("QG_RUNTIME_DIR",
+                        os.path.join(os.getenv("XDG_RUNTIME_DIR") or tempfile.gettempdir(), f"qmaster-{os.getuid()}"))
+DEFAULT_SOCKET_PATH = os.path.join(RUNTIME_DIR, "inference.sock")
+
+
+class InferenceServerError(Exception):
+    pass
+
+
+def private_socket_dir(socket_path):
+    # Creates the socket's directory with mode 0700, or checks that an existing one is owned
+    # by this user and closed to everyone else
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    stat = os.stat(directory)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise InferenceServerError(f"{directory} must be owned by this user with mode 0700 to hold the inference socket")
+    return directory
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def encode_array(array):
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def decode_array(payload):
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(payload["shape"])
+
+
+class InferenceClient:
+    def __init__(self, address=INFERENCE_SERVER, timeout=INFERENCE_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self, timeout):
+        if self.address.startswith("unix:"):
+            return UnixHTTPConnection(self.address[len("unix:"):] or DEFAULT_SOCKET_PATH, timeout=timeout)
+        parsed = urlparse(self.address)
+        return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+
+    def request(self, method, path, payload=None, timeout=None):
+        connection = self._connection(timeout or self.timeout)
+        try:
+            body = json.dumps(payload) if payload is not None else None
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            data = json.loads(response.read() or b"{}")
+            if response.status >= 400:
+                raise InferenceServerError(data.get("error", f"HTTP {response.status}"))
+            return data
+        finally:
+            connection.close()
+
+    def ready(self):
+        if not self.address:
+            return False
+        try:
+            self.request("GET", "/ready", timeout=5)
+            return True
+        except (OSError, http.client.HTTPException, InferenceServerError):
+            return False
+
+
+class RemoteProxy:
+    # Calls the server, and on a connection failure or a dropped response (e.g. the server
+    # restarting mid-request) switches for good to a local object built by `fallback`
+    def __init__(self, client, fallback=None):
+        self.client = client
+        self._fallback_factory = fallback
+        self._fallback = None
+
+    def _local(self):
+        if self._fallback is None:
+            print(f"Inference server at {self.client.address} is unavailable, falling back to in-process inference")
+            self._fallback = self._fallback_factory()
+        return self._fallback
+
+    def _call(self, path, payload):
+        if self._fallback is None:
+            try:
+                return self.client.request("POST", path, payload)
+            except (OSError, http.client.HTTPException):
+                if self._fallback_factory is None:
+                    raise
+        return None
+
+
+class RemoteBackend(RemoteProxy, GenerationBackend):
+    name = "remote"
+
+    def __init__(self, client, model_name, fallback=None):
+        super().__init__(client, fallback)
+        self.model_name = model_name
+
+    def generate(self, prompts, max_input_length=512, batch_size=None, **decoding):
+        response = self._call("/generate", {
+            "model": self.model_name,
+            "prompts": prompts,
+            "max_input_length": max_input_length,
+            "batch_size": batch_size,
+            "decoding": decoding
+        })
+        if response is not None:
+            return response["outputs"]
+        return self._local().generate(prompts, max_input_length=max_input_length, batch_size=batch_size, **decoding)
+
+    def count_tokens(self, text):
+        response = self._call("/tokenize", {"model": self.model_name, "texts": [text]})
+        if response is not None:
+            return response["counts"][0]
+        return self._local().count_tokens(text)
+
+    def count_tokens_batch(self, texts):
+        response = self._call("/tokenize", {"model": self.model_name, "texts": list(texts)})
+        if response is not None:
+            return response["counts"]
+        return self._local().count_tokens_batch(texts)
+
+
+class RemoteSentenceModel(RemoteProxy):
+    def encode(self, texts):
+        if isinstance(texts, str):
+            texts = [texts]
+        response = self._call("/encode", {"texts": list(texts)})
+        if response is not None:
+            return decode_array(response["embeddings"])
+        return self._local().encode(texts)
+
+
+class RemoteSense2Vec(RemoteProxy):
+    def get_best_sense(self, word, senses=None, ignore_case=True):
+        response = self._call("/s2v/best_sense", {"word": word, "senses": list(senses or []), "ignore_case": ignore_case})
+        if response is not None:
+            return response["sense"]
+        return self._local().get_best_sense(word, senses=senses or [], ignore_case=ignore_case)
+
+    def most_similar(self, keys, n=10):
+        response = self._call("/s2v/most_similar", {"keys": keys, "n": n})
+        if response is not None:
+            return [tuple(item) for item in response["results"]]
+        return self._local().most_similar(keys, n=n)
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ai import question_generator as qg
+from ai.generation_scheduler import scheduler_stats
+from ai.inference_client import DEFAULT_SOCKET_PATH, encode_array, private_socket_dir
+
+# One process owning the T5 models, the sentence transformer and sense2vec for every
+# gunicorn worker on the host. Workers reach it through ai.inference_client.
+# Generate requests are batched per model by ai.generation_scheduler.
+# Usage: python -m ai.inference_server [--socket [path] | --port 8765]
+
+
+class InferenceState:
+    def __init__(self):
+        self.ready = False
+        self.error = None
+
+    def load(self):
+        try:
+            qg.download_and_load_models(use_server=False)
+            self.ready = True
+            print("Inference server ready")
+        except Exception as e:
+            self.error = str(e)
+            traceback.print_exc()
+
+    def backend(self, model_name):
+        backends = {
+            "t5_summary": qg.summary_backend,
+            "t5_question": qg.question_backend,
+            "t5_answer": qg.answer_backend
+        }
+        if model_name not in backends:
+            raise KeyError(f"Unknown model {model_name}")
+        return backends[model_name]
+
+
+state = InferenceState()
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "QMasterInference/1.0"
+
+    def address_string(self):
+        return "local"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok", "ready": state.ready, "error": state.error})
+        elif self.path == "/stats":
+            self._send(200, {"schedulers": scheduler_stats()})
+        elif self.path == "/ready":
+            if state.ready:
+                self._send(200, {"status": "ready"})
+            else:
+                self._send(503, {"status": "loading", "error": state.error or "Models are still loading"})
+        else:
+            self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if not state.ready:
+            self._send(503, {"error": "Models are still loading"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/generate":
+                # Requests from all workers meet in the model's generation scheduler
+                outputs = state.backend(data["model"]).generate(data["prompts"], data.get("max_input_length", 512),
+                                                                batch_size=data.get("batch_size"),
+                                                                **data.get("decoding", {}))
+                self._send(200, {"outputs": outputs})
+            elif self.path == "/tokenize":
+                backend = state.backend(data["model"])
+                self._send(200, {"counts": backend.count_tokens_batch(data["texts"])})
+            elif self.path == "/encode":
+                self._send(200, {"embeddings": encode_array(qg.encode_texts(data["texts"]))})
+            elif self.path == "/s2v/best_sense":
+                sense = qg.s2v.get_best_sense(data["word"], senses=data.get("senses") or [],
+                                              ignore_case=data.get("ignore_case", True))
+                self._send(200, {"sense": sense})
+            elif self.path == "/s2v/most_similar":
+                results = qg.s2v.most_similar(data["keys"], n=data.get("n", 10))
+                self._send(200, {"results": [[key, float(score)] for key, score in results]})
+            else:
+                self._send(404, {"error": "Not found"})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+def create_server(socket_path=None, host="127.0.0.1", port=8765):
+    if socket_path:
+        private_socket_dir(socket_path)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, InferenceRequestHandler)
+        os.chmod(socket_path, 0o600)
+        return server
+    server = ThreadingHTTPServer((host, port), InferenceRequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="QMaster local inference server")
+    parser.add_argument("--socket", nargs="?", const=DEFAULT_SOCKET_PATH, default=os.getenv("QG_INFERENCE_SOCKET"),
+                        help=f"listen on a unix socket (default path {DEFAULT_SOCKET_PATH})")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("QG_INFERENCE_PORT", 8765)))
+    args = parser.parse_args()
+    server = create_server(args.socket, args.host, args.port)
+    threading.Thread(target=state.load, daemon=True).start()
+    print(f"Inference server listening on {'unix:' + args.socket if args.socket else f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
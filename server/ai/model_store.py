@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+from datetime import datetime
+import torch
+import transformers
+from transformers import T5ForConditionalGeneration, T5Tokenizer
+from sentence_transformers import SentenceTransformer
+
+# Weights are kept as safetensors, which from_pretrained reads straight from an mmap of
+# the file, instead of whole pickled model objects.
+# `s2v` converts the sense2vec tables to the compact store and indexes it (see ai.s2v_store).
+# Usage: python -m ai.model_store [fetch|migrate|verify|benchmark|s2v]
+MODEL_STORE_DIR = os.getenv("QG_MODEL_STORE", "model_store")
+MODEL_STORE_OFFLINE = os.getenv("QG_OFFLINE", os.getenv("HF_HUB_OFFLINE", "0")) == "1"
+MODEL_STORE_VERIFY = os.getenv("QG_MODEL_STORE_VERIFY", "size")
+STORE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+MODEL_SOURCES = {
+    "sentence_transformer": ("sentence-transformers/msmarco-distilbert-base-v2", "sentence-transformer"),
+    "t5_summary": ("t5-base", "t5"),
+    "t5_question": ("ramsrigouthamg/t5_squad_v1", "t5"),
+    "t5_answer": ("google/flan-t5-large", "t5"),
+}
+
+# Pickle files written by the previous loader, used by migrate and benchmark
+LEGACY_PICKLES = {
+    "sentence_transformer": ("sentence_transformer_model.pkl", None),
+    "t5_summary": ("t5_summary_model.pkl", "t5_summary_tokenizer.pkl"),
+    "t5_question": ("t5_question_model.pkl", "t5_question_tokenizer.pkl"),
+    "t5_answer": ("t5_answer_model.pkl", "t5_answer_tokenizer.pkl"),
+}
+
+
+class ModelStoreError(Exception):
+    pass
+
+
+def model_dir(name):
+    return os.path.join(MODEL_STORE_DIR, name)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(name):
+    path = os.path.join(model_dir(name), MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_to_store(name, model, tokenizer=None, source=None, kind="t5"):
+    directory = model_dir(name)
+    staging = directory + ".tmp"
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+    if kind == "sentence-transformer":
+        model.save(staging, safe_serialization=True)
+    else:
+        model.save_pretrained(staging, safe_serialization=True)
+        tokenizer.save_pretrained(staging)
+    files = {}
+    for root, _, filenames in os.walk(staging):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            relpath = os.path.relpath(path, staging)
+            files[relpath] = {"size": os.path.getsize(path), "sha256": _sha256(path)}
+    manifest = {
+        "format_version": STORE_FORMAT_VERSION,
+        "name": name,
+        "source": source,
+        "kind": kind,
+        "transformers_version": transformers.__version__,
+        "torch_version": torch.__version__,
+        "created_at": datetime.now().isoformat(),
+        "files": files
+    }
+    with open(os.path.join(staging, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(staging, directory)
+    return manifest
+
+
+def verify_store(name, mode=MODEL_STORE_VERIFY, source=None):
+    manifest = read_manifest(name)
+    if manifest is None:
+        raise ModelStoreError(f"No manifest for {name} in {MODEL_STORE_DIR}")
+    if manifest.get("format_version") != STORE_FORMAT_VERSION:
+        raise ModelStoreError(f"{name} was stored with format {manifest.get('format_version')}, expected {STORE_FORMAT_VERSION}")
+    if source is not None and manifest.get("source") != source:
+        raise ModelStoreError(f"{name} was stored from {manifest.get('source')}, expected {source}")
+    if mode == "none":
+        return manifest
+    for relpath, info in manifest["files"].items():
+        path = os.path.join(model_dir(name), relpath)
+        if not os.path.exists(path) or os.path.getsize(path) != info["size"]:
+            raise ModelStoreError(f"{name}: {relpath} is missing or has the wrong size")
+        if mode == "sha256" and _sha256(path) != info["sha256"]:
+            raise ModelStoreError(f"{name}: checksum mismatch for {relpath}")
+    return manifest
+
+
+def load_from_store(name, kind="t5", verify=MODEL_STORE_VERIFY, source=None):
+    verify_store(name, verify, source)
+    directory = model_dir(name)
+    if kind == "sentence-transformer":
+        return SentenceTransformer(directory), None
+    model = T5ForConditionalGeneration.from_pretrained(directory, local_files_only=True, low_cpu_mem_usage=True)
+    tokenizer = T5Tokenizer.from_pretrained(directory, local_files_only=True)
+    return model, tokenizer
+
+
+def load_tokenizer(name):
+    return T5Tokenizer.from_pretrained(model_dir(name), local_files_only=True)
+
+
+def fetch_to_store(name):
+    source, kind = MODEL_SOURCES[name]
+    if MODEL_STORE_OFFLINE:
+        raise ModelStoreError(f"{name} is not in {MODEL_STORE_DIR} and offline mode is enabled")
+    if kind == "sentence-transformer":
+        model, tokenizer = SentenceTransformer(source), None
+    else:
+        model = T5ForConditionalGeneration.from_pretrained(source)
+        tokenizer = T5Tokenizer.from_pretrained(source)
+    save_to_store(name, model, tokenizer, source=source, kind=kind)
+    return model, tokenizer
+
+
+def load_model(name):
+    source, kind = MODEL_SOURCES[name]
+    try:
+        return load_from_store(name, kind, source=source)
+    except ModelStoreError as e:
+        print(f"Model store miss for {name}: {e}")
+    return fetch_to_store(name)
+
+
+def store_versions():
+    versions = {}
+    for name in MODEL_SOURCES:
+        manifest = read_manifest(name)
+        if manifest is None:
+            versions[name] = None
+            continue
+        digest = hashlib.sha256(json.dumps(manifest["files"], sort_keys=True).encode("utf-8")).hexdigest()
+        versions[name] = f"{manifest['source']}@{digest[:12]}"
+    return versions
+
+
+def migrate_pickles():
+    for name, (model_pickle, tokenizer_pickle) in LEGACY_PICKLES.items():
+        if not os.path.exists(model_pickle):
+            print(f"Skipping {name}: {model_pickle} not found")
+            continue
+        source, kind = MODEL_SOURCES[name]
+        with open(model_pickle, "rb") as f:
+            model = pickle.load(f)
+        tokenizer = None
+        if tokenizer_pickle:
+            with open(tokenizer_pickle, "rb") as f:
+                tokenizer = pickle.load(f)
+        save_to_store(name, model, tokenizer, source=source, kind=kind)
+        print(f"Migrated {name} from {model_pickle}")
+
+
+def benchmark():
+    print(f"{'model':<22}{'pickle (s)':>12}{'store (s)':>12}")
+    for name, (model_pickle, tokenizer_pickle) in LEGACY_PICKLES.items():
+        pickle_time = None
+        if os.path.exists(model_pickle):
+            start = time.perf_counter()
+            with open(model_pickle, "rb") as f:
+                pickle.load(f)
+            if tokenizer_pickle and os.path.exists(tokenizer_pickle):
+                with open(tokenizer_pickle, "rb") as f:
+                    pickle.load(f)
+            pickle_time = time.perf_counter() - start
+        store_time = None
+        if read_manifest(name) is not None:
+            source, kind = MODEL_SOURCES[name]
+            start = time.perf_counter()
+            load_from_store(name, kind)
+            store_time = time.perf_counter() - start
+        pickle_col = f"{pickle_time:.2f}" if pickle_time is not None else "-"
+        store_col = f"{store_time:.2f}" if store_time is not None else "-"
+        print(f"{name:<22}{pickle_col:>12}{store_col:>12}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "fetch"
+    if command == "fetch":
+        for model_name in MODEL_SOURCES:
+            load_model(model_name)
+    elif command == "migrate":
+        migrate_pickles()
+    elif command == "verify":
+        for model_name in MODEL_SOURCES:
+            print(model_name, verify_store(model_name, mode="sha256")["source"])
+    elif command == "benchmark":
+        benchmark()
+    elif command == "s2v":
+        from ai.s2v_store import compact_and_index
+        compact_and_index()
+    else:
+        print("Usage: python -m ai.model_store [fetch|migrate|verify|benchmark|s2v]")
+        sys.exit(1)
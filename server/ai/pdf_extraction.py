@@ -0,0 +1,140 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pdfplumber
+
+# Page text is extracted in a process pool (pdfminer is pure Python, so threads would share
+# one core) and cached per page under the sha256 of the file, so a re-uploaded or retried
+# PDF skips extraction entirely.
+# Usage: python -m ai.pdf_extraction <file.pdf>
+PDF_WORKERS = int(os.getenv("QG_PDF_WORKERS", min(4, os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("QG_PDF_PAGES_PER_TASK", 8))
+PDF_CACHE_DIR = os.getenv("QG_PDF_CACHE", "pdf_cache")
+PDF_CACHE_MAX_DOCUMENTS = int(os.getenv("QG_PDF_CACHE_MAX_DOCUMENTS", 200))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def clean_page_text(text):
+    text = re.sub(r'\s+', ' ', text or '').strip()
+    return re.sub(r'•', '*', text)
+
+
+def _extract_page_range(path, start, stop):
+    with pdfplumber.open(path) as pdf:
+        return [clean_page_text(pdf.pages[i].extract_text()) for i in range(start, stop)]
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def page_count(path):
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def _cache_path(digest):
+    return os.path.join(PDF_CACHE_DIR, f"{digest}.json")
+
+
+def cached_pages(digest):
+    path = _cache_path(digest)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            pages = json.load(f)["pages"]
+    except (OSError, ValueError, KeyError):
+        return None
+    os.utime(path)
+    return pages
+
+
+def store_pages(digest, pages):
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    tmp = f"{_cache_path(digest)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"pages": pages}, f)
+    os.replace(tmp, _cache_path(digest))
+    prune_cache()
+
+
+def prune_cache(max_documents=PDF_CACHE_MAX_DOCUMENTS):
+    entries = [os.path.join(PDF_CACHE_DIR, name) for name in os.listdir(PDF_CACHE_DIR) if name.endswith(".json")]
+    for path in sorted(entries, key=os.path.getmtime, reverse=True)[max_documents:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def iter_pages(path, digest=None):
+    # Yields (page index, page count, text) in page order. Page ranges are extracted in
+    # parallel, but each page is handed on as soon as it and every page before it are done.
+    # Closing the generator early cancels the ranges not yet started.
+    digest = digest or file_hash(path)
+    pages = cached_pages(digest)
+    if pages is not None:
+        for index, text in enumerate(pages):
+            yield index, len(pages), text
+        return
+    count = page_count(path)
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, count)) for start in range(0, count, PDF_PAGES_PER_TASK)]
+    futures = None
+    if PDF_WORKERS > 1 and len(ranges) > 1:
+        pool = _get_pool()
+        futures = [pool.submit(_extract_page_range, path, start, stop) for start, stop in ranges]
+    pages = []
+    try:
+        for i, (start, stop) in enumerate(ranges):
+            texts = futures[i].result() if futures else _extract_page_range(path, start, stop)
+            for text in texts:
+                yield len(pages), count, text
+                pages.append(text)
+    finally:
+        for future in futures or []:
+            future.cancel()
+    store_pages(digest, pages)
+
+
+def extract_text(path, digest=None, on_page=None):
+    # on_page(pages done, page count) is called as pages arrive, for progress reporting
+    texts = []
+    for index, count, text in iter_pages(path, digest):
+        if text:
+            texts.append(text)
+        if on_page is not None:
+            on_page(index + 1, count)
+    return " ".join(texts)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m ai.pdf_extraction <file.pdf>")
+        sys.exit(1)
+    digest = file_hash(sys.argv[1])
+    was_cached = cached_pages(digest) is not None
+    start = time.time()
+    text = extract_text(sys.argv[1], digest)
+    print(f"{page_count(sys.argv[1])} pages, {len(text)} characters in {time.time() - start:.2f}s "
+          f"({'cached' if was_cached else f'{PDF_WORKERS} workers'})")
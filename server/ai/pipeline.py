@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# A per-document graph of named stages with declared inputs. A stage is computed on first
+# request only, at most once even with concurrent readers, after its inputs. prefetch starts
+# stages, their inputs included, on a shared thread pool so independent stages overlap, e.g.
+# summarization on the T5 model while spaCy and pke run. Threads rather than processes: the
+# stages use the models loaded in this process, and the heavy ones release the GIL.
+PIPELINE_WORKERS = int(os.getenv("QG_PIPELINE_WORKERS", 4))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+        return _executor
+
+
+class Stage:
+    def __init__(self, name, compute, inputs=()):
+        self.name = name
+        self.compute = compute
+        self.inputs = tuple(inputs)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for name in stage.inputs:
+                if name not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {name}")
+        # Wall seconds spent computing each stage, its inputs excluded
+        self.timings = {}
+        self._values = {}
+        self._locks = {name: threading.Lock() for name in self.stages}
+
+    def done(self, name):
+        return name in self._values
+
+    def get(self, name):
+        if name in self._values:
+            return self._values[name]
+        stage = self.stages[name]
+        # Inputs are resolved before taking this stage's lock, so a thread only ever waits on
+        # a stage that another thread is computing, never on one that is queued
+        inputs = [self.get(dependency) for dependency in stage.inputs]
+        with self._locks[name]:
+            if name not in self._values:
+                start = time.perf_counter()
+                self._values[name] = stage.compute(*inputs)
+                self.timings[name] = round(time.perf_counter() - start, 4)
+        return self._values[name]
+
+    def _dependencies(self, names):
+        ordered = []
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in ordered:
+                ordered.append(name)
+                pending.extend(self.stages[name].inputs)
+        return ordered
+
+    def prefetch(self, *names):
+        # Starts the stages and everything they depend on in the background; errors surface
+        # when the stage is read with get
+        for name in reversed(self._dependencies(names)):
+            if not self.done(name):
+                _pool().submit(self._prefetch_one, name)
+
+    def _prefetch_one(self, name):
+        try:
+            self.get(name)
+        except Exception:
+            pass
@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import time
+import torch
+from ai.model_store import MODEL_SOURCES, load_model
+
+# Opt-in int8 dynamic quantization of the Linear layers, CPU only.
+# Usage: python -m ai.quantization [build|eval <text file>]
+QUANTIZE_MODELS = os.getenv("QG_QUANTIZE", "0") == "1"
+
+
+def quantize_model(model):
+    model = model.to("cpu").eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_quantized_model(name):
+    # Nothing int8 is persisted: the fp32 weights come from the safetensors store and are
+    # quantized again on every load, which is deterministic
+    model, tokenizer = load_model(name)
+    return quantize_model(model), tokenizer
+
+
+def evaluate(text, max_items=10):
+    # The pipeline's own in-process question and answer models are one of the two variants,
+    # so only the other one is loaded
+    from ai import question_generator as qg
+    qg.download_and_load_models(use_server=False)
+    loaded = {
+        "question": (qg.question_model, qg.question_tokenizer),
+        "answer": (qg.answer_model, qg.answer_tokenizer)
+    }
+    if QUANTIZE_MODELS and qg.device.type == "cpu":
+        variants = {
+            "fp32": {"question": load_model("t5_question"), "answer": load_model("t5_answer")},
+            "int8": loaded
+        }
+    else:
+        variants = {
+            "fp32": loaded,
+            "int8": {"question": load_quantized_model("t5_question"), "answer": load_quantized_model("t5_answer")}
+        }
+    analysis = qg.DocumentAnalysis(text)
+    answers = [keyword for keyword in analysis.keywords if len(keyword) > 1][:max_items]
+    items = []
+    for answer in answers:
+        context = next((chunk for chunk in analysis.chunks if answer.lower() in chunk.lower()), analysis.summary)
+        items.append((context, answer))
+    segments = analysis.chunks[:max_items]
+    results = {}
+    for variant, models in variants.items():
+        question_model, question_tokenizer = models["question"]
+        answer_model, answer_tokenizer = models["answer"]
+        qg.set_seed(42)
+        start = time.perf_counter()
+        mcq_questions = qg.get_improved_questions_batch(items, question_model, question_tokenizer)
+        descriptive_questions = qg.generate_descriptive_questions_batch(segments, question_model, question_tokenizer)
+        descriptive_answers = qg.generate_descriptive_answers_batch(descriptive_questions, text, answer_model, answer_tokenizer)
+        elapsed = time.perf_counter() - start
+        passed = sum(1 for question, answer in zip(descriptive_questions, descriptive_answers)
+                     if qg.assess_question_quality(question, answer, text)[0])
+        results[variant] = {
+            "mcq_questions": mcq_questions,
+            "descriptive_questions": descriptive_questions,
+            "descriptive_answers": descriptive_answers,
+            "quality_pass_rate": passed / max(1, len(descriptive_answers)),
+            "seconds": elapsed
+        }
+    fp32, int8 = results["fp32"], results["int8"]
+    matching = sum(1 for a, b in zip(fp32["mcq_questions"] + fp32["descriptive_questions"],
+                                     int8["mcq_questions"] + int8["descriptive_questions"]) if a == b)
+    total_questions = len(fp32["mcq_questions"]) + len(fp32["descriptive_questions"])
+    answer_similarity = 0.0
+    if fp32["descriptive_answers"]:
+        fp32_embeddings = qg.encode_texts(fp32["descriptive_answers"])
+        int8_embeddings = qg.encode_texts(int8["descriptive_answers"])
+        similarities = [float(qg.cosine_similarity([a], [b])[0][0]) for a, b in zip(fp32_embeddings, int8_embeddings)]
+        answer_similarity = sum(similarities) / len(similarities)
+    return {
+        "question_exact_match": matching / max(1, total_questions),
+        "answer_similarity": answer_similarity,
+        "quality_pass_rate": {"fp32": fp32["quality_pass_rate"], "int8": int8["quality_pass_rate"]},
+        "seconds": {"fp32": fp32["seconds"], "int8": int8["seconds"]},
+        "speedup": fp32["seconds"] / int8["seconds"] if int8["seconds"] else None
+    }
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+    if command == "build":
+        # Checks that every model quantizes; nothing is written
+        for model_name in MODEL_SOURCES:
+            start = time.perf_counter()
+            load_quantized_model(model_name)
+            print(f"Quantized {model_name} in {time.perf_counter() - start:.1f}s")
+    elif command == "eval" and len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            report = evaluate(f.read())
+        print(json.dumps(report, indent=2))
+    else:
+        print("Usage: python -m ai.quantization [build|eval <text file>]")
+        sys.exit(1)
@@ -1,9 +1,8 @@
 import warnings
+import logging
+import threading
 warnings.filterwarnings("ignore")
 import torch
-from transformers import T5ForConditionalGeneration, T5Tokenizer
-from sense2vec import Sense2Vec
-from sentence_transformers import SentenceTransformer
 import random
 import numpy as np
 import nltk
@@ -16,18 +15,33 @@ import traceback
 from flashtext import KeywordProcessor
 from collections import OrderedDict, Counter
 from sklearn.metrics.pairwise import cosine_similarity
-import pickle
 import os
 import sys
 import subprocess
-from strsimpy.normalized_levenshtein import NormalizedLevenshtein
 import spacy
-import pdfplumber
 import re
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
+from ai.embedding_cache import EmbeddingCache
+from ai.distractor_cache import DistractorCache, normalize_answer
+from ai.dedup_index import DedupIndex
+from ai.sentence_index import SentenceIndex
+from ai.pipeline import Pipeline, Stage
+from ai.decoding_budget import JOB_DEADLINE, DecodingBudget, decoding_kwargs, full_profile
+from ai.string_similarity import similarity_matrix, similarity_to_many
+from ai.model_store import MODEL_SOURCES, load_model, store_versions
+from ai.pdf_extraction import extract_text
+from ai.s2v_index import load_index
+from ai.s2v_store import has_source, load_store, read_meta, store_fingerprint
+from ai.quantization import QUANTIZE_MODELS, load_quantized_model
+from ai.inference_backend import GenerationBackend, TorchBackend, backend_kind, create_backend
+from ai.generation_scheduler import schedule
+from ai.inference_client import InferenceClient, RemoteBackend, RemoteSense2Vec, RemoteSentenceModel
+
+logger = logging.getLogger(__name__)
 
 # Global variables for models
 s2v = None
+s2v_version = None
 summary_model = None
 summary_tokenizer = None
 question_model = None
@@ -35,10 +49,40 @@ question_tokenizer = None
 answer_model = None
 answer_tokenizer = None
 sentence_transformer_model = None
+sentence_transformer_version = None
+summary_backend = None
+question_backend = None
+answer_backend = None
+# Set once every model above is loaded; the lock makes concurrent first callers (a job's
+# prefetch thread and its request thread) wait for one load instead of each starting one
+models_loaded = False
+_models_lock = threading.Lock()
 
 # Check for GPU availability
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# Number of prompts sent through a model per generate call
+QUESTION_BATCH_SIZE = int(os.getenv("QG_BATCH_SIZE", 8))
+DESCRIPTIVE_BATCH_SIZE = int(os.getenv("QG_DESCRIPTIVE_BATCH_SIZE", 4))
+
+# Long documents are summarized map-reduce over sentence-aligned chunks of at most
+# SUMMARY_CHUNK_TOKENS summary-model tokens; keywords are extracted per block of about
+# LONG_DOCUMENT_WORDS words once a document is longer than that
+SUMMARY_CHUNK_TOKENS = int(os.getenv("QG_SUMMARY_CHUNK_TOKENS", 480))
+SUMMARY_MAX_LEVELS = 3
+SUMMARY_MAX_CHUNKS = int(os.getenv("QG_SUMMARY_MAX_CHUNKS", 16))
+LONG_DOCUMENT_WORDS = int(os.getenv("QG_LONG_DOCUMENT_WORDS", 3000))
+
+# MCQ answers are screened (distractors, duplicates) before any question is generated for
+# them; only max_questions plus this many screened answers go to question generation up front
+MCQ_SCREEN_MARGIN = int(os.getenv("QG_MCQ_SCREEN_MARGIN", 3))
+
+# Every sentence_transformer_model.encode goes through this cache
+embedding_cache = EmbeddingCache(max_entries=int(os.getenv("QG_EMBEDDING_CACHE_SIZE", 20000)))
+
+# Context-free distractor candidates per answer term, shared across uploads and processes
+distractor_cache = DistractorCache()
+
 # Initialize spaCy
 try:
     nlp = spacy.load("en_core_web_sm")
@@ -54,6 +98,15 @@ nltk.download('stopwords', quiet=True)
 nltk.download('omw-1.4', quiet=True)
 
 # Helper functions
+def encode_texts(texts, model=None):
+    return embedding_cache.encode(model or sentence_transformer_model, texts, sentence_transformer_version)
+
+def embedding_model_version(quantize):
+    # Cached embeddings are keyed on the stored weights and precision, not on the model
+    # object, so they stay valid across reloads and never outlive a model change
+    version = store_versions().get("sentence_transformer") or MODEL_SOURCES["sentence_transformer"][0]
+    return f"{version}:{'int8' if quantize else 'fp32'}"
+
 def set_seed(seed):
     random.seed(seed)
     np.random.seed(seed)
@@ -68,26 +121,53 @@ def postprocesstext(content):
         final = final + " " + sent
     return final
 
-def summarizer(text, model, tokenizer):
+def token_chunks(text, backend, max_tokens=SUMMARY_CHUNK_TOKENS):
+    # Sentence-aligned chunks of at most max_tokens model tokens; a single longer sentence
+    # becomes a chunk of its own
+    sentences = sent_tokenize(text)
+    chunks = []
+    current = []
+    current_tokens = 0
+    for sentence, count in zip(sentences, backend.count_tokens_batch(sentences)):
+        if current and current_tokens + count > max_tokens:
+            chunks.append(" ".join(current))
+            current = []
+            current_tokens = 0
+        current.append(sentence)
+        current_tokens += count
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def summarize_texts(texts, model, tokenizer, min_length=75, max_length=300):
+    outs = generate_batch(["summarize: " + text for text in texts], model, tokenizer, max_input_length=512,
+                          early_stopping=True,
+                          num_beams=3,
+                          num_return_sequences=1,
+                          no_repeat_ngram_size=2,
+                          min_length=min_length,
+                          max_length=max_length)
+    return [postprocesstext(out[0]).strip() for out in outs]
+
+def summarizer(text, model, tokenizer, chunks=None):
+    # Map-reduce: every chunk is summarized in one batched generate call and the partial
+    # summaries are chunked and summarized again until they fit in a single input. Past
+    # SUMMARY_MAX_CHUNKS, evenly spaced chunks stand in for the whole document.
     text = text.strip().replace("\n", " ")
-    text = "summarize: " + text
-    max_len = 512
-    encoding = tokenizer.encode_plus(text, max_length=max_len, pad_to_max_length=False, 
-                                    truncation=True, return_tensors="pt").to(device)
-    input_ids, attention_mask = encoding["input_ids"], encoding["attention_mask"]
-    outs = model.generate(input_ids=input_ids,
-                         attention_mask=attention_mask,
-                         early_stopping=True,
-                         num_beams=3,
-                         num_return_sequences=1,
-                         no_repeat_ngram_size=2,
-                         min_length=75,
-                         max_length=300)
-    dec = [tokenizer.decode(ids, skip_special_tokens=True) for ids in outs]
-    summary = dec[0]
-    summary = postprocesstext(summary)
-    summary = summary.strip()
-    return summary
+    backend = resolve_backend(model, tokenizer)
+    if chunks is None:
+        chunks = token_chunks(text, backend)
+    if len(chunks) > SUMMARY_MAX_CHUNKS:
+        step = len(chunks) / SUMMARY_MAX_CHUNKS
+        chunks = [chunks[int(i * step)] for i in range(SUMMARY_MAX_CHUNKS)]
+    if len(chunks) > 1:
+        for _ in range(SUMMARY_MAX_LEVELS):
+            partial = summarize_texts(chunks, model, tokenizer, min_length=30, max_length=120)
+            chunks = token_chunks(" ".join(partial), backend)
+            if len(chunks) <= 1:
+                break
+        text = " ".join(chunks)
+    return summarize_texts([text], model, tokenizer)[0]
 
 def get_nouns_multipartite(content):
     out = []
@@ -111,50 +191,75 @@ def get_keywords(originaltext):
     keywords = get_nouns_multipartite(originaltext)
     return keywords
 
-def get_improved_question(context, answer, model, tokenizer, max_attempts=3):
-    problem_patterns = [
-        r"generate a specific question for",
-        r"specific question for",
-        r"question for this answer",
-        r"what question",
-        r"which question"
-    ]
-    prompt_templates = [
+def interleave(groups):
+    merged = []
+    for i in range(max((len(group) for group in groups), default=0)):
+        for group in groups:
+            if i < len(group):
+                merged.append(group[i])
+    return merged
+
+def balance_by_section(items, sections, key):
+    # Round-robin over the sections the items come from (the first section containing
+    # key(item)), so a selection cut short still covers the whole document. The order within
+    # a section is kept; with a single section this is the identity.
+    lowered = [section.lower() for section in sections]
+    groups = [[] for _ in range(len(sections) + 1)]
+    for item in items:
+        needle = key(item).lower()
+        index = next((i for i, section in enumerate(lowered) if needle in section), len(sections))
+        groups[index].append(item)
+    return interleave(groups)
+
+QUESTION_PROBLEM_PATTERNS = [
+    r"generate a specific question for",
+    r"specific question for",
+    r"question for this answer",
+    r"what question",
+    r"which question"
+]
+
+def resolve_backend(model, tokenizer=None):
+    if isinstance(model, GenerationBackend):
+        return model
+    for backend in (summary_backend, question_backend, answer_backend):
+        if backend is not None and getattr(backend, "model", None) is model:
+            return backend
+    return TorchBackend(model, tokenizer, device)
+
+def generate_batch(prompts, model, tokenizer, max_input_length=512, batch_size=QUESTION_BATCH_SIZE, **generate_kwargs):
+    return resolve_backend(model, tokenizer).generate(prompts, max_input_length=max_input_length,
+                                                      batch_size=batch_size, **decoding_kwargs(generate_kwargs))
+
+def question_prompt_templates(context, answer):
+    return [
         f"context: {context} answer: {answer} Generate a question for this answer.",
         f"Based on this context: {context} Create a question whose answer is: {answer}",
         f"From the text: {context} Generate a question that has the answer: {answer}",
     ]
-    for attempt in range(max_attempts):
-        text = prompt_templates[attempt % len(prompt_templates)]
-        encoding = tokenizer.encode_plus(text, max_length=512, pad_to_max_length=False, 
-                                        truncation=True, return_tensors="pt").to(device)
-        input_ids, attention_mask = encoding["input_ids"], encoding["attention_mask"]
-        outs = model.generate(input_ids=input_ids,
-                             attention_mask=attention_mask,
-                             early_stopping=True,
-                             num_beams=8,
-                             num_return_sequences=5,
-                             no_repeat_ngram_size=3,
-                             max_length=100)
-        questions = [tokenizer.decode(ids, skip_special_tokens=True) for ids in outs]
-        filtered_questions = []
-        for q in questions:
-            q = q.replace("question:", "").strip()
-            q = q.replace("Question:", "").strip()
-            has_problem = False
-            for pattern in problem_patterns:
-                if re.search(pattern, q, re.IGNORECASE):
-                    has_problem = True
-                    break
-            if not has_problem and len(q) > 10:
-                filtered_questions.append(q)
-        if filtered_questions:
-            best_question = max(filtered_questions, key=lambda q: len(q.split()))
-            if not best_question.endswith("?"):
-                best_question += "?"
-            best_question = best_question[0].upper() + best_question[1:]
-            if "?" in best_question and len(best_question.split()) > 3:
-                return best_question
+
+def select_best_question(questions):
+    filtered_questions = []
+    for q in questions:
+        q = q.replace("question:", "").strip()
+        q = q.replace("Question:", "").strip()
+        has_problem = False
+        for pattern in QUESTION_PROBLEM_PATTERNS:
+            if re.search(pattern, q, re.IGNORECASE):
+                has_problem = True
+                break
+        if not has_problem and len(q) > 10:
+            filtered_questions.append(q)
+    if filtered_questions:
+        best_question = max(filtered_questions, key=lambda q: len(q.split()))
+        if not best_question.endswith("?"):
+            best_question += "?"
+        best_question = best_question[0].upper() + best_question[1:]
+        if "?" in best_question and len(best_question.split()) > 3:
+            return best_question
+    return None
+
+def fallback_question(answer):
     answer_doc = nlp(answer)
     if any(ent.label_ == "PERSON" for ent in answer_doc.ents):
         fallback = f"Who is {answer}?"
@@ -164,6 +269,53 @@ def get_improved_question(context, answer, model, tokenizer, max_attempts=3):
         fallback = f"What is {answer}?"
     return fallback
 
+def get_improved_questions_batch(items, model, tokenizer, max_attempts=3, batch_size=QUESTION_BATCH_SIZE):
+    return [question for question, _ in
+            improved_questions_with_profiles(items, model, tokenizer, max_attempts=max_attempts, batch_size=batch_size)]
+
+def improved_questions_with_profiles(items, model, tokenizer, max_attempts=3, batch_size=QUESTION_BATCH_SIZE, budget=None,
+                                     stats=None):
+    # items are (context, answer) pairs; only the items whose candidates all fail
+    # filtering are retried, with the next prompt template, in the following pass. Each pass
+    # takes its beams, return sequences and retry limit from the budget, and every question
+    # comes back with the profile of the pass that produced it. stats["generate_passes"], when
+    # given, counts the prompts decoded, retries included.
+    results = [None] * len(items)
+    pending = list(range(len(items)))
+    profile = full_profile("mcq_question")
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        profile = budget.profile("mcq_question") if budget is not None else full_profile("mcq_question")
+        if attempt >= profile["max_attempts"]:
+            break
+        prompts = []
+        for i in pending:
+            templates = question_prompt_templates(*items[i])
+            prompts.append(templates[attempt % len(templates)])
+        if stats is not None:
+            stats["generate_passes"] += len(prompts)
+        outputs = generate_batch(prompts, model, tokenizer, max_input_length=512, batch_size=batch_size,
+                                 early_stopping=True,
+                                 num_beams=profile["num_beams"],
+                                 num_return_sequences=profile["num_return_sequences"],
+                                 no_repeat_ngram_size=3,
+                                 max_length=100)
+        still_pending = []
+        for i, questions in zip(pending, outputs):
+            best_question = select_best_question(questions)
+            if best_question:
+                results[i] = (best_question, {**profile, "attempts": attempt + 1})
+            else:
+                still_pending.append(i)
+        pending = still_pending
+    for i in pending:
+        results[i] = (fallback_question(items[i][1]), {**profile, "fallback": True})
+    return results
+
+def get_improved_question(context, answer, model, tokenizer, max_attempts=3):
+    return get_improved_questions_batch([(context, answer)], model, tokenizer, max_attempts=max_attempts)[0]
+
 def filter_same_sense_words(original, wordlist):
     filtered_words = []
     try:
@@ -181,32 +333,57 @@ def filter_same_sense_words(original, wordlist):
     return filtered_words
 
 def get_highest_similarity_score(wordlist, wrd):
-    normalized_levenshtein = NormalizedLevenshtein()
-    score = []
-    for each in wordlist:
-        try:
-            score.append(normalized_levenshtein.similarity(each.lower(), wrd.lower()))
-        except:
-            score.append(0)
-    return max(score) if score else 0
+    if not wordlist:
+        return 0
+    return float(similarity_to_many(wrd.lower(), [each.lower() for each in wordlist]).max())
 
-def sense2vec_get_words(word, s2v, topn, question):
-    output = []
+DISTRACTOR_SENSES = ["NOUN", "PERSON", "PRODUCT", "LOC", "ORG",
+                     "EVENT", "NORP", "WORK OF ART", "FAC", "GPE", "NUM", "FACILITY"]
+
+def distractor_candidates(word, s2v, topn=40):
+    # Context-free candidates for an answer: same-sense s2v neighbours and WordNet siblings.
+    # The neighbours depend only on the sense and WordNet lookups ignore case, so entries are
+    # keyed by the lowercased answer plus the sense, and on the s2v store and index they came from.
     try:
-        sense = s2v.get_best_sense(word, senses=["NOUN", "PERSON", "PRODUCT", "LOC", "ORG", 
-                                                "EVENT", "NORP", "WORK OF ART", "FAC", "GPE", "NUM", "FACILITY"])
-        most_similar = s2v.most_similar(sense, n=topn)
-        output = filter_same_sense_words(sense, most_similar)
+        sense = s2v.get_best_sense(word, senses=DISTRACTOR_SENSES)
     except:
-        output = []
+        sense = None
+    key = (normalize_answer(word), f"{sense or ''}:{topn}:{s2v_version}")
+    cached = distractor_cache.get(*key)
+    if cached is not None:
+        return cached
+    neighbours = []
+    complete = True
+    if sense is not None:
+        try:
+            neighbours = filter_same_sense_words(sense, s2v.most_similar(sense, n=topn))
+        except:
+            complete = False
+    candidates = {"s2v": neighbours, "wordnet": get_distractors_wordnet(word)}
+    if complete:
+        distractor_cache.put(*key, candidates)
+    return candidates
+
+def filter_sense2vec_words(word, output, question):
+    # Greedy pass keeping a neighbour when it is less than threshold similar to the answer and
+    # every neighbour kept so far; all the pairwise scores come from one matrix call
     threshold = 0.6
+    if not output:
+        return []
+    lowered = [x.lower() for x in output]
+    scores = similarity_matrix(lowered, [word.lower()] + lowered)
+    kept = [0]
     final = [word]
     checklist = question.split()
-    for x in output:
-        if get_highest_similarity_score(final, x) < threshold and x not in final and x not in checklist:
+    for i, x in enumerate(output):
+        if scores[i, kept].max() < threshold and x not in final and x not in checklist:
             final.append(x)
+            kept.append(i + 1)
     return final[1:]
 
+def sense2vec_get_words(word, s2v, topn, question):
+    return filter_sense2vec_words(word, distractor_candidates(word, s2v, topn)["s2v"], question)
+
 def mmr(doc_embedding, word_embeddings, words, top_n, lambda_param):
     word_doc_similarity = cosine_similarity(word_embeddings, doc_embedding)
     word_similarity = cosine_similarity(word_embeddings)
@@ -245,8 +422,9 @@ def get_distractors_wordnet(word):
     return distractors
 
 def get_improved_distractors(word, origsentence, sense2vecmodel, sentencemodel, top_n=40, lambdaval=0.2):
-    distractors_s2v = sense2vec_get_words(word, sense2vecmodel, top_n, origsentence)
-    distractors_wordnet = get_distractors_wordnet(word)
+    candidates = distractor_candidates(word, sense2vecmodel, top_n)
+    distractors_s2v = filter_sense2vec_words(word, candidates["s2v"], origsentence)
+    distractors_wordnet = candidates["wordnet"]
     all_distractors = list(set(distractors_s2v + distractors_wordnet))
     if len(all_distractors) < 3:
         try:
@@ -268,9 +446,9 @@ def get_improved_distractors(word, origsentence, sense2vecmodel, sentencemodel,
         return []
     try:
         embedding_sentence = origsentence + " " + word.capitalize()
-        keyword_embedding = sentencemodel.encode([embedding_sentence])
+        keyword_embedding = encode_texts([embedding_sentence], sentencemodel)
         if all_distractors:
-            distractor_embeddings = sentencemodel.encode(all_distractors)
+            distractor_embeddings = encode_texts(all_distractors, sentencemodel)
             max_distractors = min(len(all_distractors), 5)
             filtered_distractors = mmr(keyword_embedding, distractor_embeddings, all_distractors, max_distractors, lambdaval)
             final_distractors = []
@@ -284,8 +462,8 @@ def get_improved_distractors(word, origsentence, sense2vecmodel, sentencemodel,
 
 def assess_question_difficulty(answer, distractors, sentencemodel):
     try:
-        answer_embedding = sentencemodel.encode([answer])[0].reshape(1, -1)
-        distractor_embeddings = sentencemodel.encode(distractors)
+        answer_embedding = encode_texts([answer], sentencemodel)[0].reshape(1, -1)
+        distractor_embeddings = encode_texts(distractors, sentencemodel)
         similarities = cosine_similarity(answer_embedding, distractor_embeddings)[0]
         max_similarity = max(similarities) if len(similarities) > 0 else 0
         if max_similarity > 0.9:
@@ -313,19 +491,49 @@ def preprocess_context(text):
         chunks.append(current_chunk.strip())
     return chunks
 
-def extract_key_segments(text, keywords, num_segments=100, min_length=40, max_length=250):
-    sentences = sent_tokenize(text)
-    sentence_embeddings = sentence_transformer_model.encode(sentences)
-    sentence_scores = []
-    for i, sentence in enumerate(sentences):
-        score = 0
-        for keyword in keywords:
-            if keyword.lower() in sentence.lower():
-                score += 1
-        keyword_embeddings = sentence_transformer_model.encode([" ".join(keywords)])
-        semantic_score = cosine_similarity([sentence_embeddings[i]], keyword_embeddings)[0][0]
-        combined_score = score + (semantic_score * 3)
-        sentence_scores.append((sentence, combined_score, i))
+def count_keyword_hits(sentences, keywords):
+    # Same counts as checking `keyword.lower() in sentence.lower()` for every pair, but with
+    # one scan of the joined document per distinct keyword instead of one per sentence
+    hits = np.zeros(len(sentences))
+    if not sentences:
+        return hits
+    lowered = [sentence.lower() for sentence in sentences]
+    joined = "\x00".join(lowered)
+    starts = np.cumsum([0] + [len(sentence) + 1 for sentence in lowered[:-1]])
+    for keyword, weight in Counter(keyword.lower() for keyword in keywords).items():
+        if not keyword:
+            hits += weight
+            continue
+        pos = joined.find(keyword)
+        while pos != -1:
+            idx = int(np.searchsorted(starts, pos, side="right")) - 1
+            hits[idx] += weight
+            if idx + 1 >= len(starts):
+                break
+            pos = joined.find(keyword, int(starts[idx + 1]))
+    return hits
+
+def cosine_scores(matrix, vector):
+    if len(matrix) == 0:
+        return np.zeros(0)
+    matrix_norms = np.linalg.norm(matrix, axis=1)
+    matrix_norms[matrix_norms == 0] = 1
+    vector_norm = np.linalg.norm(vector) or 1
+    return (matrix @ vector) / (matrix_norms * vector_norm)
+
+def extract_key_segments(text, keywords, num_segments=100, min_length=40, max_length=250, analysis=None):
+    rng = analysis.rng if analysis is not None else random
+    if analysis is not None:
+        sentences = analysis.sentences
+        sentence_embeddings = analysis.sentence_embeddings
+    else:
+        sentences = sent_tokenize(text)
+        sentence_embeddings = encode_texts(sentences)
+    keyword_scores = count_keyword_hits(sentences, keywords)
+    keyword_embedding = encode_texts([" ".join(keywords)])[0]
+    semantic_scores = cosine_scores(sentence_embeddings, keyword_embedding)
+    combined_scores = keyword_scores + (semantic_scores * 3)
+    sentence_scores = [(sentence, float(combined_scores[i]), i) for i, sentence in enumerate(sentences)]
     sentence_scores.sort(key=lambda x: (x[1], -x[2]), reverse=True)
     segments = []
     used_indices = set()
@@ -334,7 +542,7 @@ def extract_key_segments(text, keywords, num_segments=100, min_length=40, max_le
             break
         if idx in used_indices:
             continue
-        context_size = random.randint(1, 3)
+        context_size = rng.randint(1, 3)
         start_idx = max(0, idx - context_size)
         end_idx = min(len(sentences), idx + context_size + 1)
         overlap_count = sum(1 for i in range(start_idx, end_idx) if i in used_indices)
@@ -355,7 +563,7 @@ def extract_key_segments(text, keywords, num_segments=100, min_length=40, max_le
                     segments.append(segment)
     return segments
 
-def generate_descriptive_question(context, model, tokenizer):
+def descriptive_question_prompt(context, rng=random):
     prompt_templates = [
         f"generate an educational question based on this text: {context}",
         f"create a factual question that tests knowledge from this text: {context}",
@@ -363,18 +571,9 @@ def generate_descriptive_question(context, model, tokenizer):
         f"ask a question that would help someone understand this material: {context}",
         f"generate a question that assesses understanding of this content: {context}"
     ]
-    prompt = random.choice(prompt_templates)
-    encoding = tokenizer.encode_plus(prompt, max_length=512, pad_to_max_length=False, 
-                                    truncation=True, return_tensors="pt").to(device)
-    input_ids, attention_mask = encoding["input_ids"], encoding["attention_mask"]
-    outs = model.generate(input_ids=input_ids,
-                         attention_mask=attention_mask,
-                         early_stopping=True,
-                         num_beams=5,
-                         num_return_sequences=5,
-                         no_repeat_ngram_size=2,
-                         max_length=100)
-    questions = [tokenizer.decode(ids, skip_special_tokens=True) for ids in outs]
+    return rng.choice(prompt_templates)
+
+def select_descriptive_question(questions, context):
     filtered_questions = []
     for q in questions:
         q = q.strip()
@@ -400,79 +599,102 @@ def generate_descriptive_question(context, model, tokenizer):
         return fallback
     return max(filtered_questions, key=lambda q: len(q.split()))
 
+def generate_descriptive_questions_batch(contexts, model, tokenizer, batch_size=DESCRIPTIVE_BATCH_SIZE, profile=None,
+                                         rng=random):
+    profile = profile or full_profile("descriptive_question")
+    prompts = [descriptive_question_prompt(context, rng) for context in contexts]
+    outputs = generate_batch(prompts, model, tokenizer, max_input_length=512, batch_size=batch_size,
+                             early_stopping=True,
+                             num_beams=profile["num_beams"],
+                             num_return_sequences=profile["num_return_sequences"],
+                             no_repeat_ngram_size=2,
+                             max_length=100)
+    return [select_descriptive_question(questions, context) for questions, context in zip(outputs, contexts)]
+
+def generate_descriptive_question(context, model, tokenizer):
+    return generate_descriptive_questions_batch([context], model, tokenizer)[0]
+
+def new_dedup_index(threshold=0.85):
+    return DedupIndex(encode_texts, threshold=threshold)
+
 def is_duplicate(new_question, existing_questions, threshold=0.85):
+    if isinstance(existing_questions, DedupIndex):
+        return existing_questions.is_duplicate(new_question)
     if not existing_questions:
         return False
-    normalized_levenshtein = NormalizedLevenshtein()
-    existing_texts = [q["question"] for q in existing_questions]
-    for existing in existing_texts:
-        similarity = normalized_levenshtein.similarity(new_question.lower(), existing.lower())
-        if similarity > threshold:
-            return True
-    new_embedding = sentence_transformer_model.encode([new_question])
-    existing_embeddings = sentence_transformer_model.encode(existing_texts)
-    similarities = cosine_similarity(new_embedding, existing_embeddings)[0]
-    if max(similarities) > threshold:
-        return True
-    return False
-
-def select_relevant_sentences(question, context, num_sentences=8):
+    index = new_dedup_index(threshold)
+    index.extend(existing_questions)
+    return index.is_duplicate(new_question)
+
+def build_sentence_index(context):
     sentences = sent_tokenize(context)
-    if len(sentences) <= num_sentences:
+    return SentenceIndex(context, sentences, encode_texts(sentences) if sentences else None, encode_texts)
+
+def select_relevant_sentences(question, context, num_sentences=8, index=None):
+    if index is None:
+        index = build_sentence_index(context)
+    if len(index) <= num_sentences:
         return context
-    question_embedding = sentence_transformer_model.encode([question])
-    sentence_embeddings = sentence_transformer_model.encode(sentences)
-    similarities = cosine_similarity(question_embedding, sentence_embeddings)[0]
-    top_indices = similarities.argsort()[-num_sentences:][::-1]
-    top_indices = sorted(top_indices)
-    extended_indices = set()
-    for idx in top_indices:
-        extended_indices.add(idx)
-        if idx > 0:
-            extended_indices.add(idx - 1)
-        if idx < len(sentences) - 1:
-            extended_indices.add(idx + 1)
-    extended_indices = sorted(list(extended_indices))
-    if len(extended_indices) > num_sentences + 4:
-        sorted_extended = sorted(extended_indices, key=lambda i: similarities[i], reverse=True)
-        extended_indices = sorted(sorted_extended[:num_sentences + 4])
-    selected_context = " ".join([sentences[i] for i in extended_indices])
-    return selected_context
+    return index.select(encode_texts([question])[0], num_sentences)
 
-def generate_descriptive_answer(question, context, model, tokenizer):
-    selected_context = select_relevant_sentences(question, context, num_sentences=8)
+def descriptive_answer_prompt(question, selected_context, rng=random):
     prompt_templates = [
         f"Answer this question in detail based on the given information. Question: {question} Context: {selected_context} Answer:",
         f"Using only the provided context, answer this question thoroughly. Question: {question} Context: {selected_context} Answer:",
         f"Based on the following information, provide a comprehensive answer to this question. Question: {question} Context: {selected_context} Answer:"
     ]
-    prompt = random.choice(prompt_templates)
-    encoding = tokenizer.encode_plus(prompt, max_length=768, pad_to_max_length=False, 
-                                    truncation=True, return_tensors="pt").to(device)
-    input_ids, attention_mask = encoding["input_ids"], encoding["attention_mask"]
-    outs = model.generate(input_ids=input_ids,
-                         attention_mask=attention_mask,
-                         early_stopping=True,
-                         num_beams=5,
-                         length_penalty=1.5,
-                         no_repeat_ngram_size=3,
-                         min_length=50,
-                         max_length=250)
-    answer = tokenizer.decode(outs[0], skip_special_tokens=True)
+    return rng.choice(prompt_templates)
+
+def clean_descriptive_answer(answer):
     answer = postprocesstext(answer)
     answer = re.sub(r"^(The answer is|Answer:|Based on the context|According to the context)", "", answer).strip()
     answer = re.sub(r'([a-z])([A-Z])', r'\1 \2', answer)
     answer = re.sub(r'\.([a-zA-Z])', r'. \1', answer)
     return answer
 
-def assess_question_quality(question, answer, context):
+def generate_descriptive_answers_batch(questions, context, model, tokenizer, batch_size=DESCRIPTIVE_BATCH_SIZE, index=None,
+                                       profile=None, rng=random):
+    # Every question's context comes from one sentence index over the document, and the
+    # questions are encoded in a single call
+    if index is None:
+        index = build_sentence_index(context)
+    question_embeddings = encode_texts(questions) if len(index) > 8 else [None] * len(questions)
+    prompts = []
+    for question, embedding in zip(questions, question_embeddings):
+        selected_context = index.select(embedding, num_sentences=8)
+        prompts.append(descriptive_answer_prompt(question, selected_context, rng))
+    profile = profile or full_profile("descriptive_answer")
+    # Bucket prompts of similar token length together so each padded batch wastes little compute
+    backend = resolve_backend(model, tokenizer)
+    unique_prompts = list(dict.fromkeys(prompts))
+    counts = dict(zip(unique_prompts, backend.count_tokens_batch(unique_prompts)))
+    lengths = [min(counts[prompt], 768) for prompt in prompts]
+    order = sorted(range(len(prompts)), key=lambda i: lengths[i])
+    answers = [None] * len(prompts)
+    for start in range(0, len(order), batch_size):
+        bucket = order[start:start + batch_size]
+        outputs = generate_batch([prompts[i] for i in bucket], backend, None, max_input_length=768, batch_size=batch_size,
+                                 early_stopping=True,
+                                 num_beams=profile["num_beams"],
+                                 length_penalty=1.5,
+                                 no_repeat_ngram_size=3,
+                                 min_length=50,
+                                 max_length=profile["max_length"])
+        for i, outs in zip(bucket, outputs):
+            answers[i] = clean_descriptive_answer(outs[0])
+    return answers
+
+def generate_descriptive_answer(question, context, model, tokenizer):
+    return generate_descriptive_answers_batch([question], context, model, tokenizer)[0]
+
+def assess_question_quality(question, answer, context, index=None):
     if len(question.split()) < 3:
         return False, "Question too short"
     if len(answer.split()) < 8:
         return False, "Answer too short"
-    question_embedding = sentence_transformer_model.encode([question])
-    answer_embedding = sentence_transformer_model.encode([answer])
-    context_embedding = sentence_transformer_model.encode([context])
+    question_embedding = encode_texts([question])
+    answer_embedding = encode_texts([answer])
+    context_embedding = [index.document_embedding] if index is not None else encode_texts([context])
     q_a_similarity = cosine_similarity(question_embedding, answer_embedding)[0][0]
     a_c_similarity = cosine_similarity(answer_embedding, context_embedding)[0][0]
     if q_a_similarity < 0.15:
@@ -487,7 +709,7 @@ def assess_question_quality(question, answer, context):
         return False, "Formatting issues detected"
     sentences = sent_tokenize(answer)
     if len(sentences) >= 3:
-        sentence_embeddings = sentence_transformer_model.encode(sentences)
+        sentence_embeddings = encode_texts(sentences)
         avg_similarity = 0
         comparisons = 0
         for i in range(len(sentences)):
@@ -500,21 +722,31 @@ def assess_question_quality(question, answer, context):
                 return False, "Answer lacks coherence between sentences"
     return True, "Good quality"
 
-def download_and_load_models():
-    global s2v, summary_model, summary_tokenizer, question_model, question_tokenizer, answer_model, answer_tokenizer, sentence_transformer_model
-    print("Loading sentence transformer model...")
-    if os.path.exists("sentence_transformer_model.pkl"):
-        with open("sentence_transformer_model.pkl", 'rb') as f:
-            sentence_transformer_model = pickle.load(f)
-    else:
-        sentence_transformer_model = SentenceTransformer("sentence-transformers/msmarco-distilbert-base-v2")
-        with open("sentence_transformer_model.pkl", 'wb') as f:
-            pickle.dump(sentence_transformer_model, f)
-    print("Loading sense2vec model...")
-    if os.path.exists('s2v_old') and os.path.isdir('s2v_old'):
+def download_sense2vec():
+    import gdown
+    import tarfile
+    url = 'https://github.com/explosion/sense2vec/releases/download/v1.0.0/s2v_reddit_2015_md.tar.gz'
+    gdown.download(url, 's2v_reddit_2015_md.tar.gz', quiet=False)
+    with tarfile.open('s2v_reddit_2015_md.tar.gz', "r:gz") as tar:
+        tar.extractall(path="./")
+    extracted_files = os.listdir("./")
+    s2v_dir = None
+    for item in extracted_files:
+        if os.path.isdir(item) and (item.startswith("s2v_") and item != 's2v_old'):
+            s2v_dir = item
+            break
+    if s2v_dir:
+        if os.path.exists('s2v_old'):
+            import shutil
+            shutil.rmtree('s2v_old')
+        os.rename(s2v_dir, 's2v_old')
+
+def load_sense2vec():
+    if has_source('s2v_old') or read_meta() is not None:
         try:
-            s2v = Sense2Vec().from_disk('s2v_old')
+            model = load_store('s2v_old')
             print("Successfully loaded existing sense2vec model from s2v_old")
+            return load_index(model)
         except Exception as e:
             print(f"Error loading existing model: {e}")
             print("Will download and extract the model again")
@@ -523,114 +755,204 @@ def download_and_load_models():
                 if os.path.exists('s2v_old_backup'):
                     shutil.rmtree('s2v_old_backup')
                 os.rename('s2v_old', 's2v_old_backup')
-            import gdown
-            import tarfile
-            url = 'https://github.com/explosion/sense2vec/releases/download/v1.0.0/s2v_reddit_2015_md.tar.gz'
-            gdown.download(url, 's2v_reddit_2015_md.tar.gz', quiet=False)
-            with tarfile.open('s2v_reddit_2015_md.tar.gz', "r:gz") as tar:
-                tar.extractall(path="./")
-            extracted_files = os.listdir("./")
-            s2v_dir = None
-            for item in extracted_files:
-                if os.path.isdir(item) and (item.startswith("s2v_") and item != 's2v_old'):
-                    s2v_dir = item
-                    break
-            if s2v_dir:
-                if os.path.exists('s2v_old'):
-                    import shutil
-                    shutil.rmtree('s2v_old')
-                os.rename(s2v_dir, 's2v_old')
-            s2v = Sense2Vec().from_disk('s2v_old')
-    else:
-        import gdown
-        import tarfile
-        url = 'https://github.com/explosion/sense2vec/releases/download/v1.0.0/s2v_reddit_2015_md.tar.gz'
-        gdown.download(url, 's2v_reddit_2015_md.tar.gz', quiet=False)
-        with tarfile.open('s2v_reddit_2015_md.tar.gz', "r:gz") as tar:
-            tar.extractall(path="./")
-        extracted_files = os.listdir("./")
-        s2v_dir = None
-        for item in extracted_files:
-            if os.path.isdir(item) and (item.startswith("s2v_") and item != 's2v_old'):
-                s2v_dir = item
-                break
-        if s2v_dir:
-            if os.path.exists('s2v_old'):
-                import shutil
-                shutil.rmtree('s2v_old')
-            os.rename(s2v_dir, 's2v_old')
-        s2v = Sense2Vec().from_disk('s2v_old')
+    download_sense2vec()
+    return load_index(load_store('s2v_old'))
+
+def load_generation_model(name, load):
+    # Local backends go through the model's generation scheduler, which batches concurrent
+    # callers and serializes generate calls
+    if backend_kind(name) != "torch":
+        backend = create_backend(name)
+        return backend.model, backend.tokenizer, schedule(name, backend)
+    model, tokenizer = load(name)
+    model = model.to(device)
+    return model, tokenizer, schedule(name, TorchBackend(model, tokenizer, device))
+
+def use_inference_server(client):
+    global s2v, summary_model, summary_tokenizer, question_model, question_tokenizer, answer_model, answer_tokenizer, sentence_transformer_model
+    global sentence_transformer_version, s2v_version, summary_backend, question_backend, answer_backend
+    quantize = QUANTIZE_MODELS and device.type == "cpu"
+    load = load_quantized_model if quantize else load_model
+    sentence_transformer_version = embedding_model_version(quantize)
+    sentence_transformer_model = RemoteSentenceModel(client, fallback=lambda: load("sentence_transformer")[0])
+    s2v = RemoteSense2Vec(client, fallback=load_sense2vec)
+    s2v_version = store_fingerprint()
+    summary_backend = RemoteBackend(client, "t5_summary", fallback=lambda: load_generation_model("t5_summary", load)[2])
+    question_backend = RemoteBackend(client, "t5_question", fallback=lambda: load_generation_model("t5_question", load)[2])
+    answer_backend = RemoteBackend(client, "t5_answer", fallback=lambda: load_generation_model("t5_answer", load)[2])
+    summary_model, summary_tokenizer = summary_backend, None
+    question_model, question_tokenizer = question_backend, None
+    answer_model, answer_tokenizer = answer_backend, None
+
+def download_and_load_models(use_server=True):
+    # Loads the models once per process; later calls return at once
+    global models_loaded
+    with _models_lock:
+        if not models_loaded:
+            _load_models(use_server)
+            models_loaded = True
+
+def _load_models(use_server):
+    global s2v, summary_model, summary_tokenizer, question_model, question_tokenizer, answer_model, answer_tokenizer, sentence_transformer_model
+    global sentence_transformer_version, s2v_version, summary_backend, question_backend, answer_backend
+    if use_server:
+        client = InferenceClient()
+        if client.ready():
+            print(f"Using inference server at {client.address}")
+            use_inference_server(client)
+            return
+        if client.address:
+            print(f"Inference server at {client.address} is not ready, loading models in-process")
+    quantize = QUANTIZE_MODELS and device.type == "cpu"
+    load = load_quantized_model if quantize else load_model
+    if quantize:
+        print("Using int8 dynamically quantized models")
+    print("Loading sentence transformer model...")
+    sentence_transformer_model, _ = load("sentence_transformer")
+    sentence_transformer_version = embedding_model_version(quantize)
+    print("Loading sense2vec model...")
+    s2v = load_sense2vec()
+    s2v_version = store_fingerprint()
     print("Loading summary model...")
-    if os.path.exists("t5_summary_model.pkl"):
-        with open('t5_summary_model.pkl', 'rb') as f:
-            summary_model = pickle.load(f)
-    else:
-        summary_model = T5ForConditionalGeneration.from_pretrained('t5-base')
-        with open("t5_summary_model.pkl", 'wb') as f:
-            pickle.dump(summary_model, f)
-    print("Loading summary tokenizer...")
-    if os.path.exists("t5_summary_tokenizer.pkl"):
-        with open('t5_summary_tokenizer.pkl', 'rb') as f:
-            summary_tokenizer = pickle.load(f)
-    else:
-        summary_tokenizer = T5Tokenizer.from_pretrained('t5-base')
-        with open("t5_summary_tokenizer.pkl", 'wb') as f:
-            pickle.dump(summary_tokenizer, f)
+    summary_model, summary_tokenizer, summary_backend = load_generation_model("t5_summary", load)
     print("Loading question model...")
-    if os.path.exists("t5_question_model.pkl"):
-        with open('t5_question_model.pkl', 'rb') as f:
-            question_model = pickle.load(f)
-    else:
-        question_model = T5ForConditionalGeneration.from_pretrained('ramsrigouthamg/t5_squad_v1')
-        with open("t5_question_model.pkl", 'wb') as f:
-            pickle.dump(question_model, f)
-    print("Loading question tokenizer...")
-    if os.path.exists("t5_question_tokenizer.pkl"):
-        with open('t5_question_tokenizer.pkl', 'rb') as f:
-            question_tokenizer = pickle.load(f)
-    else:
-        question_tokenizer = T5Tokenizer.from_pretrained('ramsrigouthamg/t5_squad_v1')
-        with open("t5_question_tokenizer.pkl", 'wb') as f:
-            pickle.dump(question_tokenizer, f)
+    question_model, question_tokenizer, question_backend = load_generation_model("t5_question", load)
     print("Loading answer model...")
-    if os.path.exists("t5_answer_model.pkl"):
-        with open('t5_answer_model.pkl', 'rb') as f:
-            answer_model = pickle.load(f)
-    else:
-        answer_model = T5ForConditionalGeneration.from_pretrained('google/flan-t5-large')
-        with open("t5_answer_model.pkl", 'wb') as f:
-            pickle.dump(answer_model, f)
-    print("Loading answer tokenizer...")
-    if os.path.exists("t5_answer_tokenizer.pkl"):
-        with open('t5_answer_tokenizer.pkl', 'rb') as f:
-            answer_tokenizer = pickle.load(f)
-    else:
-        answer_tokenizer = T5Tokenizer.from_pretrained('google/flan-t5-large')
-        with open("t5_answer_tokenizer.pkl", 'wb') as f:
-            pickle.dump(answer_tokenizer, f)
-    summary_model = summary_model.to(device)
-    question_model = question_model.to(device)
-    answer_model = answer_model.to(device)
+    answer_model, answer_tokenizer, answer_backend = load_generation_model("t5_answer", load)
     print("All models loaded successfully!")
 
-def get_mcq_questions(context, max_questions=10) -> List[Dict]:
-    global s2v, summary_model, summary_tokenizer, question_model, question_tokenizer, sentence_transformer_model
-    if s2v is None or summary_model is None:
-        download_and_load_models()
-    chunks = preprocess_context(context)
-    summarized_text = summarizer(context, summary_model, summary_tokenizer)
-    imp_keywords = get_keywords(context)
+MCQ_ENTITY_LABELS = ["PERSON", "ORG", "GPE", "LOC", "PRODUCT", "EVENT", "DATE"]
+
+class DocumentAnalysis:
+    # Per-upload artifacts shared by the MCQ and descriptive generators, as stages of a
+    # pipeline: each one is computed on first access only, at most once even with concurrent
+    # readers, and prefetch overlaps the independent ones. The models must be loaded
+    # (download_and_load_models) before any stage runs. The decoding budget runs from
+    # started_at, when the job started, or else from the analysis. rng makes the job's random
+    # choices (answer order, prompt templates, context windows); seeding it makes the job
+    # repeatable without touching the process-wide generators other jobs use.
+    def __init__(self, text, deadline=JOB_DEADLINE, seed=None, started_at=None):
+        self.text = text
+        self.rng = random.Random(seed)
+        self.budget = DecodingBudget(deadline, started_at)
+        self.pipeline = Pipeline([
+            Stage("sentences", lambda: sent_tokenize(self.text)),
+            Stage("chunks", lambda: preprocess_context(self.text)),
+            Stage("sections", self._sections),
+            Stage("summary", self._summarize, inputs=["sections"]),
+            Stage("keywords", self._keywords, inputs=["sections"]),
+            Stage("doc", lambda: nlp(self.text)),
+            Stage("entities", lambda doc: [(ent.text, ent.label_) for ent in doc.ents], inputs=["doc"]),
+            Stage("sentence_embeddings", self._encode_sentences, inputs=["sentences"]),
+            Stage("sentence_index", lambda sentences, embeddings: SentenceIndex(self.text, sentences, embeddings,
+                                                                                encode_texts),
+                  inputs=["sentences", "sentence_embeddings"])
+        ])
+        # Per-job counters reported by the generators, stored with the job along with the
+        # pipeline's stage timings
+        self.metrics = {}
+
+    def prefetch(self, *names):
+        self.pipeline.prefetch(*names)
+
+    def _summarize(self, sections):
+        return summarizer(self.text, summary_model, summary_tokenizer, chunks=sections)
+
+    def _sections(self):
+        return token_chunks(self.text.strip().replace("\n", " "), summary_backend)
+
+    def _keywords(self, sections):
+        # pke ranks candidates over the whole text, which gets slow past a few thousand words,
+        # so longer documents are ranked per block of sections and the rankings interleaved.
+        # Only those use the sections, but every generator prefetches them anyway, so declaring
+        # the input costs short documents nothing.
+        if len(self.text.split()) <= LONG_DOCUMENT_WORDS:
+            return get_keywords(self.text)
+        blocks = [[]]
+        for section in sections:
+            if blocks[-1] and sum(len(s.split()) for s in blocks[-1]) + len(section.split()) > LONG_DOCUMENT_WORDS:
+                blocks.append([])
+            blocks[-1].append(section)
+        ranked = [get_keywords(" ".join(block)) for block in blocks]
+        return list(dict.fromkeys(interleave(ranked)))
+
+    def _encode_sentences(self, sentences):
+        return encode_texts(sentences)
+
+    @property
+    def sentences(self):
+        return self.pipeline.get("sentences")
+
+    @property
+    def chunks(self):
+        return self.pipeline.get("chunks")
+
+    @property
+    def sections(self):
+        return self.pipeline.get("sections")
+
+    @property
+    def summary(self):
+        return self.pipeline.get("summary")
+
+    @property
+    def keywords(self):
+        return self.pipeline.get("keywords")
+
+    @property
+    def doc(self):
+        return self.pipeline.get("doc")
+
+    @property
+    def entities(self):
+        return self.pipeline.get("entities")
+
+    @property
+    def sentence_embeddings(self):
+        return self.pipeline.get("sentence_embeddings")
+
+    @property
+    def sentence_index(self):
+        return self.pipeline.get("sentence_index")
+
+def screen_mcq_candidates(candidates, stats, similarity_threshold=0.85):
+    # Yields (context, answer, distractors) for candidates with at least three distractors
+    # whose answer is not a near-copy of one already yielded. Distractors depend only on the
+    # answer and its context, so this runs before, and in place of, the question beam search
+    # that used to be spent on answers rejected afterwards.
+    accepted = []
+    for relevant_context, answer in candidates:
+        stats["screened"] += 1
+        normalized = normalize_answer(answer)
+        if accepted and similarity_to_many(normalized, accepted).max() > similarity_threshold:
+            stats["duplicate_answers"] += 1
+            continue
+        distractors = get_improved_distractors(answer, relevant_context, s2v, sentence_transformer_model)
+        if len(distractors) < 3:
+            stats["too_few_distractors"] += 1
+            continue
+        accepted.append(normalized)
+        yield relevant_context, answer, distractors[:3]
+
+def get_mcq_questions(context, max_questions=10, batch_size=QUESTION_BATCH_SIZE, analysis=None, on_question=None) -> List[Dict]:
+    download_and_load_models()
+    if analysis is None:
+        analysis = DocumentAnalysis(context)
+    # Keywords (pke), entities (spaCy) and chunks do not depend on each other; the summary is
+    # only computed if some answer is found in no chunk
+    analysis.prefetch("chunks", "keywords", "entities", "sections")
+    chunks = analysis.chunks
+    imp_keywords = analysis.keywords
     entities = []
-    doc = nlp(context)
-    for ent in doc.ents:
-        if ent.label_ in ["PERSON", "ORG", "GPE", "LOC", "PRODUCT", "EVENT", "DATE"]:
-            entities.append(ent.text)
+    for text, label in analysis.entities:
+        if label in MCQ_ENTITY_LABELS:
+            entities.append(text)
     all_answers = list(set(imp_keywords + entities))
-    random.shuffle(all_answers)
-    qualified_questions = []
+    analysis.rng.shuffle(all_answers)
+    keyword_set = {normalize_answer(k) for k in imp_keywords}
+    entity_set = {normalize_answer(e) for e in entities}
+    candidates = []
     for answer in all_answers:
-        if len(qualified_questions) >= max_questions:
-            break
         if len(answer) < 2 or all(c in string.punctuation for c in answer):
             continue
         relevant_context = ""
@@ -638,48 +960,164 @@ def get_mcq_questions(context, max_questions=10) -> List[Dict]:
             if answer.lower() in chunk.lower():
                 relevant_context = chunk
                 break
+        # Answers that are both keywords and entities, and answers found in a chunk rather
+        # than only in the summary, are screened first
+        normalized = normalize_answer(answer)
+        rank = 2 * (normalized in keyword_set and normalized in entity_set) + bool(relevant_context)
         if not relevant_context:
-            relevant_context = summarized_text
-        question = get_improved_question(relevant_context, answer, question_model, question_tokenizer)
-        if not question or len(question.split()) < 4 or question.lower().startswith("what question"):
+            relevant_context = analysis.summary
+        candidates.append((rank, relevant_context, answer))
+    candidates.sort(key=lambda candidate: -candidate[0])
+    candidates = [(relevant_context, answer) for _, relevant_context, answer in candidates]
+    candidates = balance_by_section(candidates, analysis.sections, key=lambda candidate: candidate[1])
+    stats = {"candidates": len(candidates), "screened": 0, "duplicate_answers": 0, "too_few_distractors": 0,
+             "generated": 0, "generate_passes": 0, "saved_generate_calls": 0}
+    screened = screen_mcq_candidates(candidates, stats)
+    qualified_questions = []
+    dedup_index = new_dedup_index()
+    # Screened answers still allowed into question generation before the shortfall is checked
+    allowance = max_questions + MCQ_SCREEN_MARGIN
+    while len(qualified_questions) < max_questions:
+        if analysis.budget.expired() and stats["generated"]:
+            break
+        if allowance <= 0:
+            allowance = max_questions - len(qualified_questions)
+        window = []
+        for item in screened:
+            window.append(item)
+            # Answers screened out ahead of this one, each a generate call the unscreened
+            # loop would have made before reaching it
+            screened_out = stats["duplicate_answers"] + stats["too_few_distractors"]
+            if len(window) >= min(batch_size, allowance):
+                break
+        if not window:
+            break
+        allowance -= len(window)
+        stats["generated"] += len(window)
+        stats["saved_generate_calls"] = screened_out
+        generated = improved_questions_with_profiles([(c, a) for c, a, _ in window], question_model, question_tokenizer,
+                                                     batch_size=batch_size, budget=analysis.budget, stats=stats)
+        for (relevant_context, answer, distractors), (question, profile) in zip(window, generated):
+            if len(qualified_questions) >= max_questions:
+                break
+            if not question or len(question.split()) < 4 or question.lower().startswith("what question"):
+                continue
+            if dedup_index.is_duplicate(question):
+                continue
+            difficulty, similarity_score = assess_question_difficulty(answer, distractors, sentence_transformer_model)
+            question_data = {
+                "question": question,
+                "options": [answer] + distractors,
+                "correct": answer,
+                "correct_index": 0,
+                "context": relevant_context,
+                "difficulty": difficulty,
+                "decoding": profile
+            }
+            analysis.rng.shuffle(question_data["options"])
+            question_data["correct_index"] = question_data["options"].index(answer)
+            qualified_questions.append(question_data)
+            dedup_index.add(question)
+            if on_question is not None:
+                on_question(question_data)
+    analysis.metrics["mcq_screening"] = stats
+    logger.info(f"MCQ screening: {stats}")
+    return qualified_questions
+
+def build_descriptive_question_data(question, answer, segment):
+    doc = nlp(answer)
+    num_sentences = len(list(doc.sents))
+    avg_sentence_length = len(answer.split()) / max(1, num_sentences)
+    complexity_score = min(100, (avg_sentence_length * 2) + (num_sentences * 3))
+    return {
+        "question": question,
+        "answer": answer,
+        "complexity": int(complexity_score),
+        "context": segment,
+        "difficulty": "Medium" if complexity_score < 60 else "Hard"
+    }
+
+def batch_or_per_item(generate, items):
+    # One batched call; if it raises, every item is retried on its own so a failure only
+    # loses the items that fail alone, which come back as None
+    try:
+        return generate(items)
+    except Exception:
+        results = []
+        for item in items:
+            try:
+                results.append(generate([item])[0])
+            except Exception:
+                results.append(None)
+        return results
+
+def generate_descriptive_round(segments, context, qualified_questions, max_questions, batch_size=DESCRIPTIVE_BATCH_SIZE, dedup_index=None, on_question=None, sentence_index=None, budget=None, rng=random):
+    # Stage 1: questions for every segment, Stage 2: dedup, Stage 3: length-bucketed answers,
+    # Stage 4: quality gate over the whole round
+    if not segments:
+        return qualified_questions
+    question_profile = budget.profile("descriptive_question") if budget is not None else full_profile("descriptive_question")
+    generated = batch_or_per_item(
+        lambda items: generate_descriptive_questions_batch(items, question_model, question_tokenizer, batch_size,
+                                                           question_profile, rng),
+        segments)
+    if dedup_index is None:
+        dedup_index = new_dedup_index()
+        dedup_index.extend(qualified_questions)
+    round_index = new_dedup_index(dedup_index.threshold)
+    candidates = []
+    for segment, question in zip(segments, generated):
+        if question is None:
             continue
-        distractors = get_improved_distractors(answer, relevant_context, s2v, sentence_transformer_model)
-        if len(distractors) < 3:
+        try:
+            if dedup_index.is_duplicate(question) or round_index.is_duplicate(question):
+                continue
+            round_index.add(question)
+        except:
+            continue
+        candidates.append({"question": question, "context": segment})
+    if not candidates:
+        return qualified_questions
+    answer_profile = budget.profile("descriptive_answer") if budget is not None else full_profile("descriptive_answer")
+    answers = batch_or_per_item(
+        lambda items: generate_descriptive_answers_batch(items, context, answer_model, answer_tokenizer, batch_size,
+                                                         sentence_index, answer_profile, rng),
+        [c["question"] for c in candidates])
+    for candidate, answer in zip(candidates, answers):
+        if len(qualified_questions) >= max_questions:
+            break
+        if answer is None:
             continue
-        distractors = distractors[:3]
-        difficulty, similarity_score = assess_question_difficulty(answer, distractors, sentence_transformer_model)
-        question_data = {
-            "question": question,
-            "options": [answer] + distractors,
-            "correct": answer,
-            "correct_index": 0,
-            "context": relevant_context,
-            "difficulty": difficulty
-        }
-        random.shuffle(question_data["options"])
-        question_data["correct_index"] = question_data["options"].index(answer)
-        qualified_questions.append(question_data)
+        try:
+            is_good, reason = assess_question_quality(candidate["question"], answer, context, sentence_index)
+            if not is_good:
+                continue
+            question_data = build_descriptive_question_data(candidate["question"], answer, candidate["context"])
+            question_data["decoding"] = {"question": question_profile, "answer": answer_profile}
+            qualified_questions.append(question_data)
+            dedup_index.add(candidate["question"])
+        except:
+            continue
+        if on_question is not None:
+            on_question(question_data)
     return qualified_questions
 
-def get_descriptive_questions(context, max_questions=10) -> List[Dict]:
-    global s2v, summary_model, summary_tokenizer, question_model, question_tokenizer, answer_model, answer_tokenizer, sentence_transformer_model
-    if summary_model is None or question_model is None or answer_model is None or sentence_transformer_model is None:
-        download_and_load_models()
-    chunks = preprocess_context(context)
+def get_descriptive_questions(context, max_questions=10, batch_size=DESCRIPTIVE_BATCH_SIZE, analysis=None, on_question=None) -> List[Dict]:
+    download_and_load_models()
+    if analysis is None:
+        analysis = DocumentAnalysis(context)
+    analysis.prefetch("chunks", "keywords", "sections", "sentence_index")
+    chunks = analysis.chunks
     try:
-        summarized_text = summarizer(context, summary_model, summary_tokenizer)
-    except:
-        summarized_text = " ".join(chunks[:2])
-    try:
-        keywords = get_keywords(context)
+        keywords = analysis.keywords
     except:
         words = context.lower().split()
         words = [w for w in words if w not in stopwords.words('english') and len(w) > 3]
         keywords = [word for word, _ in Counter(words).most_common(15)]
     try:
-        key_segments = extract_key_segments(context, keywords)
+        key_segments = extract_key_segments(context, keywords, analysis=analysis)
     except:
-        key_segments = chunks[:max_questions]
+        key_segments = list(chunks[:max_questions])
     if len(key_segments) < max_questions * 2:
         more_needed = max_questions * 2 - len(key_segments)
         for chunk in chunks:
@@ -687,83 +1125,54 @@ def get_descriptive_questions(context, max_questions=10) -> List[Dict]:
                 key_segments.append(chunk)
                 more_needed -= 1
     if len(key_segments) < max_questions * 2:
-        sentences = sent_tokenize(context)
+        sentences = analysis.sentences
         for i in range(0, len(sentences), 3):
             if i + 3 <= len(sentences) and len(key_segments) < max_questions * 2:
                 segment = " ".join(sentences[i:i+3])
                 if segment not in key_segments and 40 <= len(segment.split()) <= 250:
                     key_segments.append(segment)
-    random.shuffle(key_segments)
+    analysis.rng.shuffle(key_segments)
+    key_segments = balance_by_section(key_segments, analysis.sections, key=lambda segment: segment[:60])
     qualified_questions = []
-    for segment in key_segments:
+    dedup_index = new_dedup_index()
+    for start in range(0, len(key_segments), batch_size):
         if len(qualified_questions) >= max_questions:
             break
+        # Past the deadline only the round already under way is finished
+        if start and analysis.budget.expired():
+            break
+        window = key_segments[start:start + batch_size]
+        generate_descriptive_round(window, context, qualified_questions, max_questions, batch_size, dedup_index, on_question,
+                                   analysis.sentence_index, analysis.budget, analysis.rng)
+    if len(qualified_questions) < max_questions and not (qualified_questions and analysis.budget.expired()):
+        # The summary is only needed for this fallback round
         try:
-            question = generate_descriptive_question(segment, question_model, question_tokenizer)
-            if is_duplicate(question, qualified_questions):
-                continue
-            answer = generate_descriptive_answer(question, context, answer_model, answer_tokenizer)
-            is_good, reason = assess_question_quality(question, answer, context)
-            if is_good:
-                doc = nlp(answer)
-                num_sentences = len(list(doc.sents))
-                avg_sentence_length = len(answer.split()) / max(1, num_sentences)
-                complexity_score = min(100, (avg_sentence_length * 2) + (num_sentences * 3))
-                question_data = {
-                    "question": question,
-                    "answer": answer,
-                    "complexity": int(complexity_score),
-                    "context": segment,
-                    "difficulty": "Medium" if complexity_score < 60 else "Hard"
-                }
-                qualified_questions.append(question_data)
+            summarized_text = analysis.summary
         except:
-            continue
-    if len(qualified_questions) < max_questions:
-        for _ in range(min(5, max_questions - len(qualified_questions))):
-            try:
-                question = generate_descriptive_question(summarized_text, question_model, question_tokenizer)
-                if is_duplicate(question, qualified_questions):
-                    continue
-                answer = generate_descriptive_answer(question, context, answer_model, answer_tokenizer)
-                is_good, reason = assess_question_quality(question, answer, context)
-                if is_good:
-                    doc = nlp(answer)
-                    num_sentences = len(list(doc.sents))
-                    avg_sentence_length = len(answer.split()) / max(1, num_sentences)
-                    complexity_score = min(100, (avg_sentence_length * 2) + (num_sentences * 3))
-                    question_data = {
-                        "question": question,
-                        "answer": answer,
-                        "complexity": int(complexity_score),
-                        "context": summarized_text,
-                        "difficulty": "Medium" if complexity_score < 60 else "Hard"
-                    }
-                    qualified_questions.append(question_data)
-            except:
-                continue
+            summarized_text = " ".join(chunks[:2])
+        window = [summarized_text] * min(5, max_questions - len(qualified_questions))
+        generate_descriptive_round(window, context, qualified_questions, max_questions, batch_size, dedup_index, on_question,
+                                   analysis.sentence_index, analysis.budget, analysis.rng)
     return qualified_questions
 
+def model_versions():
+    # Everything that changes generation output for the same input; used to key cached results
+    versions = store_versions()
+    versions["backends"] = {name: backend_kind(name) for name in ("t5_summary", "t5_question", "t5_answer")}
+    versions["quantized"] = QUANTIZE_MODELS
+    return versions
+
 def extract_text_from_pdf(pdf_path: str) -> str:
     try:
-        text = ""
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    cleaned_text = re.sub(r'\s+', ' ', page_text).strip()
-                    text += cleaned_text + " "
-        text = text.replace('\n', ' ').strip()
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'•', '*', text)
-        text = re.sub(r'[^\x00-\x7F]+', '', text)
-        return text
+        return extract_text(pdf_path)
     except Exception as e:
         print(f"Error reading PDF: {e}")
         return ""
 
-def generate_mcqs(text: str, num_mcqs: int) -> List[Dict]:
-    return get_mcq_questions(text, max_questions=num_mcqs)
+def generate_mcqs(text: str, num_mcqs: int, analysis: Optional[DocumentAnalysis] = None,
+                  on_question: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    return get_mcq_questions(text, max_questions=num_mcqs, analysis=analysis, on_question=on_question)
 
-def generate_descriptive_questions(text: str, num_descriptive: int) -> List[Dict]:
-    return get_descriptive_questions(text, max_questions=num_descriptive)
\ No newline at end of file
+def generate_descriptive_questions(text: str, num_descriptive: int, analysis: Optional[DocumentAnalysis] = None,
+                                   on_question: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    return get_descriptive_questions(text, max_questions=num_descriptive, analysis=analysis, on_question=on_question)
\ No newline at end of file
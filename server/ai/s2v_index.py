@@ -0,0 +1,211 @@
+import argparse
+import importlib.util
+import json
+import os
+import random
+import time
+import numpy as np
+
+# Annoy index over the sense2vec vector table (the full Sense2Vec tables or the compact
+# store from ai.s2v_store), so distractor lookups do not scan every row. The index file is
+# memory-mapped at load and shared by every process on the host.
+# Usage: python -m ai.s2v_index [build [--trees N] | benchmark [--samples N] [--n N]]
+S2V_DIR = "s2v_old"
+S2V_INDEX_DIR = os.getenv("QG_S2V_INDEX", "s2v_ann")
+S2V_INDEX_TREES = int(os.getenv("QG_S2V_INDEX_TREES", 50))
+S2V_SEARCH_K = int(os.getenv("QG_S2V_SEARCH_K", -1))
+S2V_USE_INDEX = os.getenv("QG_S2V_ANN", "1") == "1"
+INDEX_FORMAT_VERSION = 1
+
+
+def source_fingerprint(s2v_dir=S2V_DIR):
+    # Sizes and mtimes of the vector files; an index built from other vectors is not used
+    fingerprint = {}
+    for root, _, files in os.walk(s2v_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            fingerprint[os.path.relpath(path, s2v_dir)] = [stat.st_size, int(stat.st_mtime)]
+    return fingerprint
+
+
+def store_kind(s2v):
+    return getattr(s2v, "store_kind", "sense2vec")
+
+
+def store_source_dir(s2v, s2v_dir=S2V_DIR):
+    return s2v.path if store_kind(s2v) == "compact" else s2v_dir
+
+
+def store_keys(s2v):
+    if store_kind(s2v) == "compact":
+        return [s2v.key_at(row) for row in range(len(s2v))]
+    return [s2v.strings[key] for key in s2v.vectors.key2row]
+
+
+def read_manifest(index_dir=S2V_INDEX_DIR):
+    path = os.path.join(index_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def build_index(s2v, index_dir=S2V_INDEX_DIR, trees=S2V_INDEX_TREES, s2v_dir=S2V_DIR):
+    from annoy import AnnoyIndex
+    if store_kind(s2v) == "compact":
+        data = s2v.vectors
+        rows = None
+    else:
+        data = s2v.vectors.data
+        rows = np.zeros(len(data), dtype=np.uint64)
+        for key, row in s2v.vectors.key2row.items():
+            rows[row] = key
+    index = AnnoyIndex(data.shape[1], "angular")
+    for row in range(len(data)):
+        if rows is None or rows[row]:
+            index.add_item(row, np.asarray(data[row], dtype=np.float32))
+    start = time.time()
+    index.build(trees)
+    os.makedirs(index_dir, exist_ok=True)
+    index.save(os.path.join(index_dir, "index.ann"))
+    if rows is not None:
+        np.save(os.path.join(index_dir, "row_keys.npy"), rows)
+    manifest = {
+        "format_version": INDEX_FORMAT_VERSION,
+        "store": store_kind(s2v),
+        "trees": trees,
+        "dimensions": data.shape[1],
+        "rows": len(data),
+        "source": source_fingerprint(store_source_dir(s2v, s2v_dir)),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+    with open(os.path.join(index_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Built sense2vec index over {index.get_n_items()} keys with {trees} trees in {time.time() - start:.1f}s")
+    return manifest
+
+
+class AnnSense2Vec:
+    # Drop-in for the Sense2Vec methods used by distractor generation; most_similar gives the
+    # same (key, cosine score) pairs as Sense2Vec.most_similar, from the index instead of a scan
+    def __init__(self, s2v, index_dir=S2V_INDEX_DIR, search_k=S2V_SEARCH_K):
+        from annoy import AnnoyIndex
+        manifest = read_manifest(index_dir)
+        self.s2v = s2v
+        self.search_k = search_k
+        self.index = AnnoyIndex(manifest["dimensions"], "angular")
+        self.index.load(os.path.join(index_dir, "index.ann"))
+        self.row_keys = None
+        if store_kind(s2v) != "compact":
+            self.row_keys = np.load(os.path.join(index_dir, "row_keys.npy"), mmap_mode="r")
+
+    def _key_at(self, row):
+        if self.row_keys is None:
+            return self.s2v.key_at(row)
+        return self.s2v.strings[int(self.row_keys[row])]
+
+    def __contains__(self, key):
+        return key in self.s2v
+
+    def __getitem__(self, key):
+        return self.s2v[key]
+
+    def __getattr__(self, name):
+        return getattr(self.s2v, name)
+
+    def get_best_sense(self, word, senses=None, ignore_case=True):
+        return self.s2v.get_best_sense(word, senses=senses or [], ignore_case=ignore_case)
+
+    def most_similar(self, keys, n=10):
+        if isinstance(keys, (str, int)):
+            keys = [keys]
+        for key in keys:
+            if key not in self.s2v:
+                raise ValueError(f"Can't find key {key} in table")
+        average = np.vstack([self.s2v[key] for key in keys]).mean(axis=0)
+        rows, distances = self.index.get_nns_by_vector(average, n + len(keys), search_k=self.search_k,
+                                                       include_distances=True)
+        results = []
+        for row, distance in zip(rows, distances):
+            key = self._key_at(row)
+            if key not in keys:
+                # Annoy's angular distance is sqrt(2 - 2 cos)
+                results.append((key, 1 - distance * distance / 2))
+        return results
+
+
+def index_status(kind, source_dir, index_dir=S2V_INDEX_DIR):
+    # "current" when the index was built over a store of this kind from the vectors in source_dir
+    manifest = read_manifest(index_dir)
+    if manifest is None:
+        return "missing"
+    if (manifest.get("format_version") != INDEX_FORMAT_VERSION or manifest.get("store") != kind
+            or manifest.get("source") != source_fingerprint(source_dir)):
+        return "stale"
+    return "current"
+
+
+def index_usable(kind, source_dir, index_dir=S2V_INDEX_DIR):
+    # Whether load_index would put a store of this kind behind the index
+    if not S2V_USE_INDEX or index_status(kind, source_dir, index_dir) != "current":
+        return False
+    return importlib.util.find_spec("annoy") is not None
+
+
+def load_index(s2v, index_dir=S2V_INDEX_DIR, s2v_dir=S2V_DIR):
+    # The indexed wrapper when a current index exists, otherwise s2v itself (exact search)
+    if not S2V_USE_INDEX:
+        return s2v
+    status = index_status(store_kind(s2v), store_source_dir(s2v, s2v_dir), index_dir)
+    if status == "missing":
+        print(f"No sense2vec index in {index_dir}, using exact search (build one with python -m ai.model_store s2v)")
+        return s2v
+    if status == "stale":
+        print(f"Sense2vec index in {index_dir} is stale, using exact search (rebuild with python -m ai.model_store s2v)")
+        return s2v
+    try:
+        return AnnSense2Vec(s2v, index_dir)
+    except ImportError:
+        print("annoy is not installed, using exact sense2vec search")
+        return s2v
+
+
+def benchmark(s2v, samples=200, n=40, seed=0):
+    indexed = AnnSense2Vec(s2v)
+    keys = store_keys(s2v)
+    keys = random.Random(seed).sample(keys, min(samples, len(keys)))
+    exact_time = 0.0
+    ann_time = 0.0
+    recalls = []
+    for key in keys:
+        start = time.perf_counter()
+        exact = s2v.most_similar(key, n=n)
+        exact_time += time.perf_counter() - start
+        start = time.perf_counter()
+        approximate = indexed.most_similar(key, n=n)
+        ann_time += time.perf_counter() - start
+        expected = {k for k, _ in exact[:n]}
+        if expected:
+            recalls.append(len(expected & {k for k, _ in approximate[:n]}) / len(expected))
+    print(f"{len(keys)} queries, n={n}")
+    print(f"  exact most_similar: {exact_time / len(keys) * 1000:.2f} ms/query")
+    print(f"  indexed:            {ann_time / len(keys) * 1000:.3f} ms/query")
+    print(f"  recall@{n}:          {np.mean(recalls):.4f}")
+
+
+if __name__ == "__main__":
+    from ai.s2v_store import load_store
+    parser = argparse.ArgumentParser(description="sense2vec nearest-neighbour index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("--trees", type=int, default=S2V_INDEX_TREES)
+    benchmark_parser = subparsers.add_parser("benchmark")
+    benchmark_parser.add_argument("--samples", type=int, default=200)
+    benchmark_parser.add_argument("--n", type=int, default=40)
+    args = parser.parse_args()
+    model = load_store(require_index=False)
+    if args.command == "build":
+        build_index(model, trees=args.trees)
+    else:
+        benchmark(model, samples=args.samples, n=args.n)
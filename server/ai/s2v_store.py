@@ -0,0 +1,245 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import numpy as np
+
+# Compact, memory-mapped copy of the s2v_old tables: float16 vectors, a sorted table of key
+# hashes for lookups, the key strings as one UTF-8 blob and per-row frequencies. Nothing is
+# read into the heap at load, so every process on the host shares the same page cache.
+# Conversion takes minutes, so it is an offline step: python -m ai.model_store s2v converts
+# the tables and builds the nearest-neighbour index over the result.
+# Usage: python -m ai.s2v_store [convert | verify [--samples N] [--n N]]
+S2V_DIR = "s2v_old"
+S2V_COMPACT_DIR = os.getenv("QG_S2V_COMPACT", "s2v_compact")
+S2V_AUTO_COMPACT = os.getenv("QG_S2V_AUTO_COMPACT", "0") == "1"
+COMPACT_FORMAT_VERSION = 1
+CONVERT_BLOCK_ROWS = 65536
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def make_key(word, sense):
+    # Same keys as sense2vec.util.make_key
+    return re.sub(r"\s", "_", word) + "|" + sense
+
+
+def has_source(s2v_dir=S2V_DIR):
+    # s2v_old/cfg is checked in; the tables only exist once the vectors were downloaded
+    return os.path.exists(os.path.join(s2v_dir, "strings.json"))
+
+
+def read_meta(path=S2V_COMPACT_DIR):
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def convert(s2v, path=S2V_COMPACT_DIR, s2v_dir=S2V_DIR):
+    from ai.s2v_index import source_fingerprint
+    start = time.time()
+    entries = sorted(s2v.vectors.key2row.items(), key=lambda item: item[1])
+    rows = len(entries)
+    dimensions = s2v.vectors.shape[1]
+    tmp = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    vectors = np.lib.format.open_memmap(os.path.join(tmp, "vectors.npy"), mode="w+", dtype=np.float16,
+                                        shape=(rows, dimensions))
+    norms = np.zeros(rows, dtype=np.float32)
+    source_rows = np.array([row for _, row in entries], dtype=np.int64)
+    for block in range(0, rows, CONVERT_BLOCK_ROWS):
+        data = np.asarray(s2v.vectors.data[source_rows[block:block + CONVERT_BLOCK_ROWS]], dtype=np.float32)
+        vectors[block:block + len(data)] = data
+        norms[block:block + len(data)] = np.linalg.norm(data, axis=1)
+    vectors.flush()
+    del vectors
+    norms[norms == 0] = 1
+    np.save(os.path.join(tmp, "norms.npy"), norms)
+    keys = [s2v.strings[key] for key, _ in entries]
+    encoded = [key.encode("utf-8") for key in keys]
+    np.save(os.path.join(tmp, "string_offsets.npy"), np.cumsum([0] + [len(e) for e in encoded], dtype=np.int64))
+    with open(os.path.join(tmp, "strings.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    hashes = np.array([key_hash(key) for key in keys], dtype=np.uint64)
+    order = np.argsort(hashes, kind="stable")
+    np.save(os.path.join(tmp, "key_hashes.npy"), hashes[order])
+    np.save(os.path.join(tmp, "key_rows.npy"), order.astype(np.int64))
+    np.save(os.path.join(tmp, "freqs.npy"), np.array([s2v.get_freq(key, -1) for key in keys], dtype=np.int64))
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({
+            "format_version": COMPACT_FORMAT_VERSION,
+            "rows": rows,
+            "dimensions": dimensions,
+            "senses": list(s2v.senses),
+            "source": source_fingerprint(s2v_dir)
+        }, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    print(f"Converted {rows} sense2vec keys to {path} in {time.time() - start:.1f}s")
+
+
+class CompactSense2Vec:
+    # The parts of the Sense2Vec API distractor generation uses, over the compact store.
+    # Scores are cosine similarities computed in float32 from the float16 vectors.
+    store_kind = "compact"
+
+    def __init__(self, path=S2V_COMPACT_DIR):
+        meta = read_meta(path)
+        self.path = path
+        self.senses = meta["senses"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.norms = np.load(os.path.join(path, "norms.npy"), mmap_mode="r")
+        self.freqs = np.load(os.path.join(path, "freqs.npy"), mmap_mode="r")
+        self._hashes = np.load(os.path.join(path, "key_hashes.npy"), mmap_mode="r")
+        self._hash_rows = np.load(os.path.join(path, "key_rows.npy"), mmap_mode="r")
+        self._offsets = np.load(os.path.join(path, "string_offsets.npy"), mmap_mode="r")
+        self._strings = np.memmap(os.path.join(path, "strings.bin"), dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def key_at(self, row):
+        return self._strings[self._offsets[row]:self._offsets[row + 1]].tobytes().decode("utf-8")
+
+    def row(self, key):
+        digest = np.uint64(key_hash(key))
+        index = int(np.searchsorted(self._hashes, digest))
+        while index < len(self._hashes) and self._hashes[index] == digest:
+            row = int(self._hash_rows[index])
+            if self.key_at(row) == key:
+                return row
+            index += 1
+        return None
+
+    def __contains__(self, key):
+        return self.row(key) is not None
+
+    def __getitem__(self, key):
+        row = self.row(key)
+        if row is None:
+            raise KeyError(key)
+        return np.asarray(self.vectors[row], dtype=np.float32)
+
+    def get_freq(self, key, default=None):
+        row = self.row(key)
+        if row is None or self.freqs[row] < 0:
+            return default
+        return int(self.freqs[row])
+
+    def get_best_sense(self, word, senses=None, ignore_case=True):
+        sense_options = senses or self.senses
+        versions = [word, word.upper(), word.title()] if ignore_case else [word]
+        freqs = []
+        for text in versions:
+            for sense in sense_options:
+                key = make_key(text, sense)
+                if key in self:
+                    freqs.append((self.get_freq(key, -1), key))
+        return max(freqs)[1] if freqs else None
+
+    def most_similar(self, keys, n=10):
+        if isinstance(keys, str):
+            keys = [keys]
+        for key in keys:
+            if key not in self:
+                raise ValueError(f"Can't find key {key} in table")
+        average = np.vstack([self[key] for key in keys]).mean(axis=0)
+        scores = np.empty(len(self.vectors), dtype=np.float32)
+        for start in range(0, len(self.vectors), CONVERT_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + CONVERT_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ average
+        scores /= self.norms * (np.linalg.norm(average) or 1)
+        count = min(n + len(keys), len(scores))
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.key_at(row), float(scores[row])) for row in top if self.key_at(row) not in keys]
+
+
+def store_fingerprint(s2v_dir=S2V_DIR, path=S2V_COMPACT_DIR):
+    # Digest of the tables, compact store and index on disk, which decide what get_best_sense
+    # and most_similar return, whichever process (this one or the inference server) serves them
+    from ai.s2v_index import S2V_INDEX_DIR, S2V_SEARCH_K, S2V_USE_INDEX, read_manifest, source_fingerprint
+    state = {
+        "source": source_fingerprint(s2v_dir),
+        "compact": read_meta(path),
+        "index": read_manifest(S2V_INDEX_DIR) if S2V_USE_INDEX else None,
+        "search_k": S2V_SEARCH_K
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def compact_is_current(s2v_dir=S2V_DIR, path=S2V_COMPACT_DIR):
+    from ai.s2v_index import source_fingerprint
+    meta = read_meta(path)
+    if meta is None or meta.get("format_version") != COMPACT_FORMAT_VERSION:
+        return False
+    if has_source(s2v_dir) and meta.get("source") != source_fingerprint(s2v_dir):
+        print(f"Compact sense2vec store in {path} is stale")
+        return False
+    return True
+
+
+def load_store(s2v_dir=S2V_DIR, path=S2V_COMPACT_DIR, require_index=True):
+    # The compact store when it is current and, with require_index, has a usable index:
+    # without one its most_similar scans every row in blocks, slower than Sense2Vec's own
+    # search, so the full tables are loaded instead. QG_S2V_AUTO_COMPACT=1 converts a missing
+    # or stale store on the way; it is used from the next start, once indexed.
+    from ai.s2v_index import index_usable
+    compact = compact_is_current(s2v_dir, path)
+    if compact and (not require_index or not has_source(s2v_dir) or index_usable("compact", path)):
+        return CompactSense2Vec(path)
+    from sense2vec import Sense2Vec
+    model = Sense2Vec().from_disk(s2v_dir)
+    if S2V_AUTO_COMPACT and not compact:
+        convert(model, path, s2v_dir)
+    return model
+
+
+def compact_and_index(s2v_dir=S2V_DIR, path=S2V_COMPACT_DIR):
+    # The offline step behind python -m ai.model_store s2v; either half is skipped when its
+    # output is current
+    from ai.s2v_index import build_index, index_status
+    if not compact_is_current(s2v_dir, path):
+        from sense2vec import Sense2Vec
+        convert(Sense2Vec().from_disk(s2v_dir), path, s2v_dir)
+    if index_status("compact", path) != "current":
+        build_index(CompactSense2Vec(path), s2v_dir=s2v_dir)
+
+
+def verify(samples=100, n=40, seed=0):
+    import random
+    from sense2vec import Sense2Vec
+    from ai.s2v_index import store_keys
+    full = Sense2Vec().from_disk(S2V_DIR)
+    compact = CompactSense2Vec()
+    keys = random.Random(seed).sample(store_keys(full), samples)
+    overlaps = []
+    for key in keys:
+        expected = {k for k, _ in full.most_similar(key, n=n)[:n]}
+        actual = {k for k, _ in compact.most_similar(key, n=n)[:n]}
+        overlaps.append(len(expected & actual) / max(1, len(expected)))
+    same_sense = sum(full.get_best_sense(key.split("|")[0]) == compact.get_best_sense(key.split("|")[0]) for key in keys)
+    print(f"{samples} keys: top-{n} overlap {np.mean(overlaps):.4f}, get_best_sense agreement {same_sense}/{samples}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact sense2vec vector store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("convert")
+    verify_parser = subparsers.add_parser("verify")
+    verify_parser.add_argument("--samples", type=int, default=100)
+    verify_parser.add_argument("--n", type=int, default=40)
+    args = parser.parse_args()
+    if args.command == "convert":
+        from sense2vec import Sense2Vec
+        convert(Sense2Vec().from_disk(S2V_DIR))
+    else:
+        verify(samples=args.samples, n=args.n)
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class SentenceIndex:
+    # The sentences of one document with their L2-normalized embeddings, built once per
+    # document and shared by every answer-context lookup and quality check on it
+    def __init__(self, text, sentences, embeddings, encode):
+        self.text = text
+        self.sentences = list(sentences)
+        self.encode = encode
+        if self.sentences:
+            self.embeddings = _normalize(np.asarray(embeddings, dtype=np.float32))
+        else:
+            self.embeddings = np.zeros((0, 1), dtype=np.float32)
+        self._document_embedding = None
+
+    def __len__(self):
+        return len(self.sentences)
+
+    @property
+    def document_embedding(self):
+        # Embedding of the whole text, as assess_question_quality compares answers against it
+        if self._document_embedding is None:
+            self._document_embedding = _normalize(np.asarray(self.encode([self.text])[0], dtype=np.float32))
+        return self._document_embedding
+
+    def scores(self, query_embedding):
+        return self.embeddings @ _normalize(np.asarray(query_embedding, dtype=np.float32))
+
+    def select(self, query_embedding, num_sentences=8):
+        # Top num_sentences by cosine similarity, each widened to its neighbours, keeping at
+        # most num_sentences + 4 sentences in document order
+        if len(self.sentences) <= num_sentences:
+            return self.text
+        similarities = self.scores(query_embedding)
+        top_indices = sorted(similarities.argsort()[-num_sentences:][::-1])
+        extended_indices = set()
+        for idx in top_indices:
+            extended_indices.add(idx)
+            if idx > 0:
+                extended_indices.add(idx - 1)
+            if idx < len(self.sentences) - 1:
+                extended_indices.add(idx + 1)
+        extended_indices = sorted(extended_indices)
+        if len(extended_indices) > num_sentences + 4:
+            by_similarity = sorted(extended_indices, key=lambda i: similarities[i], reverse=True)
+            extended_indices = sorted(by_similarity[:num_sentences + 4])
+        return " ".join(self.sentences[i] for i in extended_indices)
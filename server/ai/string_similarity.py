@@ -0,0 +1,57 @@
+import numpy as np
+
+# Normalized Levenshtein similarity, 1 - distance / max(len(a), len(b)), the same score as
+# strsimpy's NormalizedLevenshtein, computed for one string against many or many against
+# many in a single call. rapidfuzz does the work when installed; otherwise a dynamic
+# programme vectorized over the candidates runs in numpy.
+try:
+    from rapidfuzz.distance import Levenshtein as _rapidfuzz_levenshtein
+    from rapidfuzz.process import cdist as _rapidfuzz_cdist
+except ImportError:
+    _rapidfuzz_levenshtein = None
+
+
+def _codes(texts):
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    codes = np.full((len(texts), max(lengths.max(initial=0), 1)), -1, dtype=np.int64)
+    for i, text in enumerate(texts):
+        codes[i, :len(text)] = [ord(c) for c in text]
+    return codes, lengths
+
+
+def _distances(query, candidates):
+    # One Levenshtein row per candidate, advanced a query character at a time; cell (i, j)
+    # only depends on row i - 1 and on cell (i, j - 1), so the loop over j stays in Python
+    # while every candidate is updated at once
+    codes, lengths = _codes(candidates)
+    width = codes.shape[1]
+    previous = np.tile(np.arange(width + 1, dtype=np.int64), (len(candidates), 1))
+    current = np.empty_like(previous)
+    for i, char in enumerate(query, start=1):
+        current[:, 0] = i
+        substitution = previous[:, :-1] + (codes != ord(char))
+        deletion = previous[:, 1:] + 1
+        best = np.minimum(substitution, deletion)
+        for j in range(1, width + 1):
+            current[:, j] = np.minimum(best[:, j - 1], current[:, j - 1] + 1)
+        previous, current = current, previous
+    return previous[np.arange(len(candidates)), lengths]
+
+
+def similarity_to_many(query, candidates):
+    if len(candidates) == 0:
+        return np.zeros(0)
+    if _rapidfuzz_levenshtein is not None:
+        return np.array([_rapidfuzz_levenshtein.normalized_similarity(query, candidate) for candidate in candidates])
+    longest = np.maximum(np.array([len(candidate) for candidate in candidates]), len(query))
+    distances = _distances(query, list(candidates))
+    return np.where(longest == 0, 1.0, 1 - distances / np.maximum(longest, 1))
+
+
+def similarity_matrix(queries, candidates):
+    if len(queries) == 0 or len(candidates) == 0:
+        return np.zeros((len(queries), len(candidates)))
+    if _rapidfuzz_levenshtein is not None:
+        return _rapidfuzz_cdist(queries, candidates, scorer=_rapidfuzz_levenshtein.normalized_similarity,
+                                dtype=np.float64)
+    return np.vstack([similarity_to_many(query, candidates) for query in queries])
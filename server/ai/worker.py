@@ -0,0 +1,123 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+
+# Generation worker for GENERATION_MODE=distributed. The web tier only inserts pending
+# token_requests documents; workers claim them with a lease, heartbeat while running
+# process_content, and a job whose worker died is claimed again once its lease expires.
+# Every write process_content makes into the job is conditional on the claiming worker's id,
+# so a worker that lost its lease aborts instead of overwriting the new owner's results.
+# Workers also heartbeat into generation_workers, from which the web tier counts the live ones.
+# Usage (from server/): MONGO_URI=mongodb://localhost:27017/qmaster python -m ai.worker --processes 3
+WORKER_LEASE = timedelta(seconds=int(os.getenv('GENERATION_LEASE_SECONDS', 120)))
+WORKER_POLL_INTERVAL = float(os.getenv('GENERATION_POLL_SECONDS', 2))
+WORKER_MAX_ATTEMPTS = int(os.getenv('GENERATION_MAX_ATTEMPTS', 3))
+
+logger = logging.getLogger("ai.worker")
+
+
+def claim_job(token_requests, worker_id):
+    now = datetime.now()
+    return token_requests.find_one_and_update(
+        {
+            "status": "pending",
+            "mode": "distributed",
+            "$or": [{"leaseExpiresAt": {"$exists": False}}, {"leaseExpiresAt": {"$lt": now}}]
+        },
+        {
+            "$set": {"worker": worker_id, "leaseExpiresAt": now + WORKER_LEASE, "startedAt": now},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("createdAt", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def register_worker(workers, worker_id, stop):
+    while True:
+        workers.update_one({"_id": worker_id}, {"$set": {"seenAt": datetime.now()}}, upsert=True)
+        if stop.wait(WORKER_LEASE.total_seconds() / 3):
+            break
+    workers.delete_one({"_id": worker_id})
+
+
+def live_workers(workers):
+    return workers.count_documents({"seenAt": {"$gt": datetime.now() - WORKER_LEASE}})
+
+
+def heartbeat(token_requests, request_id, worker_id, stop):
+    while not stop.wait(WORKER_LEASE.total_seconds() / 3):
+        result = token_requests.update_one(
+            {"request_id": request_id, "worker": worker_id, "status": "pending"},
+            {"$set": {"leaseExpiresAt": datetime.now() + WORKER_LEASE}}
+        )
+        if result.matched_count == 0:
+            # process_content's next write into the job fails and aborts the generation
+            logger.warning(f"Worker {worker_id} lost the lease on {request_id}")
+            return
+
+
+def run_job(app_module, job, worker_id):
+    token_requests = app_module.token_requests
+    request_id = job["request_id"]
+    if job.get("attempts", 1) > WORKER_MAX_ATTEMPTS:
+        token_requests.update_one(
+            {"request_id": request_id, "worker": worker_id},
+            {"$set": {"status": "failed", "error": f"Generation failed after {WORKER_MAX_ATTEMPTS} attempts"},
+             "$unset": {"leaseExpiresAt": ""}}
+        )
+        logger.error(f"Giving up on {request_id} after {WORKER_MAX_ATTEMPTS} attempts")
+        return
+    logger.info(f"Worker {worker_id} claimed {request_id} (attempt {job.get('attempts', 1)})")
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(token_requests, request_id, worker_id, stop), daemon=True)
+    beat.start()
+    try:
+        app_module.process_content(request_id, owner={"worker": worker_id}, **job["params"])
+    finally:
+        stop.set()
+        beat.join()
+        token_requests.update_one({"request_id": request_id, "worker": worker_id}, {"$unset": {"leaseExpiresAt": ""}})
+
+
+def run_worker(worker_index=0):
+    import app as app_module
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{worker_index}"
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    registration = threading.Thread(target=register_worker, args=(app_module.generation_workers, worker_id, stopping),
+                                    daemon=True)
+    registration.start()
+    logger.info(f"Worker {worker_id} started")
+    while not stopping.is_set():
+        job = claim_job(app_module.token_requests, worker_id)
+        if job is None:
+            stopping.wait(WORKER_POLL_INTERVAL)
+            continue
+        run_job(app_module, job, worker_id)
+    registration.join()
+    logger.info(f"Worker {worker_id} stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="QMaster distributed generation worker")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("GENERATION_WORKER_PROCESSES", 1)))
+    args = parser.parse_args()
+    os.environ["GENERATION_MODE"] = "distributed"
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.processes <= 1:
+        run_worker()
+    else:
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=run_worker, args=(i,)) for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from pymongo import MongoClient
 from pymongo.errors import ServerSelectionTimeoutError
@@ -7,7 +7,10 @@ from bcrypt import hashpw, gensalt, checkpw
 from dotenv import load_dotenv
 from uuid import uuid4
 import os
-import pdfplumber
+import hashlib
+import json
+import tempfile
+import gridfs
 from datetime import datetime, timedelta
 import logging
 import smtplib
@@ -16,8 +19,13 @@ import random
 import spacy
 import time
 from bson.objectid import ObjectId
-from ai.question_generator import generate_mcqs, generate_descriptive_questions
+from ai.question_generator import generate_mcqs, generate_descriptive_questions, DocumentAnalysis, download_and_load_models, embedding_cache, distractor_cache, model_versions
 import threading
+from job_executor import GenerationExecutor, QueueFullError
+from job_events import JobWatcher
+from ai.pdf_extraction import extract_text
+from ai.generation_scheduler import scheduler_stats
+from ai.worker import live_workers
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -45,6 +53,28 @@ users = db.users
 questions = db.questions
 tests = db.tests
 token_requests = db.token_requests  # New collection for tracking token generation
+generation_cache = db.generation_cache  # Finished question pools keyed by content and generation parameters
+generation_stats = db.generation_stats
+generation_workers = db.generation_workers  # Live distributed workers, see ai.worker.register_worker
+pdf_uploads = gridfs.GridFS(db, collection="pdf_uploads")  # Uploaded PDFs waiting for extraction
+job_contents = gridfs.GridFS(db, collection="job_contents")  # Text of queued jobs, referenced from their params
+
+# Generation job limits. In "local" mode jobs run on this process's executor, in
+# "distributed" mode the web tier only enqueues and `python -m ai.worker` runs them.
+GENERATION_MODE = os.getenv('GENERATION_MODE', 'local')
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', 1))
+GENERATION_QUEUE_SIZE = int(os.getenv('GENERATION_QUEUE_SIZE', 8))
+# Assumed job duration until enough jobs have finished to measure it
+DEFAULT_JOB_SECONDS = 180
+GENERATION_JOB_STALE_AFTER = timedelta(seconds=int(os.getenv('GENERATION_JOB_STALE_SECONDS', 120)))
+MAX_TEXT_WORDS = int(os.getenv('MAX_TEXT_WORDS', 20000))
+# Each open token-stream holds one of the web server's threads, so only this many are served
+# at once; the rest are turned away and poll token-status instead
+STREAM_MAX_CONNECTIONS = int(os.getenv('GENERATION_STREAM_MAX_CONNECTIONS', 4))
+STREAM_POLL_INTERVAL = float(os.getenv('GENERATION_STREAM_POLL_SECONDS', 1))
+STREAM_TICKET_LIFETIME = timedelta(seconds=int(os.getenv('GENERATION_STREAM_TICKET_SECONDS', 60)))
+STREAM_KEEPALIVE_INTERVAL = 15
+job_watcher = JobWatcher(token_requests, STREAM_POLL_INTERVAL)  # Wakes token-stream handlers on job updates
 
 # OTP Store
 otps = {}
@@ -81,6 +111,10 @@ def send_otp_email(to_email, otp, otp_type="registration"):
 def authenticate(token):
     try:
         payload = decode(token, JWT_SECRET, algorithms=["HS256"])
+        if "purpose" in payload:
+            # A single-purpose ticket, see stream_ticket; never a session
+            logger.error("Ticket used as a session token")
+            return None
         return payload
     except ExpiredSignatureError:
         logger.error("JWT expired")
@@ -96,77 +130,378 @@ def mongo_to_json(obj):
         return obj.isoformat()
     raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
+def current_model_version():
+    return hashlib.sha256(json.dumps(model_versions(), sort_keys=True).encode('utf-8')).hexdigest()
+
+def generation_cache_key(content, num_mcqs, num_descriptive):
+    normalized = " ".join(content.split())
+    content_hash = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    model_version = current_model_version()
+    fingerprint = json.dumps({"numMCQs": num_mcqs, "numDescriptive": num_descriptive, "modelVersion": model_version}, sort_keys=True)
+    key = hashlib.sha256(f"{content_hash}:{fingerprint}".encode('utf-8')).hexdigest()
+    return key, content_hash, model_version
+
+def record_cache_lookup(hit):
+    generation_stats.update_one({"_id": "result_cache"}, {"$inc": {"hits" if hit else "misses": 1}}, upsert=True)
+
+class JobOwnershipLost(Exception):
+    pass
+
+def job_filter(request_id, owner=None):
+    # Matches the job only while `owner` (this worker's lease, or this process's executor)
+    # still holds it, so a process that lost the job to another one cannot write into it
+    return {"request_id": request_id, **(owner or {})}
+
+def update_job(request_id, owner, update, **conditions):
+    result = token_requests.update_one({**job_filter(request_id, owner), **conditions}, update)
+    if result.matched_count == 0:
+        raise JobOwnershipLost(f"Job {request_id} is no longer owned by {owner}")
+    job_watcher.notify(request_id)
+
+def reuse_cached_pool(request_id, cache_key, token_id, subject, input_type, content, pdf_content, mcq_marks, descriptive_marks, owner=None):
+    cached = generation_cache.find_one({"key": cache_key})
+    if not cached:
+        return False
+    # Clones the snapshot taken when the pool was generated, not the source token's questions,
+    # which their teacher may have edited since
+    cloned = []
+    for question in cached["questions"]:
+        question["token"] = token_id
+        question["subject"] = subject
+        question["marks"] = mcq_marks if question["type"] == "mcq" else descriptive_marks
+        if question["type"] == "descriptive":
+            question["pdfContent"] = pdf_content if input_type == 'pdf' else None
+        cloned.append(question)
+    questions.insert_many(cloned)
+    update_job(request_id, owner,
+               {"$set": {"status": "completed", "completedAt": datetime.now(), "token": token_id, "mcqs": cached["mcqs"],
+                         "descriptiveQuestions": cached["descriptiveQuestions"], "cached": True,
+                         "progress.stage": "completed", "progress.mcqs": len(cached["mcqs"]),
+                         "progress.descriptive": len(cached["descriptiveQuestions"])}},
+               token=token_id)
+    notes.insert_one({"token": token_id, "content": content, "createdAt": datetime.now(), "inputType": input_type, "subject": subject})
+    logger.info(f"Reused cached question pool from token {cached['token']} for request_id {request_id}")
+    return True
+
+invalidated_model_version = None
+
+def invalidate_stale_generation_cache(model_version):
+    # Runs in the process that generates, the distributed workers included, whose loaded
+    # models define the version; once per version, since other versions' entries can no
+    # longer be hit from here
+    global invalidated_model_version
+    if model_version == invalidated_model_version:
+        return
+    invalidated_model_version = model_version
+    try:
+        result = generation_cache.delete_many({"modelVersion": {"$ne": model_version}})
+        if result.deleted_count:
+            logger.info(f"Removed {result.deleted_count} cached question pools built with other model versions")
+    except Exception as e:
+        logger.error(f"Failed to invalidate generation cache: {e}")
+
+def question_document(kind, item, token_id, subject, marks, pdf_content=None):
+    if kind == "mcq":
+        return {
+            "token": token_id,
+            "type": "mcq",
+            "question": item['question'],
+            "options": item['options'],
+            "correctAnswer": item['correct'],
+            "correctIndex": item.get('correct_index', 0),
+            "marks": marks,
+            "context": item['context'],
+            "difficulty": item['difficulty'],
+            "decoding": item.get('decoding'),
+            "subject": subject
+        }
+    return {
+        "token": token_id,
+        "type": "descriptive",
+        "question": item['question'],
+        "correctAnswer": item['answer'],
+        "marks": marks,
+        "pdfContent": pdf_content,
+        "context": item['context'],
+        "difficulty": item['difficulty'],
+        "decoding": item.get('decoding'),
+        "subject": subject
+    }
+
+def start_progress(request_id, token_id, num_mcqs, num_descriptive, owner=None):
+    # Resets the partial results of an earlier attempt at this request and drops the questions
+    # it had already persisted under its own token. Returns when the job started.
+    previous = token_requests.find_one_and_update(
+        job_filter(request_id, owner),
+        {"$set": {"token": token_id, "mcqs": [], "descriptiveQuestions": [],
+                  "progress": {"stage": "analysis", "mcqs": 0, "mcqsTarget": num_mcqs,
+                               "descriptive": 0, "descriptiveTarget": num_descriptive}}}
+    )
+    if previous is None:
+        raise JobOwnershipLost(f"Job {request_id} is no longer owned by {owner}")
+    if previous.get("token") and previous["token"] != token_id:
+        questions.delete_many({"token": previous["token"]})
+    return previous.get("startedAt") or previous.get("createdAt")
+
+def question_recorder(request_id, token_id, kind, subject, marks, pdf_content=None, owner=None):
+    # on_question callback for the generators: persists each accepted question right away so
+    # token-status and the stream endpoint can serve it before the whole pool is finished.
+    # Once the job has been taken over the question is withdrawn and generation aborted.
+    field, counter = ("mcqs", "progress.mcqs") if kind == "mcq" else ("descriptiveQuestions", "progress.descriptive")
+    def record(item):
+        inserted = questions.insert_one(question_document(kind, item, token_id, subject, marks, pdf_content))
+        try:
+            update_job(request_id, owner, {"$push": {field: item}, "$inc": {counter: 1}}, token=token_id)
+        except JobOwnershipLost:
+            questions.delete_one({"_id": inserted.inserted_id})
+            raise
+    return record
+
+def store_job_content(content):
+    return str(job_contents.put(content.encode("utf-8"), sha256=hashlib.sha256(content.encode("utf-8")).hexdigest()))
+
+def load_job_content(content_file_id):
+    return job_contents.get(ObjectId(content_file_id)).read().decode("utf-8")
+
+def release_job_content(request_id):
+    # The job's text is kept until the job has a final status, so a retry can still read it
+    job = token_requests.find_one({"request_id": request_id, "status": {"$in": ["completed", "failed"]}},
+                                  {"params.content_file_id": 1})
+    content_file_id = job and job.get("params", {}).get("content_file_id")
+    if content_file_id:
+        job_contents.delete(ObjectId(content_file_id))
+        token_requests.update_one({"request_id": request_id}, {"$unset": {"params.content_file_id": ""}})
+
+def extract_uploaded_pdf(request_id, pdf_file_id, pdf_hash, owner=None):
+    # Runs on the generation worker, not in the upload request. The extracted text replaces the
+    # uploaded PDF in GridFS, and the job's params point at it so a retried job does not
+    # extract again. Progress writes are fenced like every other write, so a job lost to
+    # another worker stops extracting at the next page with JobOwnershipLost.
+    def on_page(done, total):
+        update_job(request_id, owner, {"$set": {"progress.pagesExtracted": done, "progress.pagesTotal": total}})
+    update_job(request_id, owner, {"$set": {"progress.stage": "extraction"}})
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+        pdf_file.write(pdf_uploads.get(ObjectId(pdf_file_id)).read())
+        pdf_file.flush()
+        pdf_content = extract_text(pdf_file.name, digest=pdf_hash, on_page=on_page)
+    logger.info(f"Extracted PDF content length: {len(pdf_content)} characters")
+    content_file_id = store_job_content(pdf_content)
+    try:
+        update_job(request_id, owner, {"$set": {"params.content_file_id": content_file_id},
+                                       "$unset": {"params.pdf_file_id": ""}})
+    except JobOwnershipLost:
+        job_contents.delete(ObjectId(content_file_id))
+        raise
+    pdf_uploads.delete(ObjectId(pdf_file_id))
+    return pdf_content
+
 # Background processing function
-def process_content(request_id, input_type, subject, text_content, pdf_content, num_mcqs, num_descriptive, mcq_marks, descriptive_marks):
+def process_content(request_id, input_type, subject, num_mcqs, num_descriptive, mcq_marks, descriptive_marks, force_regenerate=False, content_file_id=None, pdf_file_id=None, pdf_hash=None, owner=None):
+    # owner is the job-document condition that proves this process still holds the job; every
+    # write into the job is fenced on it.
+    token_id = str(uuid4())
     try:
-        token_id = str(uuid4())
         mcqs = []
         descriptive = []
 
+        started_at = start_progress(request_id, token_id, num_mcqs, num_descriptive, owner)
+        text_content = pdf_content = ""
+        if content_file_id:
+            if input_type == 'pdf':
+                pdf_content = load_job_content(content_file_id)
+            else:
+                text_content = load_job_content(content_file_id)
+        elif input_type == 'pdf' and pdf_file_id:
+            pdf_content = extract_uploaded_pdf(request_id, pdf_file_id, pdf_hash, owner)
+            if not pdf_content.strip():
+                update_job(request_id, owner, {"$set": {"status": "failed", "error": "No readable text found in the PDF"}})
+                return
+
         content_to_process = pdf_content if input_type == 'pdf' else text_content
         if not content_to_process.strip():
-            token_requests.update_one(
-                {"request_id": request_id},
-                {"$set": {"status": "failed", "error": "No valid content to process for question generation"}}
-            )
+            update_job(request_id, owner,
+                       {"$set": {"status": "failed", "error": "No valid content to process for question generation"}})
             return
 
+        cache_key, content_hash, model_version = generation_cache_key(content_to_process, num_mcqs, num_descriptive)
+        invalidate_stale_generation_cache(model_version)
+        if not force_regenerate:
+            hit = reuse_cached_pool(request_id, cache_key, token_id, subject, input_type, content_to_process,
+                                    pdf_content, mcq_marks, descriptive_marks, owner)
+            record_cache_lookup(hit)
+            if hit:
+                return
+
+        stored_pdf_content = pdf_content if input_type == 'pdf' else None
+        # Seeded from the content so a regenerated pool comes out the same, except when the
+        # teacher forced regeneration to get a different one: then a nonce is mixed in
+        seed = int(content_hash[:8], 16)
+        if force_regenerate:
+            seed ^= uuid4().int & 0xFFFFFFFF
+        analysis = DocumentAnalysis(content_to_process, seed=seed, started_at=started_at)
+        # The descriptive stage's sentence index is built while the MCQs are generated; its
+        # thread needs the models, so they are loaded here first
+        download_and_load_models()
+        if num_descriptive > 0:
+            analysis.prefetch("sentence_index")
         logger.info(f"Generating {num_mcqs} MCQs for request_id {request_id}")
-        mcqs = generate_mcqs(content_to_process, num_mcqs)
+        update_job(request_id, owner, {"$set": {"progress.stage": "mcq"}})
+        mcqs = generate_mcqs(content_to_process, num_mcqs, analysis=analysis,
+                             on_question=question_recorder(request_id, token_id, "mcq", subject, mcq_marks, owner=owner))
         logger.info(f"Generating {num_descriptive} descriptive questions for request_id {request_id}")
-        descriptive = generate_descriptive_questions(content_to_process, num_descriptive)
+        update_job(request_id, owner, {"$set": {"progress.stage": "descriptive"}})
+        descriptive = generate_descriptive_questions(
+            content_to_process, num_descriptive, analysis=analysis,
+            on_question=question_recorder(request_id, token_id, "descriptive", subject, descriptive_marks,
+                                          stored_pdf_content, owner)
+        )
+        logger.info(f"Embedding cache stats after request_id {request_id}: {embedding_cache.stats()}")
+        # Stage timings are copied once here; the pipeline's own dict can still change if a
+        # prefetched stage finishes late
+        generation_stats_report = {**analysis.metrics, "stage_seconds": dict(analysis.pipeline.timings),
+                                   "decoding_budget": analysis.budget.summary()}
+        logger.info(f"Generation stats for request_id {request_id}: {generation_stats_report}")
 
         if not mcqs and not descriptive:
-            token_requests.update_one(
-                {"request_id": request_id},
-                {"$set": {"status": "failed", "error": "Failed to generate any questions"}}
-            )
+            update_job(request_id, owner, {"$set": {"status": "failed", "error": "Failed to generate any questions"}})
             return
 
-        questions_to_insert = []
-        for mcq in mcqs:
-            questions_to_insert.append({
-                "token": token_id,
-                "type": "mcq",
-                "question": mcq['question'],
-                "options": mcq['options'],
-                "correctAnswer": mcq['correct'],
-                "correctIndex": mcq.get('correct_index', 0),
-                "marks": mcq_marks,
-                "context": mcq['context'],
-                "difficulty": mcq['difficulty'],
-                "subject": subject
-            })
-        for desc in descriptive:
-            questions_to_insert.append({
-                "token": token_id,
-                "type": "descriptive",
-                "question": desc['question'],
-                "correctAnswer": desc['answer'],
-                "marks": descriptive_marks,
-                "pdfContent": pdf_content if input_type == 'pdf' else None,
-                "context": desc['context'],
-                "difficulty": desc['difficulty'],
-                "subject": subject
-            })
-
-        if questions_to_insert:
-            questions.insert_many(questions_to_insert)
-            logger.info(f"Inserted {len(questions_to_insert)} questions for token {token_id}")
+        logger.info(f"Inserted {len(mcqs) + len(descriptive)} questions for token {token_id}")
+        update_job(request_id, owner,
+                   {"$set": {"status": "completed", "completedAt": datetime.now(), "token": token_id, "mcqs": mcqs,
+                             "descriptiveQuestions": descriptive, "progress.stage": "completed",
+                             "generationStats": generation_stats_report}},
+                   token=token_id)
         content_to_store = content_to_process
         notes.insert_one({"token": token_id, "content": content_to_store, "createdAt": datetime.now(), "inputType": input_type, "subject": subject})
         logger.info(f"Inserted note with token: {token_id}")
-
-        token_requests.update_one(
-            {"request_id": request_id},
-            {"$set": {"status": "completed", "token": token_id, "mcqs": mcqs, "descriptiveQuestions": descriptive}}
-        )
+        # Pools decoded with a reduced profile near the deadline are not reused for later uploads
+        if not analysis.budget.degraded():
+            snapshot = list(questions.find({"token": token_id}, {"_id": 0, "pdfContent": 0}))
+            generation_cache.update_one(
+                {"key": cache_key},
+                {"$set": {"key": cache_key, "contentHash": content_hash, "modelVersion": model_version, "token": token_id,
+                          "mcqs": mcqs, "descriptiveQuestions": descriptive, "questions": snapshot,
+                          "createdAt": datetime.now()}},
+                upsert=True
+            )
+    except JobOwnershipLost as e:
+        # Another worker claimed the job after this one's lease expired; it owns the result
+        logger.warning(f"Abandoning request_id {request_id}: {e}")
+        questions.delete_many({"token": token_id})
     except Exception as e:
         logger.error(f"Background processing failed for request_id {request_id}: {e}", exc_info=True)
-        token_requests.update_one(
-            {"request_id": request_id},
-            {"$set": {"status": "failed", "error": str(e)}}
+        questions.delete_many({"token": token_id})
+        result = token_requests.update_one(
+            job_filter(request_id, owner),
+            {"$set": {"status": "failed", "completedAt": datetime.now(), "error": str(e)}}
+        )
+        job_watcher.notify(request_id)
+        if pdf_file_id and result.matched_count:
+            pdf_uploads.delete(ObjectId(pdf_file_id))
+    finally:
+        release_job_content(request_id)
+
+def heartbeat_jobs(request_ids):
+    token_requests.update_many({"request_id": {"$in": request_ids}, "instance": generation_executor.instance_id},
+                               {"$set": {"heartbeatAt": datetime.now()}})
+
+def recover_when_idle():
+    threading.Thread(target=recover_pending_jobs, daemon=True).start()
+
+generation_executor = None
+if GENERATION_MODE == 'local':
+    generation_executor = GenerationExecutor(max_workers=GENERATION_WORKERS, max_queue=GENERATION_QUEUE_SIZE, default_duration=DEFAULT_JOB_SECONDS,
+                                             heartbeat=heartbeat_jobs, on_slot_free=recover_when_idle)
+
+def run_generation_job(request_id, params):
+    # Fenced on this executor: once another process has recovered the job, this one stops
+    owner = {"instance": generation_executor.instance_id}
+    token_requests.update_one(job_filter(request_id, owner), {"$set": {"startedAt": datetime.now()}})
+    process_content(request_id, owner=owner, **params)
+
+recovery_lock = threading.Lock()
+
+def recover_pending_jobs():
+    # Pending jobs whose owner stopped heartbeating were lost in a restart; claim them
+    # atomically so only one process resubmits each. Runs at startup, every
+    # GENERATION_JOB_STALE_SECONDS and whenever an executor slot frees up, and only claims
+    # while the executor has room, so the rest wait for the next run.
+    if not recovery_lock.acquire(blocking=False):
+        return
+    try:
+        _recover_pending_jobs()
+    finally:
+        recovery_lock.release()
+
+def _recover_pending_jobs():
+    cutoff = datetime.now() - GENERATION_JOB_STALE_AFTER
+    while generation_executor.has_capacity():
+        job = token_requests.find_one_and_update(
+            {"status": "pending", "mode": {"$ne": "distributed"},
+             "$or": [{"heartbeatAt": {"$lt": cutoff}}, {"heartbeatAt": {"$exists": False}}]},
+            {"$set": {"heartbeatAt": datetime.now(), "instance": generation_executor.instance_id}, "$unset": {"startedAt": ""}},
+            sort=[("createdAt", 1)]
         )
+        if not job:
+            return
+        params = job.get("params")
+        if not params:
+            token_requests.update_one(
+                {"request_id": job["request_id"]},
+                {"$set": {"status": "failed", "error": "Generation was interrupted by a server restart"}}
+            )
+            continue
+        try:
+            generation_executor.submit(job["request_id"], run_generation_job, job["request_id"], params)
+            logger.info(f"Recovered pending generation job {job['request_id']}")
+        except QueueFullError:
+            token_requests.update_one({"request_id": job["request_id"]}, {"$unset": {"heartbeatAt": ""}})
+            return
+
+def queue_status(request_data):
+    position, eta = None, None
+    if generation_executor is not None:
+        position, eta = generation_executor.status(request_data["request_id"])
+    if position is None:
+        if request_data.get("startedAt"):
+            return 0, None
+        ahead = token_requests.count_documents({
+            "status": "pending",
+            "mode": request_data.get("mode", GENERATION_MODE),
+            "startedAt": {"$exists": False},
+            "createdAt": {"$lt": request_data["createdAt"]}
+        })
+        return ahead + 1, None
+    return position, eta
+
+def distributed_job_duration(sample=20):
+    # Mean wall time of the latest distributed jobs, as GenerationExecutor measures it locally
+    recent = list(token_requests.find(
+        {"mode": "distributed", "status": "completed", "startedAt": {"$exists": True}, "completedAt": {"$exists": True}},
+        {"startedAt": 1, "completedAt": 1}
+    ).sort("completedAt", -1).limit(sample))
+    if not recent:
+        return DEFAULT_JOB_SECONDS
+    return sum((job["completedAt"] - job["startedAt"]).total_seconds() for job in recent) / len(recent)
+
+def check_distributed_capacity():
+    queued = token_requests.count_documents({"status": "pending", "mode": "distributed", "startedAt": {"$exists": False}})
+    if queued >= GENERATION_QUEUE_SIZE:
+        workers = live_workers(generation_workers)
+        raise QueueFullError(int(distributed_job_duration() * max(1, queued) / max(1, workers)))
+    return queued + 1
+
+def recover_periodically():
+    while True:
+        try:
+            recover_pending_jobs()
+        except Exception as e:
+            logger.error(f"Recovering pending generation jobs failed: {e}")
+        time.sleep(GENERATION_JOB_STALE_AFTER.total_seconds())
+
+if GENERATION_MODE == 'local':
+    threading.Thread(target=recover_periodically, daemon=True).start()
 
 @app.route('/api/setup-user', methods=['POST'])
 def setup_user():
@@ -466,28 +801,21 @@ def upload_content():
         return jsonify({"error": "Invalid input type. Must be 'text' or 'pdf'"}), 400
 
     text_content = ""
-    pdf_content = ""
 
     if input_type == 'pdf':
         if 'pdf' not in request.files:
             return jsonify({"error": "No PDF file provided"}), 400
         pdf_file = request.files['pdf']
-        logger.info(f"Processing PDF file: {pdf_file.filename}")
-        try:
-            with pdfplumber.open(pdf_file) as pdf:
-                pdf_content = ''.join(page.extract_text() or '' for page in pdf.pages)
-            logger.info(f"Extracted PDF content length: {len(pdf_content)} characters")
-            if not pdf_content.strip():
-                return jsonify({"error": "No readable text found in the PDF"}), 400
-        except Exception as e:
-            logger.error(f"Failed to extract PDF content: {e}")
-            return jsonify({"error": f"Failed to process PDF: {e}"}), 400
+        logger.info(f"Received PDF file: {pdf_file.filename}")
+        pdf_bytes = pdf_file.read()
+        if not pdf_bytes.startswith(b'%PDF'):
+            return jsonify({"error": "Failed to process PDF: not a PDF file"}), 400
     else:
         text_content = request.form.get('textContent', '')
         if not text_content:
             return jsonify({"error": "No text content provided"}), 400
-        if len(text_content.split()) > 3000:
-            return jsonify({"error": "Text exceeds 3000 words limit"}), 400
+        if len(text_content.split()) > MAX_TEXT_WORDS:
+            return jsonify({"error": f"Text exceeds {MAX_TEXT_WORDS} words limit"}), 400
 
     try:
         num_mcqs = int(request.form.get('numMCQs', 5))
@@ -500,19 +828,57 @@ def upload_content():
         return jsonify({"error": "Invalid numeric parameters"}), 400
 
     request_id = str(uuid4())
-    token_requests.insert_one({
-        "request_id": request_id,
-        "status": "pending",
-        "createdAt": datetime.now()
-    })
-
-    thread = threading.Thread(
-        target=process_content,
-        args=(request_id, input_type, subject, text_content, pdf_content, num_mcqs, num_descriptive, mcq_marks, descriptive_marks)
-    )
-    thread.start()
-
-    return jsonify({"request_id": request_id}), 202
+    pdf_file_id = None
+    pdf_hash = None
+    if input_type == 'pdf':
+        # Text extraction happens on the generation worker; the file waits in GridFS until then
+        pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+        pdf_file_id = str(pdf_uploads.put(pdf_bytes, filename=pdf_file.filename, sha256=pdf_hash))
+    # Job documents only reference the content: text goes to GridFS now, PDFs wait there
+    # until the worker extracts them
+    content_file_id = store_job_content(text_content) if input_type == 'text' else None
+    params = {
+        "input_type": input_type,
+        "subject": subject,
+        "content_file_id": content_file_id,
+        "num_mcqs": num_mcqs,
+        "num_descriptive": num_descriptive,
+        "mcq_marks": mcq_marks,
+        "descriptive_marks": descriptive_marks,
+        "force_regenerate": request.form.get('forceRegenerate', 'false').lower() in ['true', '1', 'yes'],
+        "pdf_file_id": pdf_file_id,
+        "pdf_hash": pdf_hash
+    }
+    try:
+        if GENERATION_MODE == 'distributed':
+            position = check_distributed_capacity()
+        token_requests.insert_one({
+            "request_id": request_id,
+            "status": "pending",
+            "createdAt": datetime.now(),
+            "heartbeatAt": datetime.now(),
+            "mode": GENERATION_MODE,
+            "instance": generation_executor.instance_id if generation_executor else None,
+            "attempts": 0,
+            "params": params
+        })
+        if GENERATION_MODE != 'distributed':
+            try:
+                position = generation_executor.submit(request_id, run_generation_job, request_id, params)
+            except QueueFullError:
+                token_requests.delete_one({"request_id": request_id})
+                raise
+    except QueueFullError as e:
+        if pdf_file_id:
+            pdf_uploads.delete(ObjectId(pdf_file_id))
+        if content_file_id:
+            job_contents.delete(ObjectId(content_file_id))
+        logger.warning(f"Generation queue full, rejecting upload (retry after {e.retry_after}s)")
+        response = jsonify({"error": "The server is busy generating questions, please try again shortly", "retryAfter": e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
+    return jsonify({"request_id": request_id, "queuePosition": position}), 202
 
 @app.route('/api/token-status/<request_id>', methods=['GET'])
 def token_status(request_id):
@@ -529,7 +895,16 @@ def token_status(request_id):
 
     status = request_data.get("status")
     if status == "pending":
-        return jsonify({"status": "pending"}), 200
+        position, eta = queue_status(request_data)
+        return jsonify({
+            "status": "pending",
+            "queuePosition": position,
+            "etaSeconds": eta,
+            "token": request_data.get("token"),
+            "progress": request_data.get("progress"),
+            "mcqs": request_data.get("mcqs", []),
+            "descriptiveQuestions": request_data.get("descriptiveQuestions", [])
+        }), 200
     elif status == "completed":
         return jsonify({
             "status": "completed",
@@ -540,6 +915,139 @@ def token_status(request_id):
     elif status == "failed":
         return jsonify({"status": "failed", "error": request_data.get("error")}), 500
 
+def sse_event(event, data, event_id=None):
+    message = f"event: {event}\ndata: {json.dumps(data, default=mongo_to_json)}\n\n"
+    return f"id: {event_id}\n{message}" if event_id is not None else message
+
+@app.route('/api/token-stream/<request_id>/ticket', methods=['POST'])
+def stream_ticket(request_id):
+    # EventSource cannot send headers, so the stream is opened with a ticket in its URL rather
+    # than the session JWT. A ticket only opens this request's stream and expires after
+    # STREAM_TICKET_LIFETIME, so one that ends up in an access log is of no use.
+    auth_token = request.headers.get('Authorization')
+    if not auth_token or not auth_token.startswith('Bearer '):
+        return jsonify({"error": "No token provided"}), 401
+    payload = authenticate(auth_token[7:])
+    if not payload or payload['role'] != 'teacher':
+        return jsonify({"error": "Unauthorized"}), 403
+    if not token_requests.find_one({"request_id": request_id}, {"_id": 1}):
+        return jsonify({"error": "Request not found"}), 404
+    ticket = encode({"purpose": "token-stream", "request_id": request_id, "id": payload['id'],
+                     "exp": int(time.time() + STREAM_TICKET_LIFETIME.total_seconds())}, JWT_SECRET, algorithm="HS256")
+    return jsonify({"ticket": ticket, "expiresIn": int(STREAM_TICKET_LIFETIME.total_seconds())}), 200
+
+def authenticate_stream(request_id):
+    ticket = request.args.get('ticket')
+    if ticket:
+        try:
+            payload = decode(ticket, JWT_SECRET, algorithms=["HS256"])
+        except Exception as e:
+            logger.error(f"Stream ticket rejected: {e}")
+            return False
+        return payload.get("purpose") == "token-stream" and payload.get("request_id") == request_id
+    header = request.headers.get('Authorization')
+    payload = authenticate(header[7:]) if header and header.startswith('Bearer ') else None
+    return bool(payload) and payload['role'] == 'teacher'
+
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONNECTIONS)
+
+@app.route('/api/token-stream/<request_id>', methods=['GET'])
+def token_stream(request_id):
+    # Server-Sent Events version of token-status, authenticated with a ticket from
+    # stream_ticket (or the Authorization header, for clients that can send one). Event ids
+    # are "<token>:<mcqs sent>:<descriptive sent>" so a reconnecting client resumes from
+    # Last-Event-ID, or ?lastEventId= when it reconnects with a new ticket, instead of
+    # receiving every question again. The handler sleeps on job_watcher between updates.
+    if not authenticate_stream(request_id):
+        return jsonify({"error": "Unauthorized"}), 403
+    job = token_requests.find_one({"request_id": request_id}, {"_id": 1})
+    if not job:
+        return jsonify({"error": "Request not found"}), 404
+    if not stream_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open streams, poll token-status instead"})
+        response.headers['Retry-After'] = str(STREAM_KEEPALIVE_INTERVAL)
+        return response, 503
+
+    resume_token, resume_mcqs, resume_descriptive = None, 0, 0
+    last_event_id = (request.headers.get('Last-Event-ID') or request.args.get('lastEventId', '')).split(':')
+    if len(last_event_id) == 3 and last_event_id[1].isdigit() and last_event_id[2].isdigit():
+        resume_token, resume_mcqs, resume_descriptive = last_event_id[0], int(last_event_id[1]), int(last_event_id[2])
+    job_watcher.watch(request_id, job["_id"])
+
+    def events():
+        token_id, sent_mcqs, sent_descriptive = resume_token, resume_mcqs, resume_descriptive
+        last_progress = None
+        last_write = time.time()
+        version = job_watcher.version(request_id)
+        while True:
+            request_data = token_requests.find_one({"request_id": request_id})
+            if not request_data:
+                yield sse_event("failed", {"error": "Request not found"})
+                return
+            if request_data.get("token") != token_id:
+                # A retried job starts over under a new token; earlier questions were discarded
+                if token_id is not None and request_data.get("token"):
+                    yield sse_event("reset", {"token": request_data.get("token")})
+                token_id = request_data.get("token")
+                sent_mcqs = sent_descriptive = 0
+            for item in request_data.get("mcqs", [])[sent_mcqs:]:
+                sent_mcqs += 1
+                yield sse_event("question", {"type": "mcq", **item}, f"{token_id}:{sent_mcqs}:{sent_descriptive}")
+                last_write = time.time()
+            for item in request_data.get("descriptiveQuestions", [])[sent_descriptive:]:
+                sent_descriptive += 1
+                yield sse_event("question", {"type": "descriptive", **item}, f"{token_id}:{sent_mcqs}:{sent_descriptive}")
+                last_write = time.time()
+            status = request_data.get("status")
+            if status == "completed":
+                yield sse_event("completed", {"token": token_id, "progress": request_data.get("progress")})
+                return
+            if status == "failed":
+                yield sse_event("failed", {"error": request_data.get("error")})
+                return
+            position, eta = queue_status(request_data)
+            progress = {"status": status, "queuePosition": position, "etaSeconds": eta, "progress": request_data.get("progress")}
+            if progress != last_progress:
+                yield sse_event("progress", progress)
+                last_progress = progress
+                last_write = time.time()
+            elif time.time() - last_write >= STREAM_KEEPALIVE_INTERVAL:
+                yield ": keepalive\n\n"
+                last_write = time.time()
+            # The queue position can change without the job changing, so it is refreshed at
+            # least once per keepalive interval
+            version = job_watcher.wait(request_id, version, STREAM_KEEPALIVE_INTERVAL)
+
+    def release():
+        job_watcher.unwatch(request_id, job["_id"])
+        stream_slots.release()
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(release)
+    return response
+
+@app.route('/api/generation-cache/stats', methods=['GET'])
+def generation_cache_stats():
+    auth_token = request.headers.get('Authorization')
+    if not auth_token or not auth_token.startswith('Bearer '):
+        return jsonify({"error": "No token provided"}), 401
+    payload = authenticate(auth_token[7:])
+    if not payload or payload['role'] != 'teacher':
+        return jsonify({"error": "Unauthorized"}), 403
+    stats = generation_stats.find_one({"_id": "result_cache"}) or {}
+    hits = stats.get("hits", 0)
+    misses = stats.get("misses", 0)
+    return jsonify({
+        "hits": hits,
+        "misses": misses,
+        "hitRate": round(hits / (hits + misses), 4) if hits + misses else 0,
+        "entries": generation_cache.count_documents({}),
+        "embeddingCache": embedding_cache.stats(),
+        "distractorCache": distractor_cache.stats(),
+        "generationSchedulers": scheduler_stats()
+    }), 200
+
 @app.route('/api/teacher/questions/<token>', methods=['GET'])
 def get_questions(token):
     auth_token = request.headers.get('Authorization')
@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class JobWatcher:
+    # Wakes the handlers streaming a job when its document changes, so they do not each poll
+    # Mongo. Writes made by this process call notify() directly; writes from other processes
+    # (distributed workers, other web instances) arrive through a change stream on the
+    # collection, or where the deployment has none (a standalone mongod), through a single
+    # query per poll_interval covering every watched job.
+    def __init__(self, collection, poll_interval=1.0):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._watchers = {}
+        self._versions = {}
+        self._document_ids = {}
+        self._seen = {}
+        self._thread = None
+
+    def watch(self, request_id, document_id):
+        with self._condition:
+            self._watchers[request_id] = self._watchers.get(request_id, 0) + 1
+            self._versions.setdefault(request_id, 0)
+            self._document_ids[document_id] = request_id
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="job-watcher", daemon=True)
+                self._thread.start()
+
+    def unwatch(self, request_id, document_id):
+        with self._condition:
+            self._watchers[request_id] -= 1
+            if not self._watchers[request_id]:
+                del self._watchers[request_id]
+                del self._versions[request_id]
+                self._document_ids.pop(document_id, None)
+                self._seen.pop(request_id, None)
+
+    def version(self, request_id):
+        with self._condition:
+            return self._versions.get(request_id, 0)
+
+    def notify(self, request_id):
+        with self._condition:
+            if request_id in self._versions:
+                self._versions[request_id] += 1
+                self._condition.notify_all()
+
+    def wait(self, request_id, version, timeout):
+        # Blocks until the job changed since `version` was read, or for at most timeout
+        # seconds; returns the current version
+        with self._condition:
+            self._condition.wait_for(lambda: self._versions.get(request_id, version) != version, timeout)
+            return self._versions.get(request_id, version)
+
+    def _run(self):
+        try:
+            with self.collection.watch([{"$project": {"documentKey": 1}}]) as stream:
+                logger.info("Following job updates through the change stream")
+                for change in stream:
+                    with self._condition:
+                        request_id = self._document_ids.get(change["documentKey"]["_id"])
+                    if request_id is not None:
+                        self.notify(request_id)
+        except Exception as e:
+            logger.info(f"No change stream for job updates ({e}), polling every {self.poll_interval}s")
+        while True:
+            try:
+                self._poll()
+            except Exception as e:
+                logger.error(f"Polling job updates failed: {e}")
+            time.sleep(self.poll_interval)
+
+    def _poll(self):
+        with self._condition:
+            request_ids = list(self._watchers)
+        if not request_ids:
+            return
+        documents = self.collection.find({"request_id": {"$in": request_ids}},
+                                         {"_id": 0, "request_id": 1, "status": 1, "token": 1, "progress": 1})
+        for document in documents:
+            request_id = document.pop("request_id")
+            with self._condition:
+                changed = request_id in self._watchers and self._seen.get(request_id) != document
+                if changed:
+                    self._seen[request_id] = document
+            if changed:
+                self.notify(request_id)
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from collections import deque
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Generation queue is full, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class GenerationExecutor:
+    # Fixed pool of worker threads in front of a bounded FIFO. submit() raises QueueFullError
+    # instead of queueing past max_queue, and heartbeat(job_ids) is called periodically with
+    # every queued or running job so other processes can tell these jobs are still owned.
+    # on_slot_free() is called after each job finishes.
+    def __init__(self, max_workers=1, max_queue=8, default_duration=180, heartbeat=None, heartbeat_interval=30,
+                 on_slot_free=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.default_duration = default_duration
+        self.on_slot_free = on_slot_free
+        self.instance_id = str(uuid4())
+        self._queue = deque()
+        self._running = {}
+        self._durations = deque(maxlen=20)
+        self._condition = threading.Condition()
+        for _ in range(max_workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        if heartbeat is not None:
+            threading.Thread(target=self._heartbeat, args=(heartbeat, heartbeat_interval), daemon=True).start()
+
+    def average_duration(self):
+        with self._condition:
+            if not self._durations:
+                return self.default_duration
+            return sum(self._durations) / len(self._durations)
+
+    def retry_after(self):
+        with self._condition:
+            waiting = len(self._queue) + len(self._running)
+        return int(self.average_duration() * max(1, waiting) / self.max_workers)
+
+    def has_capacity(self):
+        with self._condition:
+            return len(self._queue) < self.max_queue
+
+    def submit(self, job_id, fn, *args, **kwargs):
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(self.retry_after())
+            self._queue.append((job_id, fn, args, kwargs))
+            self._condition.notify()
+            return len(self._queue)
+
+    def jobs(self):
+        with self._condition:
+            return [job[0] for job in self._queue] + list(self._running)
+
+    def status(self, job_id):
+        # (queue position, estimated seconds until done); position 0 means running, None means
+        # the job is not owned by this executor
+        average = self.average_duration()
+        now = time.time()
+        with self._condition:
+            if job_id in self._running:
+                return 0, max(0, int(average - (now - self._running[job_id])))
+            for index, job in enumerate(self._queue):
+                if job[0] == job_id:
+                    running_left = sorted(max(0.0, average - (now - started)) for started in self._running.values())
+                    first_free = running_left[0] if len(running_left) >= self.max_workers else 0
+                    rounds = index // self.max_workers
+                    return index + 1, int(first_free + (rounds + 1) * average)
+        return None, None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                job_id, fn, args, kwargs = self._queue.popleft()
+                self._running[job_id] = time.time()
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                logger.exception(f"Generation job {job_id} failed")
+            finally:
+                with self._condition:
+                    started = self._running.pop(job_id)
+                    self._durations.append(time.time() - started)
+            if self.on_slot_free is not None:
+                try:
+                    self.on_slot_free()
+                except Exception:
+                    logger.exception("on_slot_free callback failed")
+
+    def _heartbeat(self, heartbeat, interval):
+        while True:
+            time.sleep(interval)
+            job_ids = self.jobs()
+            if job_ids:
+                try:
+                    heartbeat(job_ids)
+                except Exception as e:
+                    logger.error(f"Job heartbeat failed: {e}")
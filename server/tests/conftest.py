@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The server modules are imported as the top-level `ai` package, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,90 @@
+import threading
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from ai.inference_backend import GenerationBackend, TorchBackend
+
+# A randomly initialised two-layer T5 with a word-level tokenizer, built in memory so the
+# parity checks need no downloads. The outputs are nonsense, but every backend has to
+# produce the same nonsense.
+WORDS = ("summarize question answer context the a of cell energy plant light water is in "
+         "and produces mitochondria photosynthesis force motion law newton first").split()
+PROMPTS = [
+    "summarize the plant produces energy in light",
+    "question context the cell is the mitochondria",
+    "answer newton first law of motion and force",
+]
+DECODING = {"num_beams": 2, "num_return_sequences": 2, "no_repeat_ngram_size": 2, "max_length": 12}
+
+
+def build_tokenizer():
+    vocab = {"<pad>": 0, "</s>": 1, "<unk>": 2}
+    for word in WORDS:
+        vocab.setdefault(word, len(vocab))
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<pad>", eos_token="</s>",
+                                                unk_token="<unk>")
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    tokenizer = build_tokenizer()
+    config = transformers.T5Config(vocab_size=len(tokenizer), d_model=16, d_kv=8, d_ff=32, num_layers=2,
+                                   num_heads=2, pad_token_id=0, eos_token_id=1, decoder_start_token_id=0)
+    torch.manual_seed(0)
+    model = transformers.T5ForConditionalGeneration(config).eval()
+    directory = tmp_path_factory.mktemp("tiny-t5")
+    model.save_pretrained(directory, safe_serialization=True)
+    tokenizer.save_pretrained(directory)
+    return model, tokenizer, directory
+
+
+@pytest.fixture(scope="module")
+def torch_backend(tiny_model):
+    model, tokenizer, _ = tiny_model
+    return TorchBackend(model, tokenizer)
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        GenerationBackend()
+
+
+def test_torch_batching_matches_single_prompts(torch_backend):
+    batched = torch_backend.generate(PROMPTS, batch_size=len(PROMPTS), **DECODING)
+    single = [torch_backend.generate([prompt], batch_size=1, **DECODING)[0] for prompt in PROMPTS]
+    assert batched == single
+    assert all(len(outputs) == DECODING["num_return_sequences"] for outputs in batched)
+
+
+def test_onnx_matches_torch(tiny_model, torch_backend):
+    onnxruntime = pytest.importorskip("optimum.onnxruntime")
+    _, tokenizer, directory = tiny_model
+    # OnnxBackend is TorchBackend's generate over an exported model; build it from the tiny
+    # model directly rather than from the model store
+    exported = onnxruntime.ORTModelForSeq2SeqLM.from_pretrained(directory, export=True, use_cache=True)
+    onnx_backend = TorchBackend(exported, tokenizer)
+    assert onnx_backend.generate(PROMPTS, **DECODING) == torch_backend.generate(PROMPTS, **DECODING)
+
+
+def test_remote_matches_torch(monkeypatch, torch_backend):
+    inference_server = pytest.importorskip("ai.inference_server")
+    from ai.inference_client import InferenceClient, RemoteBackend
+    monkeypatch.setattr(inference_server.state, "ready", True)
+    monkeypatch.setattr(inference_server.state, "backend", lambda model_name: torch_backend)
+    server = inference_server.create_server(host="127.0.0.1", port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = InferenceClient(f"http://127.0.0.1:{server.server_address[1]}")
+        remote = RemoteBackend(client, "t5_question")
+        assert remote.generate(PROMPTS, **DECODING) == torch_backend.generate(PROMPTS, **DECODING)
+        assert remote.count_tokens_batch(PROMPTS) == torch_backend.count_tokens_batch(PROMPTS)
+        assert remote._fallback is None
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,86 @@
+import random
+import zlib
+import numpy as np
+import pytest
+
+from ai.dedup_index import DedupIndex
+
+BASE_QUESTIONS = [
+    "What is the main function of the mitochondria in a cell?",
+    "Which process do plants use to convert sunlight into chemical energy?",
+    "Who wrote the Declaration of Independence in 1776?",
+    "What causes the seasons to change on Earth?",
+    "How does the water cycle move water between the ocean and the atmosphere?",
+    "Why did the Roman Empire split into eastern and western halves?",
+]
+
+
+def encode_trigrams(texts):
+    # Deterministic stand-in for the sentence model: hashed character trigram counts, so
+    # questions sharing most of their text also get a high cosine similarity
+    vectors = np.zeros((len(texts), 64), dtype=np.float32)
+    for row, text in zip(vectors, texts):
+        text = text.lower()
+        for i in range(len(text) - 2):
+            row[zlib.crc32(text[i:i + 3].encode("utf-8")) % 64] += 1
+    return vectors
+
+
+def encode_unrelated(texts):
+    # Near-orthogonal embeddings, so only the string comparison, and with it the prefilter,
+    # can find a duplicate
+    return np.array([np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(512) for text in texts],
+                    dtype=np.float32)
+
+
+def levenshtein_similarity(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, start=1):
+        current = [i]
+        for j, other in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        previous = current
+    longest = max(len(a), len(b))
+    return 1 - previous[-1] / longest if longest else 1.0
+
+
+def brute_force_is_duplicate(question, accepted, threshold, encode):
+    # Every accepted question is compared, without the n-gram and length prefilter
+    embeddings = encode([question] + accepted)
+    norms = np.linalg.norm(embeddings, axis=1)
+    embeddings = embeddings / np.where(norms == 0, 1, norms)[:, None]
+    for other, embedding in zip(accepted, embeddings[1:]):
+        if levenshtein_similarity(question.lower(), other.lower()) > threshold:
+            return True
+        if float(embeddings[0] @ embedding) > threshold:
+            return True
+    return False
+
+
+def mutate(text, rng, edits):
+    chars = list(text)
+    for _ in range(edits):
+        position = rng.randrange(len(chars) + 1)
+        operation = rng.choice(["insert", "delete", "replace"])
+        if operation == "insert" or not chars:
+            chars.insert(position, rng.choice("abcdefghijklmnopqrstuvwxyz "))
+        elif position < len(chars):
+            if operation == "delete":
+                del chars[position]
+            else:
+                chars[position] = rng.choice("abcdefghijklmnopqrstuvwxyz ")
+    return "".join(chars)
+
+
+@pytest.mark.parametrize("encode", [encode_trigrams, encode_unrelated])
+@pytest.mark.parametrize("threshold", [0.85, 0.7])
+def test_is_duplicate_matches_brute_force_scan(threshold, encode):
+    rng = random.Random(7)
+    accepted = [mutate(question, rng, rng.randint(0, 4)) for question in BASE_QUESTIONS]
+    index = DedupIndex(encode, threshold=threshold)
+    index.extend(accepted)
+    # Edit counts around the threshold, where the prefilter must not drop a true match
+    queries = [mutate(rng.choice(BASE_QUESTIONS), rng, rng.randint(0, 25)) for _ in range(150)]
+    queries += ["", "What?", "An unrelated question about something else entirely?"]
+    for query in queries:
+        assert index.is_duplicate(query) == brute_force_is_duplicate(query, accepted, threshold, encode), query
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from uuid import uuid4
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+
+from ai import worker
+
+# Runs the lease protocol against a real mongod, since claim_job's correctness rests on
+# find_one_and_update being atomic across processes. Skipped when none is reachable; point
+# QG_TEST_MONGO_URI at a server whose databases may be created and dropped.
+MONGO_URI = os.getenv("QG_TEST_MONGO_URI", "mongodb://localhost:27017")
+
+
+@pytest.fixture
+def db():
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"No mongod reachable at {MONGO_URI}")
+    name = f"qmaster_test_{uuid4().hex[:8]}"
+    yield client[name]
+    client.drop_database(name)
+    client.close()
+
+
+def insert_jobs(token_requests, count):
+    now = datetime.now()
+    token_requests.insert_many([
+        {"request_id": f"job-{i}", "status": "pending", "mode": "distributed", "attempts": 0,
+         "createdAt": now + timedelta(milliseconds=i), "params": {}}
+        for i in range(count)
+    ])
+
+
+def test_concurrent_workers_claim_each_job_once(db):
+    insert_jobs(db.token_requests, 40)
+    claimed = {}
+    lock = threading.Lock()
+
+    def work(worker_id):
+        while True:
+            job = worker.claim_job(db.token_requests, worker_id)
+            if job is None:
+                return
+            with lock:
+                claimed.setdefault(job["request_id"], []).append(worker_id)
+
+    threads = [threading.Thread(target=work, args=(f"worker-{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(f"job-{i}" for i in range(40))
+    assert all(len(owners) == 1 for owners in claimed.values())
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_is_fenced(db, monkeypatch):
+    monkeypatch.setattr(worker, "WORKER_LEASE", timedelta(milliseconds=300))
+    insert_jobs(db.token_requests, 1)
+    first = worker.claim_job(db.token_requests, "worker-a")
+    assert worker.claim_job(db.token_requests, "worker-b") is None
+    time.sleep(0.4)
+    second = worker.claim_job(db.token_requests, "worker-b")
+    assert second["request_id"] == first["request_id"]
+    assert second["attempts"] == 2
+
+    # worker-a's heartbeat notices the loss, and its writes, fenced as process_content's are,
+    # match nothing while worker-b's go through
+    stop = threading.Event()
+    beat = threading.Thread(target=worker.heartbeat, args=(db.token_requests, first["request_id"], "worker-a", stop))
+    beat.start()
+    beat.join(timeout=2)
+    assert not beat.is_alive()
+    stale = db.token_requests.update_one({"request_id": first["request_id"], "worker": "worker-a"},
+                                         {"$set": {"status": "completed"}})
+    assert stale.matched_count == 0
+    current = db.token_requests.update_one({"request_id": first["request_id"], "worker": "worker-b"},
+                                           {"$set": {"status": "completed"}})
+    assert current.matched_count == 1
+
+
+def test_run_job_fences_process_content_on_the_worker(db):
+    insert_jobs(db.token_requests, 1)
+    job = worker.claim_job(db.token_requests, "worker-a")
+    calls = []
+
+    def process_content(request_id, owner=None, **params):
+        calls.append(owner)
+        db.token_requests.update_one({"request_id": request_id, **owner}, {"$set": {"status": "completed"}})
+
+    app_module = SimpleNamespace(token_requests=db.token_requests, process_content=process_content)
+    worker.run_job(app_module, job, "worker-a")
+    assert calls == [{"worker": "worker-a"}]
+    finished = db.token_requests.find_one({"request_id": job["request_id"]})
+    assert finished["status"] == "completed"
+    assert "leaseExpiresAt" not in finished
+
+
+def test_live_workers_counts_registered_workers(db):
+    stops = [threading.Event() for _ in range(3)]
+    threads = [threading.Thread(target=worker.register_worker, args=(db.generation_workers, f"worker-{i}", stop))
+               for i, stop in enumerate(stops)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 2
+    while worker.live_workers(db.generation_workers) < 3 and time.time() < deadline:
+        time.sleep(0.05)
+    assert worker.live_workers(db.generation_workers) == 3
+    stops[0].set()
+    threads[0].join()
+    assert worker.live_workers(db.generation_workers) == 2
+    for stop, thread in zip(stops[1:], threads[1:]):
+        stop.set()
+        thread.join()
+    assert worker.live_workers(db.generation_workers) == 0
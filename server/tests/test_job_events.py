@@ -0,0 +1,70 @@
+import threading
+import time
+
+from job_events import JobWatcher
+
+
+class StandaloneCollection:
+    # A token_requests stand-in without change streams, as on a standalone mongod
+    def __init__(self):
+        self.documents = {}
+        self.queries = 0
+
+    def watch(self, pipeline):
+        raise RuntimeError("The $changeStream stage is only supported on replica sets")
+
+    def find(self, query, projection):
+        self.queries += 1
+        wanted = query["request_id"]["$in"]
+        return [{"request_id": request_id, **document} for request_id, document in self.documents.items()
+                if request_id in wanted]
+
+
+def test_notify_wakes_waiting_stream():
+    watcher = JobWatcher(StandaloneCollection(), poll_interval=60)
+    watcher.watch("job-1", 1)
+    version = watcher.version("job-1")
+    woken = []
+    waiter = threading.Thread(target=lambda: woken.append(watcher.wait("job-1", version, timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    watcher.notify("job-1")
+    waiter.join(timeout=1)
+    assert woken == [version + 1]
+
+
+def test_wait_times_out_without_changes():
+    watcher = JobWatcher(StandaloneCollection(), poll_interval=60)
+    watcher.watch("job-1", 1)
+    version = watcher.version("job-1")
+    watcher.notify("job-2")
+    assert watcher.wait("job-1", version, timeout=0.05) == version
+
+
+def test_poll_covers_every_watched_job_in_one_query():
+    collection = StandaloneCollection()
+    collection.documents = {"job-1": {"status": "pending"}, "job-2": {"status": "pending"}}
+    watcher = JobWatcher(collection, poll_interval=0.02)
+    watcher.watch("job-1", 1)
+    watcher.watch("job-2", 2)
+    time.sleep(0.1)
+    before = {request_id: watcher.version(request_id) for request_id in ("job-1", "job-2")}
+    collection.documents["job-2"] = {"status": "pending", "progress": {"mcqs": 1}}
+    assert watcher.wait("job-2", before["job-2"], timeout=1) > before["job-2"]
+    assert watcher.version("job-1") == before["job-1"]
+    queries = collection.queries
+    time.sleep(0.1)
+    # One query per interval, whatever the number of open streams
+    assert collection.queries - queries <= 10
+
+
+def test_unwatch_forgets_job_after_last_stream():
+    watcher = JobWatcher(StandaloneCollection(), poll_interval=60)
+    watcher.watch("job-1", 1)
+    watcher.watch("job-1", 1)
+    watcher.unwatch("job-1", 1)
+    watcher.notify("job-1")
+    assert watcher.version("job-1") == 1
+    watcher.unwatch("job-1", 1)
+    watcher.notify("job-1")
+    assert watcher.version("job-1") == 0
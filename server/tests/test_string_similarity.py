@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+strsimpy = pytest.importorskip("strsimpy.normalized_levenshtein")
+
+from ai import string_similarity
+
+WORDS = ["", "a", "Paris", "paris", "Parish", "Lyon", "New York", "new york city", "York", "photosynthesis",
+         "Photo synthesis", "héllo", "hello", "World War II", "World War I"]
+
+
+@pytest.fixture(params=["rapidfuzz", "numpy"])
+def backend(request, monkeypatch):
+    # Both implementations must give strsimpy's scores, whichever one is installed
+    if request.param == "rapidfuzz":
+        if string_similarity._rapidfuzz_levenshtein is None:
+            pytest.skip("rapidfuzz is not installed")
+    else:
+        monkeypatch.setattr(string_similarity, "_rapidfuzz_levenshtein", None)
+    return request.param
+
+
+def expected(a, b):
+    return strsimpy.NormalizedLevenshtein().similarity(a, b)
+
+
+def test_similarity_to_many_matches_strsimpy(backend):
+    for query in WORDS:
+        scores = string_similarity.similarity_to_many(query, WORDS)
+        assert np.allclose(scores, [expected(query, word) for word in WORDS])
+
+
+def test_similarity_matrix_matches_strsimpy(backend):
+    scores = string_similarity.similarity_matrix(WORDS[:6], WORDS)
+    assert scores.shape == (6, len(WORDS))
+    assert np.allclose(scores, [[expected(query, word) for word in WORDS] for query in WORDS[:6]])
+    assert string_similarity.similarity_matrix([], WORDS).shape == (0, len(WORDS))